@@ -0,0 +1,62 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def batch_executor() -> ThreadPoolExecutor:
+    """Process-wide pool for batch generations, kept apart from live chat replies.
+
+    AI_BATCH_WORKERS bounds how many batch items run at once across all
+    requests, so a large evaluation run cannot take over the LLM providers.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'AI_BATCH_WORKERS', 4),
+                thread_name_prefix='ai-batch'
+            )
+    return _executor
+
+
+def run_batch(items: List[Any], handler: Callable[[Any], Dict[str, Any]],
+              timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Run handler over the items on the batch pool; results come back in input order.
+
+    Each result carries its index and elapsed_ms. An item whose handler
+    raises gets an error entry instead of failing the whole batch, as does
+    every item still unfinished timeout seconds after the batch started.
+    """
+    def timed(index: int, item: Any) -> Dict[str, Any]:
+        started = time.perf_counter()
+        try:
+            result = {'index': index, **handler(item)}
+        except Exception as e:
+            logger.error(f"Batch item {index} failed: {str(e)}")
+            result = {'index': index, 'error': str(e)}
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+
+    deadline = time.monotonic() + timeout if timeout else None
+    futures = [batch_executor().submit(timed, index, item) for index, item in enumerate(items)]
+    results = []
+    for index, future in enumerate(futures):
+        try:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+            results.append(future.result(timeout=remaining))
+        except FutureTimeoutError:
+            # Items not yet started are dropped; running ones finish in the background
+            future.cancel()
+            results.append({'index': index, 'error': 'timed out', 'elapsed_ms': None})
+    if deadline is not None and any(result.get('error') == 'timed out' for result in results):
+        logger.error(f"Batch of {len(items)} items passed its {timeout}s deadline")
+    return results
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Lanes in priority order: a free worker always takes the highest non-empty lane
+LANES = ('crisis', 'support', 'ai')
+
+
+class AIJob:
+    """One queued AI generation"""
+
+    __slots__ = ('lane', 'user_key', 'run', 'future', 'enqueued_at')
+
+    def __init__(self, lane: str, user_key: Any, run: Callable[[], Awaitable[Any]], future: asyncio.Future):
+        self.lane = lane
+        self.user_key = user_key
+        self.run = run
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class _Lane:
+    """Per-user FIFO queues served round-robin so one user cannot starve others"""
+
+    def __init__(self):
+        self.users: 'OrderedDict[Any, deque]' = OrderedDict()
+        self.depth = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.avg_wait = 0.0
+        self.max_wait = 0.0
+
+    def push(self, job: AIJob):
+        self.users.setdefault(job.user_key, deque()).append(job)
+        self.depth += 1
+        self.submitted += 1
+
+    def pop(self) -> Optional[AIJob]:
+        if not self.users:
+            return None
+        user_key, jobs = next(iter(self.users.items()))
+        job = jobs.popleft()
+        # Move this user behind everyone else who is waiting
+        del self.users[user_key]
+        if jobs:
+            self.users[user_key] = jobs
+        self.depth -= 1
+        return job
+
+    def record_wait(self, wait: float):
+        self.avg_wait = wait if self.completed + self.failed == 0 else 0.8 * self.avg_wait + 0.2 * wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class AIScheduler:
+    """Process-wide queue for AI replies with priority lanes and bounded concurrency.
+
+    `workers` tasks serve all lanes in priority order; `crisis_workers` extra
+    tasks serve only the crisis lane, so a crisis reply never waits behind a
+    slow generation in a busy process.
+    """
+
+    def __init__(self, workers: int = None, crisis_workers: int = None, max_depth: int = None):
+        self.workers = workers or getattr(settings, 'AI_SCHEDULER_WORKERS', 4)
+        self.crisis_workers = crisis_workers if crisis_workers is not None else \
+            getattr(settings, 'AI_SCHEDULER_CRISIS_WORKERS', 1)
+        self.max_depth = max_depth or getattr(settings, 'AI_SCHEDULER_MAX_DEPTH', 50)
+        self.shed = {lane: 0 for lane in LANES}
+        self._loop = None
+        self._reset()
+
+    def _reset(self):
+        self._lanes: Dict[str, _Lane] = {lane: _Lane() for lane in LANES}
+        self._wakeup = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = {lane: 0 for lane in LANES}
+
+    def submit(self, lane: str, user_key: Any, run: Callable[[], Awaitable[Any]]) -> asyncio.Future:
+        """Queue run() in a lane; the returned future resolves with its result"""
+        if lane not in self._lanes:
+            lane = 'ai'
+        self._ensure_workers()
+        future = self._loop.create_future()
+        self._lanes[lane].push(AIJob(lane, user_key, run, future))
+        self._wakeup.set()
+        return future
+
+    def depth(self, lane: str = None) -> int:
+        if lane is not None:
+            return self._lanes[lane].depth
+        return sum(l.depth for l in self._lanes.values())
+
+    def saturated(self, lane: str) -> bool:
+        """True when a lane is too backed up to accept more generations"""
+        return self.depth(lane if lane in self._lanes else 'ai') >= self.max_depth
+
+    def record_shed(self, lane: str):
+        """Count a reply answered from templates because the lane was saturated"""
+        self.shed[lane if lane in self.shed else 'ai'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'crisis_workers': self.crisis_workers,
+            'max_depth': self.max_depth,
+            'lanes': {
+                name: {
+                    'depth': lane.depth,
+                    'running': self.running[name],
+                    'waiting_users': len(lane.users),
+                    'submitted': lane.submitted,
+                    'completed': lane.completed,
+                    'failed': lane.failed,
+                    'shed': self.shed[name],
+                    'avg_wait_ms': round(lane.avg_wait * 1000, 1),
+                    'max_wait_ms': round(lane.max_wait * 1000, 1),
+                }
+                for name, lane in self._lanes.items()
+            }
+        }
+
+    def _ensure_workers(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # First use, or a new event loop (tests): queues from an old loop cannot run
+            self._loop = loop
+            self._reset()
+            self._wakeup = asyncio.Event()
+            self._tasks = [
+                loop.create_task(self._worker(LANES), name=f'ai-worker-{i}')
+                for i in range(self.workers)
+            ] + [
+                loop.create_task(self._worker(('crisis',)), name=f'ai-crisis-worker-{i}')
+                for i in range(self.crisis_workers)
+            ]
+
+    def _next_job(self, lanes) -> Optional[AIJob]:
+        for name in lanes:
+            job = self._lanes[name].pop()
+            if job is not None:
+                return job
+        return None
+
+    async def _worker(self, lanes):
+        while True:
+            job = self._next_job(lanes)
+            if job is None:
+                # Every idle worker wakes on a new job and re-checks the lanes it serves
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+
+            lane = self._lanes[job.lane]
+            lane.record_wait(time.monotonic() - job.enqueued_at)
+            self.running[job.lane] += 1
+            try:
+                result = await job.run()
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                lane.failed += 1
+                logger.error(f"AI job in {job.lane} lane failed: {str(e)}", exc_info=True)
+                if not job.future.done():
+                    job.future.set_exception(e)
+                    # Nobody may be awaiting the future; avoid "exception never retrieved"
+                    job.future.exception()
+            else:
+                lane.completed += 1
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.running[job.lane] -= 1
+
+
+ai_scheduler = AIScheduler()
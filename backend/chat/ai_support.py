@@ -9,41 +9,35 @@ from django.utils import timezone
 from django.conf import settings
 from users.models import CustomUser
 from .models import Message, ChatRoom
-
-# Import Google Generative AI
-try:
-    import google.generativeai as genai
-    GEMINI_AVAILABLE = True
-except ImportError:
-    GEMINI_AVAILABLE = False
-    genai = None
+from .prompt_builder import prompt_assembler
+from .singleflight import SingleFlight, prompt_key
+from .llm_router import build_llm_router
+from .memory_models import extract_topics
 
 # Import our new services
 try:
-    from .memory_service import MemoryService
+    from .memory_service import MemoryService, get_memory_service
     from .rag_service import RAGService
     ENHANCED_AI_AVAILABLE = True
 except ImportError:
     ENHANCED_AI_AVAILABLE = False
     MemoryService = None
+    get_memory_service = None
     RAGService = None
 
 logger = logging.getLogger(__name__)
 
-# Initialize Gemini AI client
-gemini_model = None
-if GEMINI_AVAILABLE and hasattr(settings, 'GEMINI_API_KEY') and settings.GEMINI_API_KEY:
-    try:
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        gemini_model = genai.GenerativeModel('gemini-1.5-flash')
-        logger.info("Gemini AI client initialized successfully")
-    except Exception as e:
-        logger.error(f"Failed to initialize Gemini AI client: {e}")
-        gemini_model = None
+# Initialize LLM providers (Gemini and/or OpenAI, whichever have API keys)
+llm_router = build_llm_router()
+if llm_router.providers:
+    logger.info(f"LLM router initialized with providers: {[p.name for p in llm_router.providers]}")
+
+# Concurrent identical prompts share one in-flight LLM call
+llm_singleflight = SingleFlight()
 
 # Initialize services
 if ENHANCED_AI_AVAILABLE:
-    memory_service = MemoryService()
+    memory_service = get_memory_service()
     rag_service = RAGService()
 else:
     memory_service = None
@@ -67,6 +61,29 @@ CRISIS_KEYWORDS = {
     ]
 }
 
+# Phrases that mark a request for information rather than emotional support
+INFORMATIONAL_KEYWORDS = [
+    'list', 'what are', 'tell me about', 'explain', 'describe', 'causes of',
+    'symptoms of', 'types of', 'examples of', 'how to', 'ways to', 'methods',
+    'techniques', 'strategies for', 'signs of', 'reasons for', 'factors',
+    'what causes', 'why do', 'what is', 'define', 'difference between'
+]
+
+# Crisis screening ignores messages asking for information about these topics
+INFORMATIONAL_QUERY_PATTERNS = INFORMATIONAL_KEYWORDS + [
+    'help me understand', 'can you explain', 'information about'
+]
+
+# Medium-risk keywords only count in first-person or urgent context
+PERSONAL_INDICATORS = ['i am', 'i feel', 'i have', 'i\'m', 'my', 'me']
+URGENT_INDICATORS = ['right now', 'currently', 'today', 'this moment', 'can\'t']
+
+# High-risk keywords alongside these make a message critical
+IMMEDIATE_DANGER_INDICATORS = [
+    'right now', 'tonight', 'today', 'going to', 'plan to',
+    'have the', 'ready to', 'can\'t wait'
+]
+
 # Positive keywords for mood detection
 POSITIVE_KEYWORDS = [
     'happy', 'good', 'great', 'wonderful', 'excited', 'joyful', 'grateful',
@@ -197,17 +214,8 @@ def detect_crisis_keywords(text: str) -> List[str]:
     text_lower = text.lower()
     detected_keywords = []
     
-    # First check if this is an informational query - these should NOT trigger crisis
-    informational_patterns = [
-        'list', 'what are', 'tell me about', 'explain', 'describe', 'causes of',
-        'symptoms of', 'types of', 'examples of', 'how to', 'ways to', 'methods',
-        'techniques', 'strategies for', 'signs of', 'reasons for', 'factors',
-        'what causes', 'why do', 'what is', 'define', 'difference between',
-        'help me understand', 'can you explain', 'information about'
-    ]
-    
     # If this is an informational query, don't trigger crisis detection
-    if any(pattern in text_lower for pattern in informational_patterns):
+    if any(pattern in text_lower for pattern in INFORMATIONAL_QUERY_PATTERNS):
         return []
     
     # Check for high-risk keywords first
@@ -221,11 +229,8 @@ def detect_crisis_keywords(text: str) -> List[str]:
             if keyword in text_lower:
                 # Additional context check for medium-risk keywords
                 # Only flag as crisis if used in first person or urgent context
-                personal_indicators = ['i am', 'i feel', 'i have', 'i\'m', 'my', 'me']
-                urgent_indicators = ['right now', 'currently', 'today', 'this moment', 'can\'t']
-                
-                if (any(indicator in text_lower for indicator in personal_indicators) or 
-                    any(indicator in text_lower for indicator in urgent_indicators)):
+                if (any(indicator in text_lower for indicator in PERSONAL_INDICATORS) or 
+                    any(indicator in text_lower for indicator in URGENT_INDICATORS)):
                     detected_keywords.append(keyword)
     
     return detected_keywords
@@ -364,14 +369,8 @@ def check_message_urgency(message: str) -> str:
     """Determine the urgency level of a message."""
     text_lower = message.lower()
     
-    # Check for immediate danger indicators
-    immediate_danger = [
-        'right now', 'tonight', 'today', 'going to', 'plan to',
-        'have the', 'ready to', 'can\'t wait'
-    ]
-    
     high_risk_present = any(keyword in text_lower for keyword in CRISIS_KEYWORDS['high_risk'])
-    immediate_indicators = any(phrase in text_lower for phrase in immediate_danger)
+    immediate_indicators = any(phrase in text_lower for phrase in IMMEDIATE_DANGER_INDICATORS)
     
     if high_risk_present and immediate_indicators:
         return 'critical'
@@ -382,6 +381,74 @@ def check_message_urgency(message: str) -> str:
     else:
         return 'low'
 
+def _phrase_pattern(phrases: List[str]) -> 're.Pattern':
+    # Longest first, so a phrase is never shadowed by a shorter one at the same position
+    alternatives = '|'.join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True))
+    return re.compile(f"(?=({alternatives}))")
+
+
+class CrisisScreener:
+    """Crisis keyword, urgency and sentiment screening with precompiled patterns.
+
+    Gives the same answers as detect_crisis_keywords, check_message_urgency
+    and analyze_sentiment, but scans each message once per phrase list instead
+    of once per phrase, which is what makes screening thousands of messages at
+    a time cheap.
+    """
+
+    def __init__(self):
+        self.informational = _phrase_pattern(INFORMATIONAL_QUERY_PATTERNS)
+        self.context = _phrase_pattern(PERSONAL_INDICATORS + URGENT_INDICATORS)
+        self.immediate = _phrase_pattern(IMMEDIATE_DANGER_INDICATORS)
+        self.levels = {level: _phrase_pattern(keywords) for level, keywords in CRISIS_KEYWORDS.items()}
+        self.positive = _phrase_pattern(POSITIVE_KEYWORDS)
+
+    @staticmethod
+    def _matches(pattern: 're.Pattern', text: str) -> set:
+        return {match.group(1) for match in pattern.finditer(text)}
+
+    def screen(self, text: str) -> Dict[str, Any]:
+        text_lower = text.lower()
+        found = {level: self._matches(pattern, text_lower) for level, pattern in self.levels.items()}
+        high = [keyword for keyword in CRISIS_KEYWORDS['high_risk'] if keyword in found['high_risk']]
+        medium = [keyword for keyword in CRISIS_KEYWORDS['medium_risk'] if keyword in found['medium_risk']]
+
+        if self.informational.search(text_lower):
+            keywords = []
+        elif high:
+            keywords = high
+        elif medium and self.context.search(text_lower):
+            keywords = medium
+        else:
+            keywords = []
+
+        if high:
+            urgency = 'critical' if self.immediate.search(text_lower) else 'high'
+        else:
+            urgency = 'medium' if medium else 'low'
+
+        positive_count = len(self._matches(self.positive, text_lower))
+        negative_count = sum(len(matches) for matches in found.values())
+        if negative_count > positive_count:
+            sentiment = 'crisis' if high else 'negative' if medium else 'slightly_negative'
+        elif positive_count > negative_count:
+            sentiment = 'positive'
+        else:
+            sentiment = 'neutral'
+
+        return {
+            'is_crisis': bool(keywords),
+            'keywords_detected': keywords,
+            'urgency_level': urgency,
+            'sentiment': sentiment,
+        }
+
+    def screen_many(self, texts: List[str]) -> List[Dict[str, Any]]:
+        return [self.screen(text) for text in texts]
+
+
+crisis_screener = CrisisScreener()
+
 def generate_safety_plan_suggestions(user_context: Dict = None) -> List[str]:
     """Generate personalized safety plan suggestions."""
     suggestions = [
@@ -440,155 +507,44 @@ def get_breathing_exercise() -> Dict[str, Any]:
 
 def generate_gemini_response(message: str, user_context: Dict = None, 
                            relevant_knowledge: List[Dict] = None,
-                           crisis_detected: bool = False) -> str:
-    """Generate AI response using Google Gemini"""
-    global gemini_model
-    
-    if not gemini_model or not GEMINI_AVAILABLE:
+                           crisis_detected: bool = False,
+                           history: List[Dict] = None) -> str:
+    """Generate AI response using the configured LLM providers (Gemini/OpenAI)"""
+    if not llm_router.providers:
         # Fallback to template response
         return get_ai_response(message, crisis_detected, user_context)
     
     try:
         # Handle crisis situations with priority
         if crisis_detected:
-            crisis_keywords = detect_crisis_keywords(message)
-            prompt = f"""You are a compassionate mental health support AI. The user has expressed concerning content that suggests they may be in crisis.
-
-CRITICAL: This user has mentioned: {', '.join(crisis_keywords[:3])}
-
-Please provide an immediate, caring response that:
-1. Acknowledges their pain with empathy
-2. Provides immediate crisis resources (988 Suicide Prevention Lifeline, Crisis Text Line: Text HOME to 741741, Emergency: 911)
-3. Encourages them to seek immediate help
-4. Does NOT provide therapy or attempt to solve their problems
-5. Keeps the response under 300 words
-
-User message: "{message}"
-
-Remember: Safety first, provide resources, encourage professional help."""
+            assembled = prompt_assembler.build(
+                message,
+                mode='crisis',
+                crisis_keywords=detect_crisis_keywords(message)
+            )
+            logger.debug(f"Prompt assembled: {assembled.as_dict()}")
 
-            response = gemini_model.generate_content(prompt)
-            return response.text if response and response.text else random.choice(CRISIS_RESPONSES)
+            response_text = _generate_llm_text(assembled)
+            return response_text if response_text else random.choice(CRISIS_RESPONSES)
         
         # Detect if user is asking for specific information/lists
-        informational_keywords = [
-            'list', 'what are', 'tell me about', 'explain', 'describe', 'causes of',
-            'symptoms of', 'types of', 'examples of', 'how to', 'ways to', 'methods',
-            'techniques', 'strategies for', 'signs of', 'reasons for', 'factors',
-            'what causes', 'why do', 'what is', 'define', 'difference between'
-        ]
-        
-        is_informational_query = any(keyword in message.lower() for keyword in informational_keywords)
-        
-        # Build context for non-crisis responses
-        context_parts = []
-        
-        if user_context:
-            if user_context.get('recent_memories'):
-                memories = user_context['recent_memories'][:2]  # Limit to recent memories
-                context_parts.append(f"User's recent context: {', '.join([m['content'][:50] + '...' for m in memories])}")
-            
-            if user_context.get('effective_strategies'):
-                strategies = user_context['effective_strategies'][:3]
-                context_parts.append(f"Strategies that have helped this user before: {', '.join(strategies)}")
-            
-            if user_context.get('preferred_tone'):
-                context_parts.append(f"User prefers {user_context['preferred_tone']} communication style")
-        
-        # Add relevant knowledge
-        knowledge_context = []
-        if relevant_knowledge:
-            for knowledge in relevant_knowledge[:2]:  # Use top 2 knowledge items
-                if knowledge.get('source') == 'knowledge_base':
-                    title = knowledge.get('metadata', {}).get('title', 'Mental Health Information')
-                    content_preview = knowledge.get('content', '')[:200] + '...'
-                    knowledge_context.append(f"{title}: {content_preview}")
-        
-        # Construct the main prompt based on query type
-        if is_informational_query:
-            # For informational queries, prioritize comprehensive answers
-            prompt_parts = [
-                "You are Hope, a knowledgeable mental health support AI assistant.",
-                "",
-                "The user is asking for specific information. Your role:",
-                "- Provide accurate, comprehensive, and well-organized information",
-                "- Answer the question directly and completely",
-                "- Use bullet points or numbered lists when appropriate",
-                "- Include practical examples and actionable advice",
-                "- Maintain a helpful and professional tone",
-                "- You may provide longer responses (up to 300 words) for informational content",
-                "",
-                "Guidelines:",
-                "- Answer the specific question asked",
-                "- Provide factual, evidence-based information",
-                "- Organize information clearly (use lists, bullet points, or categories)",
-                "- Include practical examples where relevant",
-                "- Always mention when professional help is recommended",
-                "- Do NOT deflect to emotional support when specific information is requested",
-                ""
-            ]
-        else:
-            # For emotional support, keep responses concise and supportive
-            prompt_parts = [
-                "You are Hope, a compassionate mental health support AI assistant.",
-                "",
-                "Your role:",
-                "- Provide emotional support and validation",
-                "- Share evidence-based coping strategies",
-                "- Encourage professional help when appropriate",
-                "- Maintain a warm, empathetic, and non-judgmental tone",
-                "",
-                "Guidelines:",
-                "- You are NOT a therapist and cannot provide therapy or medical advice",
-                "- Always prioritize user safety",
-                "- Encourage professional help for serious mental health concerns",
-                "- Keep responses between 50-80 words (2-3 sentences maximum)",
-                "- Use supportive emojis sparingly and appropriately",
-                "- Be concise but warm and empathetic",
-                ""
-            ]
-        
-        if context_parts:
-            prompt_parts.extend([
-                "User context:",
-                *[f"- {context}" for context in context_parts],
-                ""
-            ])
-        
-        if knowledge_context:
-            prompt_parts.extend([
-                "Relevant mental health information:",
-                *[f"- {knowledge}" for knowledge in knowledge_context],
-                ""
-            ])
-        
-        # Add specific instructions based on query type
-        if is_informational_query:
-            prompt_parts.append("The user is asking for specific information. Please provide a comprehensive, well-organized answer that directly addresses their question.")
-        else:
-            # Analyze sentiment for appropriate response tone
-            sentiment = analyze_sentiment(message)
-            if sentiment['sentiment'] in ['negative', 'slightly_negative']:
-                prompt_parts.append("The user seems to be struggling. Please provide gentle support and practical coping strategies.")
-            elif sentiment['sentiment'] == 'positive':
-                prompt_parts.append("The user seems to be in a better mood. Reinforce their positive feelings while remaining supportive.")
-            else:
-                prompt_parts.append("Provide supportive guidance based on what the user has shared.")
-        
-        prompt_parts.extend([
-            "",
-            f'User message: "{message}"',
-            "",
-            "Please respond appropriately based on the type of question asked."
-        ])
-        
-        prompt = "\n".join(prompt_parts)
+        is_informational_query = any(keyword in message.lower() for keyword in INFORMATIONAL_KEYWORDS)
+        
+        assembled = prompt_assembler.build(
+            message,
+            mode='informational' if is_informational_query else 'supportive',
+            sentiment='neutral' if is_informational_query else analyze_sentiment(message)['sentiment'],
+            user_context=user_context,
+            relevant_knowledge=relevant_knowledge,
+            history=history
+        )
+        logger.debug(f"Prompt assembled: {assembled.as_dict()}")
         
-        # Generate response with Gemini
-        response = gemini_model.generate_content(prompt)
+        # Generate response with the fastest available provider
+        response_text = _generate_llm_text(assembled)
         
-        if response and response.text:
-            generated_text = response.text.strip()
+        if response_text:
+            generated_text = response_text.strip()
             
             # Safety check - if response seems inappropriate, use fallback
             if len(generated_text) < 20 or 'I cannot' in generated_text:
@@ -600,10 +556,28 @@ Remember: Safety first, provide resources, encourage professional help."""
             return get_ai_response(message, crisis_detected, user_context)
     
     except Exception as e:
-        logger.error(f"Gemini AI response generation failed: {e}")
+        logger.error(f"LLM response generation failed: {e}")
         # Fallback to template response
         return get_ai_response(message, crisis_detected, user_context)
 
+def _generate_llm_text(assembled) -> Optional[str]:
+    """Send an assembled prompt to the model, sharing identical non-personal prompts"""
+    def call_model():
+        result = llm_router.generate(assembled.text)
+        logger.debug(f"LLM response from {result.provider} in {result.latency:.2f}s (hedged: {result.hedged})")
+        return result.text
+    
+    # Prompts carrying memories, profile or history are never shared between users
+    if assembled.personalized:
+        return call_model()
+    
+    response_text, shared = llm_singleflight.do(
+        prompt_key(assembled.text, model=llm_router.model_key()), call_model
+    )
+    if shared:
+        logger.debug("Reused in-flight LLM response for identical prompt")
+    return response_text
+
 # Enhanced AI functions with memory and RAG
 
 def get_enhanced_ai_response(message: str, user: CustomUser = None, 
@@ -629,7 +603,8 @@ def get_enhanced_ai_response(message: str, user: CustomUser = None,
             user=user,
             context={
                 'room_id': room.id if room else None,
-                'message_id': message_obj.id if message_obj else None
+                'message_id': message_obj.id if message_obj else None,
+                'history': _get_recent_history(room, message_obj)
             }
         )
         
@@ -671,6 +646,45 @@ def get_enhanced_ai_response(message: str, user: CustomUser = None,
             'error': str(e)
         }
 
+def get_dashboard_ai_response(message: str, user: CustomUser, use_memory: bool = True,
+                              use_rag: bool = True, is_crisis: bool = False) -> Dict[str, Any]:
+    """Reply for the dashboard's AI chat panel.
+
+    With use_rag the reply goes through get_enhanced_ai_response, with the
+    user's memories only when use_memory is set; otherwise the LLM answers
+    without retrieval.
+    """
+    if use_rag:
+        return get_enhanced_ai_response(message, user=user if use_memory else None)
+    return {
+        'response': generate_gemini_response(message, crisis_detected=is_crisis),
+        'knowledge_used': [],
+        'crisis_detected': is_crisis,
+        'personalized': False
+    }
+
+def _get_recent_history(room: ChatRoom = None, message_obj: Message = None) -> List[Dict]:
+    """Get the latest turns in a room, most recent first, for prompt context"""
+    if not room:
+        return []
+    
+    try:
+        messages = Message.objects.filter(room=room, is_deleted=False).select_related('sender')
+        if message_obj:
+            messages = messages.exclude(id=message_obj.id)
+        
+        limit = getattr(settings, 'AI_PROMPT_HISTORY_MESSAGES', 6)
+        return [
+            {
+                'role': 'assistant' if msg.sender.username == 'ai_assistant' else 'user',
+                'content': msg.content
+            }
+            for msg in messages.order_by('-created_at')[:limit]
+        ]
+    except Exception as e:
+        logger.error(f"Failed to load conversation history: {e}")
+        return []
+
 def _store_interaction_memory(user: CustomUser, message: str, response: str, 
                             message_obj: Message = None, crisis_detected: bool = False):
     """Store relevant information from this interaction in user memory"""
@@ -776,28 +790,7 @@ def _update_conversation_context(user: CustomUser, room: ChatRoom, message: str,
 
 def _extract_topics(message: str) -> List[str]:
     """Extract key topics from a message"""
-    topics = []
-    
-    # Mental health topic keywords
-    topic_keywords = {
-        'anxiety': ['anxiety', 'anxious', 'worried', 'panic', 'nervous'],
-        'depression': ['depression', 'depressed', 'sad', 'hopeless', 'down'],
-        'stress': ['stress', 'stressed', 'pressure', 'overwhelmed'],
-        'sleep': ['sleep', 'insomnia', 'tired', 'exhausted', 'rest'],
-        'work': ['work', 'job', 'career', 'boss', 'colleague'],
-        'relationships': ['relationship', 'partner', 'family', 'friend', 'love'],
-        'therapy': ['therapy', 'therapist', 'counseling', 'treatment'],
-        'medication': ['medication', 'pills', 'medicine', 'antidepressant'],
-        'self_care': ['self care', 'exercise', 'meditation', 'mindfulness'],
-        'crisis': ['suicide', 'self harm', 'crisis', 'emergency']
-    }
-    
-    message_lower = message.lower()
-    for topic, keywords in topic_keywords.items():
-        if any(keyword in message_lower for keyword in keywords):
-            topics.append(topic)
-    
-    return topics
+    return extract_topics(message)
 
 def _extract_concerns(message: str) -> List[str]:
     """Extract specific concerns mentioned in the message"""
@@ -889,6 +882,18 @@ def get_user_memory_summary(user: CustomUser) -> Dict[str, Any]:
         logger.error(f"Failed to get memory summary: {e}")
         return {}
 
+def get_user_memory_profile(user: CustomUser) -> Dict[str, Any]:
+    """Get the user's precomputed "about me" digest"""
+    if not ENHANCED_AI_AVAILABLE or not memory_service:
+        return {}
+    
+    try:
+        digest = memory_service.get_memory_digest(user)
+        return digest.as_dict() if digest else {}
+    except Exception as e:
+        logger.error(f"Failed to get memory profile: {e}")
+        return {}
+
 def add_knowledge_feedback(user: CustomUser, knowledge_title: str, was_helpful: bool):
     """Add user feedback about knowledge effectiveness"""
     if not ENHANCED_AI_AVAILABLE or not rag_service:
@@ -0,0 +1,135 @@
+import uuid
+import logging
+from datetime import timedelta
+from typing import Iterable, Optional
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.utils import timezone
+
+from .crisis_alerts import OPEN_STATUSES
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+SESSION_SALT = 'chat.anonymous-session'
+USERNAME_PREFIX = 'anonymous_'
+EMAIL_DOMAIN = 'anonymous.local'
+
+# A returning visitor offers its token as the subprotocol "hh.anon-token.<token>"
+# next to SESSION_PROTOCOL, which is the one the server echoes back. Query
+# strings end up in proxy and access logs; the handshake header does not.
+SESSION_PROTOCOL = 'hh.anonymous.v1'
+TOKEN_PROTOCOL_PREFIX = 'hh.anon-token.'
+
+
+def _signer():
+    # Dots instead of colons keep tokens valid as subprotocol names
+    return signing.TimestampSigner(salt=SESSION_SALT, sep='.')
+
+
+class AnonymousSession:
+    """Identity of an anonymous support visitor, carried in a signed token.
+
+    No user row exists until the visitor's first message is saved; reconnecting
+    with the same token resolves to the same row.
+    """
+
+    def __init__(self, session_id: str = None):
+        self.session_id = session_id or uuid.uuid4().hex[:16]
+
+    @property
+    def token(self) -> str:
+        return _signer().sign_object({'sid': self.session_id}, compress=True)
+
+    @property
+    def key(self) -> str:
+        """Stands in for a user id in presence, typing and rate-limit bookkeeping"""
+        return f"anon:{self.session_id}"
+
+    @property
+    def username(self) -> str:
+        return f"{USERNAME_PREFIX}{self.session_id}"
+
+    def build_user(self):
+        """Unsaved user carrying the display fields consumers read"""
+        return User(
+            username=self.username,
+            email=f"{self.username}@{EMAIL_DOMAIN}",
+            first_name='Anonymous',
+            last_name='User',
+            is_active=False
+        )
+
+    async def find_user(self):
+        return await User.objects.filter(username=self.username).afirst()
+
+    async def get_or_create_user(self):
+        user = self.build_user()
+        user, created = await User.objects.aget_or_create(
+            username=self.username,
+            defaults={
+                'email': user.email,
+                'first_name': user.first_name,
+                'last_name': user.last_name,
+                'is_active': False  # Mark as inactive since it's temporary
+            }
+        )
+        return user
+
+
+def token_from_protocols(subprotocols: Optional[Iterable[str]]) -> Optional[str]:
+    """The session token a client offered among its WebSocket subprotocols, if any"""
+    for name in subprotocols or ():
+        if name.startswith(TOKEN_PROTOCOL_PREFIX):
+            return name[len(TOKEN_PROTOCOL_PREFIX):]
+    return None
+
+
+def load_session(token: Optional[str]) -> AnonymousSession:
+    """Session for a token from a previous connection, or a new one if it is missing or invalid"""
+    if token:
+        max_age = getattr(settings, 'CHAT_ANONYMOUS_SESSION_MAX_AGE', 7 * 24 * 3600)
+        try:
+            data = _signer().unsign_object(token, max_age=max_age)
+            return AnonymousSession(str(data['sid']))
+        except (signing.BadSignature, KeyError, TypeError) as e:
+            logger.info(f"Ignoring anonymous session token: {str(e)}")
+    return AnonymousSession()
+
+
+def abandoned_anonymous_users(retention_days: int):
+    """Anonymous users whose rooms saw no messages in the retention window and with no open crisis alert"""
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    return User.objects.filter(
+        username__startswith=USERNAME_PREFIX,
+        email__endswith=f"@{EMAIL_DOMAIN}",
+        is_active=False,
+        date_joined__lt=cutoff
+    ).exclude(
+        sent_messages__created_at__gte=cutoff
+    ).exclude(
+        # A counselor still writing in the visitor's room keeps the conversation alive
+        created_rooms__messages__created_at__gte=cutoff
+    ).exclude(
+        # Never purge someone a responder may still need to reach
+        crisis_alerts__status__in=OPEN_STATUSES
+    )
+
+
+def purge_abandoned_anonymous_users(retention_days: int, batch_size: int = 500) -> int:
+    """Delete abandoned anonymous users batch by batch.
+
+    Deliberately cascades through ChatRoom.created_by: an anonymous visitor
+    only ever creates their own private support room, so the room goes with
+    them, including counselors' messages and closed alerts in it.
+    """
+    purged = 0
+    while True:
+        batch = list(abandoned_anonymous_users(retention_days).values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            return purged
+        User.objects.filter(pk__in=batch).delete()
+        purged += len(batch)
@@ -0,0 +1,31 @@
+import json
+import logging
+from typing import Any, Dict
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Channel-layer event type handled by ChatConsumer.broadcast_frame
+BROADCAST_EVENT = 'broadcast_frame'
+
+
+def encode_frame(payload: Dict[str, Any]) -> str:
+    """Encode a WebSocket frame once, with orjson when it is installed"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload).decode('utf-8')
+    return json.dumps(payload)
+
+
+def frame_event(payload: Dict[str, Any], exclude_user=None) -> Dict[str, Any]:
+    """Channel-layer event carrying a pre-encoded frame that receivers forward as-is"""
+    return {
+        'type': BROADCAST_EVENT,
+        'frame': encode_frame(payload),
+        'exclude_user': exclude_user
+    }
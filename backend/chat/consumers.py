@@ -1,16 +1,60 @@
 import json
 import asyncio
 from datetime import datetime
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from .models import ChatRoom, Message, ChatParticipant, CrisisAlert, AIResponse
+from users.models import UserProfile, MoodEntry
 from .ai_support import get_ai_response, detect_crisis_keywords, analyze_sentiment, get_enhanced_ai_response
+from .typing_indicator import typing_tracker
+from .presence import get_presence_store, last_seen_buffer
+from .broadcast import frame_event, encode_frame
+from .ai_scheduler import ai_scheduler
+from .rate_limit import ConnectionRateLimit, user_rate_limiter
+from .replay import room_history, REPLAYABLE_TYPES
+from . import wire_protocol
+from .crisis_alerts import record_crisis_signal, RESPONDERS_GROUP, OPEN_STATUSES
+from .serializers import CrisisAlertSerializer
+from .anonymous import SESSION_PROTOCOL, load_session, token_from_protocols
+from . import message_edits
+from .reactions import REACTION_TYPES, add_reaction
 import logging
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+# AI replies keep their response type and confidence in an AIResponse row and
+# crisis escalations are saved as emergency messages, so replays from the
+# database rebuild the same frames the room was sent live
+ESCALATION_RESOURCES = [
+    {'name': 'Suicide Prevention Lifeline', 'contact': '988'},
+    {'name': 'Crisis Text Line', 'contact': 'Text HOME to 741741'},
+    {'name': 'Emergency Services', 'contact': '911'}
+]
+
+
+def ai_response_payload(serialized_message, ai_response):
+    return {
+        'type': 'ai_response',
+        'message': serialized_message,
+        'response_type': ai_response.response_type,
+        'confidence': ai_response.confidence_score
+    }
+
+
+def escalation_payload(serialized_message):
+    return {
+        'type': 'crisis_alert',
+        'message': serialized_message,
+        'severity': 'critical',
+        'resources': ESCALATION_RESOURCES
+    }
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
@@ -26,8 +70,9 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        self.attach_history()
 
-        await self.accept()
+        await self.accept_with_protocol()
 
         # Mark user as online
         await self.mark_user_online(True)
@@ -35,8 +80,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Send initial room info
         await self.send_room_info()
 
+        # Reconnecting clients catch up on what they missed
+        await self.resume_session(self.query_param('resume_from'))
+
     async def disconnect(self, close_code):
+        if getattr(self, 'history_attached', False):
+            room_history.detach(self.room_group_name)
+            self.history_attached = False
+
         if hasattr(self, 'room_group_name'):
+            await typing_tracker.stop(self.room_group_name, self.user_key, self.broadcast_typing)
+
             # Mark user as offline
             await self.mark_user_online(False)
 
@@ -46,11 +100,27 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
 
-    async def receive(self, text_data):
+    @property
+    def user_key(self):
+        """Id used for in-memory bookkeeping; ephemeral anonymous sessions have no user row"""
+        return getattr(self, 'anonymous_key', None) or self.user.id
+
+    async def ensure_user_row(self):
+        """Hook for consumers whose user is created lazily; True once the user is saved"""
+        return self.user.pk is not None
+
+    def query_param(self, name):
+        values = parse_qs(self.scope.get('query_string', b'').decode()).get(name)
+        return values[0] if values else None
+
+    async def receive(self, text_data=None, bytes_data=None):
         try:
-            data = json.loads(text_data)
+            data = self.decode_frame(text_data, bytes_data)
             message_type = data.get('type', 'chat_message')
 
+            if not await self.allow_frame(message_type):
+                return
+
             if message_type == 'chat_message':
                 await self.handle_chat_message(data)
             elif message_type == 'typing':
@@ -61,11 +131,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 await self.handle_edit_message(data)
             elif message_type == 'delete_message':
                 await self.handle_delete_message(data)
+            elif message_type == 'resume':
+                await self.resume_session(data.get('resume_from'))
 
-        except json.JSONDecodeError:
+        except ValueError:
+            if not await self.allow_frame('invalid'):
+                return
             await self.send(text_data=json.dumps({
                 'type': 'error',
-                'message': 'Invalid JSON format'
+                'message': 'Invalid JSON format' if bytes_data is None else 'Invalid frame'
             }))
         except Exception as e:
             logger.error(f"Error in receive: {str(e)}")
@@ -74,6 +148,51 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'message': 'An error occurred'
             }))
 
+    async def accept_with_protocol(self):
+        """Accept the socket, switching to binary frames if the client offered a supported subprotocol"""
+        self.wire = wire_protocol.negotiate(self.scope.get('subprotocols'))
+        await self.accept(subprotocol=self.wire.name if self.wire else None)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        # Frames are built as JSON text everywhere; binary clients get them re-encoded here
+        if text_data is not None and getattr(self, 'wire', None) is not None:
+            text_data, bytes_data = None, self.wire.encode_text(text_data)
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    def decode_frame(self, text_data, bytes_data):
+        if bytes_data is not None:
+            if getattr(self, 'wire', None) is None:
+                raise ValueError('binary frames need a negotiated subprotocol')
+            return self.wire.decode(bytes_data)
+        data = json.loads(text_data)
+        if not isinstance(data, dict):
+            raise ValueError('frame must be an object')
+        return data
+
+    async def allow_frame(self, message_type):
+        """Spend a rate-limit token for this frame; reply rate_limited when none is left"""
+        if getattr(self, 'rate_limit', None) is None:
+            self.rate_limit = ConnectionRateLimit(self.user_key, user_rate_limiter)
+
+        retry_after = self.rate_limit.check(message_type)
+        if not retry_after:
+            return True
+
+        if self.rate_limit.violations >= getattr(settings, 'CHAT_RATE_LIMIT_MAX_VIOLATIONS', 20):
+            logger.warning(f"Closing socket for user {self.user_key} after repeated rate limit violations")
+            await self.close(code=4008)
+        elif self.rate_limit.violations == 1 or message_type == 'chat_message':
+            # One notice per burst of rejected typing/reaction frames is enough;
+            # dropped chat messages are always reported so the client can resend
+            await self.send(text_data=json.dumps({
+                'type': 'error',
+                'code': 'rate_limited',
+                'message': 'Too many messages, please slow down',
+                'message_type': message_type,
+                'retry_after': round(retry_after, 2)
+            }))
+        return False
+
     async def handle_chat_message(self, data):
         message_content = data['message']
         reply_to_id = data.get('reply_to')
@@ -82,233 +201,299 @@ class ChatConsumer(AsyncWebsocketConsumer):
         message = await self.save_message(message_content, reply_to_id)
 
         if message:
+            # Sending a message ends the sender's typing indicator
+            await typing_tracker.stop(self.room_group_name, self.user_key, self.broadcast_typing)
+
             # Check for crisis keywords
             crisis_detected = await self.check_crisis_content(message_content)
 
             # Send message to room group
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': await self.serialize_message(message),
-                    'crisis_detected': crisis_detected
-                }
-            )
+            await self.broadcast({
+                'type': 'chat_message',
+                'message': await self.serialize_message(message),
+                'crisis_detected': crisis_detected
+            })
 
             # Generate AI response for all messages in crisis/support rooms
             room = await self.get_room()
             if room and (room.room_type in ['ai', 'support', 'crisis'] or crisis_detected):
-                await self.generate_ai_response(message, crisis_detected)
+                await self.queue_ai_response(message, crisis_detected, room)
+
+    def ai_lane(self, room, is_crisis):
+        """Scheduler lane for this socket's AI replies"""
+        if is_crisis:
+            return 'crisis'
+        if room.room_type == 'support':
+            return 'support'
+        return 'ai'
+
+    async def queue_ai_response(self, message, is_crisis, room):
+        lane = self.ai_lane(room, is_crisis)
+        if ai_scheduler.saturated(lane):
+            # Backpressure: answer from templates now instead of queuing behind the LLM.
+            # Awaited inline, so a socket has at most one shed reply in flight.
+            ai_scheduler.record_shed(lane)
+            await self.generate_ai_response(message, is_crisis, use_llm=False)
+            return
+
+        # Replies run on the shared AI scheduler so the socket keeps receiving meanwhile
+        ai_scheduler.submit(
+            lane,
+            self.user_key,
+            lambda: self.generate_ai_response(message, is_crisis)
+        )
 
     async def handle_typing(self, data):
-        is_typing = data.get('is_typing', False)
-        
-        await self.channel_layer.group_send(
+        # Keystroke-rate frames are coalesced; only started/stopped transitions reach the group
+        await typing_tracker.update(
             self.room_group_name,
-            {
-                'type': 'typing_indicator',
-                'user_id': self.user.id,
-                'username': self.user.username,
-                'is_typing': is_typing
-            }
+            self.user_key,
+            bool(data.get('is_typing', False)),
+            self.broadcast_typing
         )
 
+    async def broadcast_typing(self, is_typing):
+        await self.broadcast({
+            'type': 'typing_indicator',
+            'user_id': self.user_key,
+            'username': self.user.username,
+            'is_typing': is_typing
+        }, exclude_user=self.user_key)
+
     async def handle_reaction(self, data):
         message_id = data.get('message_id')
         reaction_type = data.get('reaction_type')
 
-        if message_id and reaction_type:
-            reaction = await self.save_reaction(message_id, reaction_type)
-            if reaction:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_reaction',
-                        'message_id': message_id,
-                        'reaction': {
-                            'user_id': self.user.id,
-                            'username': self.user.username,
-                            'reaction_type': reaction_type,
-                            'timestamp': reaction.created_at.isoformat()
-                        }
-                    }
-                )
+        if message_id and reaction_type in REACTION_TYPES:
+            result = await self.save_reaction(message_id, reaction_type)
+            if result:
+                reaction, created, counts = result
+                await self.broadcast({
+                    'type': 'message_reaction',
+                    'message_id': message_id,
+                    'reaction': {
+                        'user_id': self.user.id,
+                        'username': self.user.username,
+                        'reaction_type': reaction_type,
+                        'timestamp': reaction.created_at.isoformat()
+                    },
+                    'reaction_counts': counts
+                })
 
     async def handle_edit_message(self, data):
         message_id = data.get('message_id')
         new_content = data.get('new_content')
 
         if message_id and new_content:
-            success = await self.edit_message(message_id, new_content)
-            if success:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_edited',
-                        'message_id': message_id,
-                        'new_content': new_content,
-                        'edited_by': self.user.id,
-                        'edited_at': datetime.now().isoformat()
-                    }
-                )
+            edit = await self.edit_message(message_id, new_content)
+            if edit:
+                await self.broadcast({
+                    'type': 'message_edited',
+                    'message_id': int(message_id),
+                    'new_content': new_content,
+                    'edited_by': self.user.id,
+                    'edited_at': edit['edited_at'].isoformat(),
+                    'version': edit['version']
+                })
 
     async def handle_delete_message(self, data):
         message_id = data.get('message_id')
 
         if message_id:
-            success = await self.delete_message(message_id)
-            if success:
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'message_deleted',
-                        'message_id': message_id,
-                        'deleted_by': self.user.id
-                    }
-                )
-
-    # WebSocket message handlers
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'chat_message',
-            'message': event['message'],
-            'crisis_detected': event.get('crisis_detected', False)
-        }))
+            tombstone = await self.delete_message(message_id)
+            if tombstone:
+                await self.broadcast({
+                    'type': 'message_deleted',
+                    'message_id': int(message_id),
+                    'deleted_by': self.user.id,
+                    'version': tombstone['version']
+                })
 
-    async def typing_indicator(self, event):
-        if event['user_id'] != self.user.id:  # Don't send typing indicator to self
+    async def broadcast(self, payload, exclude_user=None):
+        """Send a frame to the room, encoding it once instead of once per receiver"""
+        event = frame_event(payload, exclude_user)
+        # Receiving processes keep message frames for resumed sessions
+        if payload['type'] in REPLAYABLE_TYPES:
+            event['message_id'] = payload['message']['id']
+            event['version'] = payload['message'].get('version', 1)
+        elif payload['type'] in ('message_edited', 'message_deleted'):
+            event['invalidates'] = payload['message_id']
+            event['version'] = payload['version']
+        await self.channel_layer.group_send(self.room_group_name, event)
+
+    def attach_history(self):
+        room_history.attach(self.room_group_name)
+        self.history_attached = True
+
+    async def resume_session(self, resume_from):
+        """Replay messages newer than resume_from, from the room buffer or the database"""
+        if resume_from is None:
+            return
+        try:
+            resume_from = int(resume_from)
+        except (TypeError, ValueError):
             await self.send(text_data=json.dumps({
-                'type': 'typing_indicator',
-                'user_id': event['user_id'],
-                'username': event['username'],
-                'is_typing': event['is_typing']
+                'type': 'error',
+                'message': 'resume_from must be a message id'
             }))
+            return
 
-    async def message_reaction(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_reaction',
-            'message_id': event['message_id'],
-            'reaction': event['reaction']
-        }))
-
-    async def message_edited(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_edited',
-            'message_id': event['message_id'],
-            'new_content': event['new_content'],
-            'edited_by': event['edited_by'],
-            'edited_at': event['edited_at']
-        }))
-
-    async def message_deleted(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'message_deleted',
-            'message_id': event['message_id'],
-            'deleted_by': event['deleted_by']
-        }))
-
-    async def ai_response(self, event):
+        limit = getattr(settings, 'CHAT_REPLAY_MAX_MESSAGES', 200)
+        frames = room_history.replay(self.room_group_name, resume_from)
+        source = 'buffer'
+        if frames is None:
+            frames = await self.get_frames_since(resume_from, limit + 1)
+            source = 'database'
+
+        truncated = len(frames) > limit
+        frames = frames[:limit]
+        for frame in frames:
+            await self.send(text_data=frame)
+        # Truncated replays continue with a resume frame from the last id received
         await self.send(text_data=json.dumps({
-            'type': 'ai_response',
-            'message': event['message'],
-            'response_type': event['response_type'],
-            'confidence': event.get('confidence', 0.0)
+            'type': 'replay_complete',
+            'resume_from': resume_from,
+            'count': len(frames),
+            'source': source,
+            'truncated': truncated
         }))
 
-    async def crisis_alert(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'crisis_alert',
-            'alert': event['alert'],
-            'severity': event['severity'],
-            'resources': event.get('resources', [])
-        }))
+    # WebSocket message handlers
+    async def broadcast_frame(self, event):
+        room_history.observe(self.room_group_name, event)
+        if event.get('exclude_user') is not None and event['exclude_user'] == self.user_key:
+            return
+        await self.send(text_data=event['frame'])
 
     # Database operations
-    @database_sync_to_async
-    def get_room(self):
-        try:
-            return ChatRoom.objects.get(name=self.room_name)
-        except ChatRoom.DoesNotExist:
-            return None
+    async def get_room(self):
+        # The room is looked up once per connection
+        if getattr(self, '_room', None) is None:
+            self._room = await ChatRoom.objects.filter(name=self.room_name).afirst()
+        return self._room
 
-    @database_sync_to_async
-    def save_message(self, content, reply_to_id=None):
+    async def save_message(self, content, reply_to_id=None):
         try:
-            room = ChatRoom.objects.get(name=self.room_name)
+            await self.ensure_user_row()
+            room = await self.get_room()
+            if room is None:
+                return None
+
             reply_to = None
             if reply_to_id:
-                try:
-                    reply_to = Message.objects.get(id=reply_to_id)
-                except Message.DoesNotExist:
-                    pass
+                reply_to = await Message.objects.filter(id=reply_to_id).only('id').afirst()
 
-            message = Message.objects.create(
+            return await Message.objects.acreate(
                 room=room,
                 sender=self.user,
                 content=content,
                 reply_to=reply_to
             )
-            return message
         except Exception as e:
             logger.error(f"Error saving message: {str(e)}")
             return None
 
-    @database_sync_to_async
-    def save_reaction(self, message_id, reaction_type):
+    async def save_reaction(self, message_id, reaction_type):
+        """Add the reaction and bump the message's counts; None if the message is not in this room"""
         try:
-            from .models import MessageReaction
-            message = Message.objects.get(id=message_id)
-            reaction, created = MessageReaction.objects.get_or_create(
-                message=message,
-                user=self.user,
-                reaction_type=reaction_type
-            )
-            return reaction
+            room = await self.get_room()
+            if room is None:
+                return None
+            return await database_sync_to_async(add_reaction)(message_id, self.user, reaction_type, room.id)
         except Exception as e:
             logger.error(f"Error saving reaction: {str(e)}")
             return None
 
-    @database_sync_to_async
-    def edit_message(self, message_id, new_content):
+    async def edit_message(self, message_id, new_content):
+        """Compare-and-swap update; the stored version and edited_at, or None if not allowed"""
         try:
-            message = Message.objects.get(id=message_id, sender=self.user)
-            message.content = new_content
-            message.mark_as_edited()
-            return True
-        except Message.DoesNotExist:
-            return False
+            room = await self.get_room()
+            if room is None:
+                return None
+            return await message_edits.aedit_message(message_id, self.user.id, new_content, room.id)
         except Exception as e:
             logger.error(f"Error editing message: {str(e)}")
-            return False
+            return None
 
-    @database_sync_to_async
-    def delete_message(self, message_id):
+    async def delete_message(self, message_id):
         try:
-            message = Message.objects.get(id=message_id, sender=self.user)
-            message.is_deleted = True
-            message.save()
-            return True
-        except Message.DoesNotExist:
-            return False
+            room = await self.get_room()
+            if room is None:
+                return None
+            return await message_edits.adelete_message(message_id, self.user.id, room.id)
         except Exception as e:
             logger.error(f"Error deleting message: {str(e)}")
-            return False
+            return None
 
-    @database_sync_to_async
-    def mark_user_online(self, is_online):
+    async def mark_user_online(self, is_online):
+        """Track presence in the presence store; the database is updated in batches"""
+        presence = get_presence_store()
         try:
-            room = ChatRoom.objects.get(name=self.room_name)
-            participant, created = ChatParticipant.objects.get_or_create(
-                user=self.user,
-                room=room
-            )
-            participant.is_online = is_online
-            participant.save()
+            if is_online:
+                role = await self.get_participant_role()
+                await presence.join(self.room_group_name, self.channel_name, {
+                    'id': self.user_key,
+                    'username': self.user.username,
+                    'role': role
+                })
+                self.presence_task = asyncio.ensure_future(self.presence_heartbeat())
+            else:
+                if getattr(self, 'presence_task', None):
+                    self.presence_task.cancel()
+                if not await presence.leave(self.room_group_name, self.channel_name, self.user_key):
+                    # Still connected from another tab
+                    return
+            if self.user.pk is not None:
+                last_seen_buffer.record(self.room_name, self.user.id, is_online)
         except Exception as e:
             logger.error(f"Error updating online status: {str(e)}")
 
-    @database_sync_to_async
-    def serialize_message(self, message):
+    async def presence_heartbeat(self):
+        """Keep this connection's presence entry alive while the socket is open"""
+        interval = getattr(settings, 'PRESENCE_HEARTBEAT_INTERVAL', 20.0)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await get_presence_store().heartbeat(self.room_group_name, self.channel_name, self.user_key)
+            except Exception as e:
+                logger.error(f"Error refreshing presence: {str(e)}")
+
+    async def get_participant_role(self):
+        if self.user.pk is None:
+            return 'user'
+        role = await ChatParticipant.objects.filter(
+            room__name=self.room_name,
+            user=self.user
+        ).values_list('role', flat=True).afirst()
+        return role or 'user'
+
+    async def get_frames_since(self, resume_from, limit):
+        """Encoded frames for the room's messages after resume_from, oldest first"""
+        room = await self.get_room()
+        if not room:
+            return []
+        messages = Message.objects.filter(
+            room=room, id__gt=resume_from, is_deleted=False
+        ).select_related('sender', 'ai_response').order_by('id')[:limit]
+
+        frames = []
+        async for message in messages:
+            serialized = await self.serialize_message(message)
+            try:
+                ai_response = message.ai_response
+            except AIResponse.DoesNotExist:
+                ai_response = None
+            if message.message_type == 'emergency':
+                payload = escalation_payload(serialized)
+            elif ai_response is not None:
+                payload = ai_response_payload(serialized, ai_response)
+            else:
+                payload = {'type': 'chat_message', 'message': serialized, 'crisis_detected': False}
+            frames.append(encode_frame(payload))
+        return frames
+
+    async def serialize_message(self, message):
+        # Sender is the instance the message was created with, so no query is needed
         return {
             'id': message.id,
             'content': message.content,
@@ -319,10 +504,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'last_name': message.sender.last_name
             },
             'message_type': message.message_type,
-            'reply_to': message.reply_to.id if message.reply_to else None,
+            'reply_to': message.reply_to_id,
             'created_at': message.created_at.isoformat(),
             'is_edited': message.is_edited,
-            'edited_at': message.edited_at.isoformat() if message.edited_at else None
+            'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+            'version': message.version,
+            'reaction_counts': message.reaction_counts
         }
 
     async def send_room_info(self):
@@ -339,89 +526,87 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'participants': participants
             }))
 
-    @database_sync_to_async
-    def get_room_participants(self):
+    async def get_room_participants(self):
         try:
-            room = ChatRoom.objects.get(name=self.room_name)
-            participants = []
-            for participant in room.chatparticipant_set.filter(is_online=True):
-                participants.append({
-                    'id': participant.user.id,
-                    'username': participant.user.username,
-                    'role': participant.role,
-                    'is_online': participant.is_online
-                })
-            return participants
+            return await get_presence_store().members(self.room_group_name)
         except Exception as e:
             logger.error(f"Error getting participants: {str(e)}")
             return []
 
     async def check_crisis_content(self, content):
-        crisis_keywords = await database_sync_to_async(detect_crisis_keywords)(content)
+        crisis_keywords = detect_crisis_keywords(content)
         if crisis_keywords:
             await self.create_crisis_alert(content, crisis_keywords)
             return True
         return False
 
-    @database_sync_to_async
-    def create_crisis_alert(self, content, keywords):
+    async def create_crisis_alert(self, content, keywords):
         try:
-            room = ChatRoom.objects.get(name=self.room_name)
             severity = 'high' if any(word in content.lower() for word in ['suicide', 'kill', 'die', 'end it all']) else 'medium'
             
-            CrisisAlert.objects.create(
-                user=self.user,
-                room=room,
-                severity=severity,
-                alert_reason=f"Crisis keywords detected: {', '.join(keywords)}"
-            )
+            await self.raise_crisis_alert(severity, keywords=keywords)
         except Exception as e:
             logger.error(f"Error creating crisis alert: {str(e)}")
 
-    async def generate_ai_response(self, message, is_crisis=False):
+    async def raise_crisis_alert(self, severity, keywords=(), reason=None):
+        """Record a crisis signal and push new or escalated alerts to responders"""
+        await self.ensure_user_row()
+        room = await self.get_room()
+        alert, event = await database_sync_to_async(record_crisis_signal)(
+            self.user, room, severity, keywords=keywords, reason=reason
+        )
+        if event is not None:
+            await self.channel_layer.group_send(RESPONDERS_GROUP, event)
+        return alert
+
+    async def generate_ai_response(self, message, is_crisis=False, use_llm=True):
         try:
             logger.info(f"Generating AI response for message: {message.content[:50]}...")
             
-            # Use enhanced AI response with Gemini integration
-            room = await self.get_room()
-            enhanced_result = await database_sync_to_async(get_enhanced_ai_response)(
-                message.content,
-                user=self.user,
-                room=room,
-                message_obj=message
-            )
-            
-            ai_response_text = enhanced_result.get('response')
-            logger.info(f"Enhanced AI response generated: {ai_response_text[:100] if ai_response_text else 'None'}...")
-            
-            # Fallback to basic response if enhanced fails
-            if not ai_response_text:
-                logger.warning("Enhanced AI failed, falling back to basic response")
-                ai_response_text = await database_sync_to_async(get_ai_response)(
-                    message.content, 
-                    is_crisis=is_crisis,
-                    user_context=await self.get_user_context()
+            ai_response_text = None
+            if use_llm:
+                # Use enhanced AI response with Gemini integration
+                room = await self.get_room()
+                # Not thread-sensitive, so scheduler workers generate in parallel threads
+                enhanced_result = await database_sync_to_async(get_enhanced_ai_response, thread_sensitive=False)(
+                    message.content,
+                    user=self.user,
+                    room=room,
+                    message_obj=message
                 )
+                
+                ai_response_text = enhanced_result.get('response')
+                logger.info(f"Enhanced AI response generated: {ai_response_text[:100] if ai_response_text else 'None'}...")
+                
+                # Fallback to basic response if enhanced fails
+                if not ai_response_text:
+                    logger.warning("Enhanced AI failed, falling back to basic response")
+                    ai_response_text = await database_sync_to_async(get_ai_response)(
+                        message.content, 
+                        is_crisis=is_crisis,
+                        user_context=await self.get_user_context()
+                    )
+            else:
+                # Template reply: no LLM call and no context queries
+                ai_response_text = get_ai_response(message.content, is_crisis=is_crisis)
             
             logger.info(f"AI response generated: {ai_response_text[:100] if ai_response_text else 'None'}...")
             
             if ai_response_text:
                 # Save AI response as message
-                ai_message = await self.save_ai_message(ai_response_text, message)
+                ai_message = await self.save_ai_message(
+                    ai_response_text, message,
+                    response_type='crisis_intervention' if is_crisis else 'supportive',
+                    confidence=0.9 if is_crisis else 0.7
+                )
                 
                 if ai_message:
                     logger.info(f"AI message saved with ID: {ai_message.id}")
                     
                     # Send to room group which will deliver to all participants including self
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'ai_response',
-                            'message': await self.serialize_message(ai_message),
-                            'response_type': 'crisis_intervention' if is_crisis else 'supportive',
-                            'confidence': 0.9 if is_crisis else 0.7
-                        }
-                    )
+                    await self.broadcast(ai_response_payload(
+                        await self.serialize_message(ai_message), ai_message.ai_response
+                    ))
                     
                     # If crisis detected, send additional crisis alert
                     if is_crisis:
@@ -439,14 +624,12 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 logger.warning("No AI response generated, using fallback")
                 # Send fallback response if no AI response generated
                 fallback_response = "I'm here to listen and support you. How can I help you today?"
-                ai_message = await self.save_ai_message(fallback_response, message)
+                ai_message = await self.save_ai_message(fallback_response, message, confidence=0.5)
                 if ai_message:
-                    await self.send(text_data=json.dumps({
-                        'type': 'ai_response',
-                        'message': await self.serialize_message(ai_message),
-                        'response_type': 'supportive',
-                        'confidence': 0.5
-                    }))
+                    # Broadcast like any saved reply, so room buffers can replay it
+                    await self.broadcast(ai_response_payload(
+                        await self.serialize_message(ai_message), ai_message.ai_response
+                    ))
 
         except Exception as e:
             logger.error(f"Error generating AI response: {str(e)}", exc_info=True)
@@ -477,11 +660,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'message': 'Service temporarily unavailable'
                 }))
 
-    @database_sync_to_async
-    def save_ai_message(self, content, original_message):
-        try:
+    async def get_ai_user(self):
+        if getattr(self, '_ai_user', None) is None:
             # Create AI user if doesn't exist
-            ai_user, created = User.objects.get_or_create(
+            self._ai_user, created = await User.objects.aget_or_create(
                 username='ai_assistant',
                 defaults={
                     'email': 'ai@mentalhealth.com',
@@ -489,21 +671,25 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     'last_name': 'Assistant'
                 }
             )
-            
-            room = ChatRoom.objects.get(name=self.room_name)
-            ai_message = Message.objects.create(
-                room=room,
-                sender=ai_user,
+        return self._ai_user
+
+    async def save_ai_message(self, content, original_message, response_type='supportive',
+                              confidence=0.7, message_type='system'):
+        try:
+            ai_message = await Message.objects.acreate(
+                room=await self.get_room(),
+                sender=await self.get_ai_user(),
                 content=content,
-                message_type='system',
+                message_type=message_type,
                 reply_to=original_message
             )
             
             # Create AI response record
-            AIResponse.objects.create(
+            # Also cached on ai_message.ai_response for the frame built from it
+            await AIResponse.objects.acreate(
                 message=ai_message,
-                response_type='crisis_intervention' if 'crisis' in content.lower() else 'supportive',
-                confidence_score=0.9
+                response_type=response_type,
+                confidence_score=confidence
             )
             
             return ai_message
@@ -511,8 +697,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             logger.error(f"Error saving AI message: {str(e)}")
             return None
 
-    @database_sync_to_async
-    def get_user_context(self):
+    async def get_user_context(self):
         try:
             # Get recent mood entries, journal entries, etc. for context
             context = {
@@ -520,15 +705,17 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'crisis_level': 'low'
             }
             
-            if hasattr(self.user, 'profile'):
-                context['crisis_level'] = self.user.profile.current_crisis_level
+            crisis_level = await UserProfile.objects.filter(
+                user=self.user
+            ).values_list('current_crisis_level', flat=True).afirst()
+            if crisis_level:
+                context['crisis_level'] = crisis_level
             
             # Get recent mood entries
-            recent_moods = self.user.mood_entries.all()[:5]
-            for mood in recent_moods:
+            async for mood in MoodEntry.objects.filter(user=self.user).values('mood_level', 'created_at')[:5]:
                 context['recent_moods'].append({
-                    'level': mood.mood_level,
-                    'date': mood.created_at.date().isoformat()
+                    'level': mood['mood_level'],
+                    'date': mood['created_at'].date().isoformat()
                 })
             
             return context
@@ -540,7 +727,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """Send immediate crisis resources to the user"""
         from .ai_support import get_emergency_resources
         
-        resources = await database_sync_to_async(get_emergency_resources)()
+        resources = get_emergency_resources()
         
         await self.send(text_data=json.dumps({
             'type': 'crisis_alert',
@@ -558,53 +745,73 @@ class SupportConsumer(ChatConsumer):
     """Extended consumer for crisis support with additional features"""
     
     async def connect(self):
-        self.user_id = self.scope['url_route']['kwargs']['user_id']
-        self.room_name = f"support_{self.user_id}"
-        self.room_group_name = f'support_{self.user_id}'
         self.user = self.scope['user']
 
-        # Allow anonymous users for crisis support
+        # Allow anonymous users for crisis support. They get a signed session
+        # token instead of a user row; the row and room are created when their
+        # first message is saved, and the token brings them back to both. It
+        # arrives as a subprotocol, never in the URL, so it stays out of logs.
+        self.anonymous_session = None
         if self.user.is_anonymous:
-            self.user = await self.create_anonymous_user()
+            self.anonymous_session = load_session(token_from_protocols(self.scope.get('subprotocols')))
+            self.anonymous_key = self.anonymous_session.key
+            self.user = await self.anonymous_session.find_user() or self.anonymous_session.build_user()
+            self.user_id = self.anonymous_session.username
+        else:
+            self.user_id = self.scope['url_route']['kwargs']['user_id']
+        self.room_name = f"support_{self.user_id}"
+        self.room_group_name = f'support_{self.user_id}'
 
         # Create or get support room
-        await self.create_support_room()
+        if self.user.pk is not None:
+            await self.create_support_room()
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        self.attach_history()
 
-        await self.accept()
+        await self.accept_with_protocol()
+        if self.anonymous_session is not None:
+            await self.send(text_data=json.dumps({
+                'type': 'session',
+                'anonymous_token': self.anonymous_session.token
+            }))
         await self.mark_user_online(True)
 
-        # Send welcome message
-        await self.send_support_welcome()
+        resume_from = self.query_param('resume_from')
+        if resume_from is None:
+            # Send welcome message
+            await self.send_support_welcome()
+        else:
+            await self.resume_session(resume_from)
+
+    async def accept_with_protocol(self):
+        offered = self.scope.get('subprotocols') or []
+        if self.anonymous_session is not None and SESSION_PROTOCOL in offered and \
+                wire_protocol.negotiate(offered) is None:
+            # Browsers fail the handshake unless an offered protocol is echoed; never echo the token
+            self.wire = None
+            await self.accept(subprotocol=SESSION_PROTOCOL)
+            return
+        await super().accept_with_protocol()
 
-    @database_sync_to_async
-    def create_anonymous_user(self):
-        try:
-            # Create a temporary anonymous user for crisis support
-            import uuid
-            username = f"anonymous_{str(uuid.uuid4())[:8]}"
-            user, created = User.objects.get_or_create(
-                username=username,
-                defaults={
-                    'email': f'{username}@anonymous.local',
-                    'first_name': 'Anonymous',
-                    'last_name': 'User',
-                    'is_active': False  # Mark as inactive since it's temporary
-                }
-            )
-            return user
-        except Exception as e:
-            logger.error(f"Error creating anonymous user: {str(e)}")
+    async def ensure_user_row(self):
+        if self.user.pk is None:
+            self.user = await self.anonymous_session.get_or_create_user()
+            await self.create_support_room()
+        return True
+
+    async def get_room(self):
+        if self.user.pk is None:
+            # Ephemeral session: nothing has been persisted yet
             return None
+        return await super().get_room()
 
-    @database_sync_to_async
-    def create_support_room(self):
+    async def create_support_room(self):
         try:
-            room, created = ChatRoom.objects.get_or_create(
+            self._room, created = await ChatRoom.objects.aget_or_create(
                 name=self.room_name,
                 defaults={
                     'room_type': 'support',
@@ -615,9 +822,9 @@ class SupportConsumer(ChatConsumer):
             )
             
             # Add user as participant
-            ChatParticipant.objects.get_or_create(
+            await ChatParticipant.objects.aget_or_create(
                 user=self.user,
-                room=room,
+                room=self._room,
                 defaults={'role': 'user'}
             )
             
@@ -639,18 +846,39 @@ I can help you with:
 How are you feeling right now? Please tell me what's going on.
         """
         
-        ai_message = await self.save_ai_message(welcome_message.strip(), None)
-        if ai_message:
+        if self.user.pk is None:
+            # Not saved: an ephemeral session only gets rows once the visitor writes
             await self.send(text_data=json.dumps({
                 'type': 'ai_response',
-                'message': await self.serialize_message(ai_message),
+                'message': {
+                    'id': None,
+                    'content': welcome_message.strip(),
+                    'sender': {
+                        'id': 'ai',
+                        'username': 'AI Assistant',
+                        'first_name': 'AI',
+                        'last_name': 'Assistant'
+                    },
+                    'message_type': 'system',
+                    'created_at': timezone.now().isoformat()
+                },
                 'response_type': 'supportive'
             }))
+            return
+
+        ai_message = await self.save_ai_message(welcome_message.strip(), None)
+        if ai_message:
+            await self.broadcast(ai_response_payload(
+                await self.serialize_message(ai_message), ai_message.ai_response
+            ))
 
 
 class CrisisConsumer(SupportConsumer):
     """Specialized consumer for crisis situations with immediate intervention"""
     
+    def ai_lane(self, room, is_crisis):
+        return 'crisis'
+
     async def connect(self):
         await super().connect()
         
@@ -676,28 +904,49 @@ A crisis counselor will join this chat shortly. Please stay with us.
 Remember: You are not alone, and help is available. Your life matters.
         """
         
-        ai_message = await self.save_ai_message(crisis_message.strip(), None)
+        ai_message = await self.save_ai_message(
+            crisis_message.strip(), None,
+            response_type='crisis_intervention', confidence=0.9, message_type='emergency'
+        )
         if ai_message:
-            await self.send(text_data=json.dumps({
-                'type': 'crisis_alert',
-                'message': await self.serialize_message(ai_message),
-                'severity': 'critical',
-                'resources': [
-                    {'name': 'Suicide Prevention Lifeline', 'contact': '988'},
-                    {'name': 'Crisis Text Line', 'contact': 'Text HOME to 741741'},
-                    {'name': 'Emergency Services', 'contact': '911'}
-                ]
-            }))
+            await self.broadcast(escalation_payload(await self.serialize_message(ai_message)))
 
-    @database_sync_to_async
-    def create_immediate_crisis_alert(self):
+    async def create_immediate_crisis_alert(self):
         try:
-            CrisisAlert.objects.create(
-                user=self.user,
-                severity='critical',
-                status='active',
-                alert_reason='User accessed crisis intervention channel',
-                emergency_contacts_notified=False
-            )
+            await self.raise_crisis_alert('critical', reason='User accessed crisis intervention channel')
         except Exception as e:
             logger.error(f"Error creating immediate crisis alert: {str(e)}")
+
+
+class CrisisResponderConsumer(AsyncWebsocketConsumer):
+    """Live feed of crisis alerts for staff dashboards, replacing polling of the active endpoint"""
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if self.user.is_anonymous or not self.user.is_staff:
+            await self.close()
+            return
+
+        await self.channel_layer.group_add(RESPONDERS_GROUP, self.channel_name)
+        self.joined = True
+        await self.accept()
+
+        # Current open alerts first; later changes arrive as crisis_alert_update frames
+        await self.send(text_data=encode_frame({
+            'type': 'crisis_alert_snapshot',
+            'alerts': await self.get_open_alerts()
+        }))
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'joined', False):
+            await self.channel_layer.group_discard(RESPONDERS_GROUP, self.channel_name)
+
+    async def broadcast_frame(self, event):
+        await self.send(text_data=event['frame'])
+
+    @database_sync_to_async
+    def get_open_alerts(self):
+        alerts = CrisisAlert.objects.filter(status__in=OPEN_STATUSES).select_related(
+            'user', 'room', 'responder'
+        ).order_by('-updated_at')[:getattr(settings, 'CRISIS_SNAPSHOT_LIMIT', 100)]
+        return CrisisAlertSerializer(alerts, many=True).data
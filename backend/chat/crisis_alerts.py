@@ -0,0 +1,106 @@
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .broadcast import frame_event
+from .models import CrisisAlert
+from .serializers import CrisisAlertSerializer
+
+logger = logging.getLogger(__name__)
+
+# Channel group that staff dashboards join through CrisisResponderConsumer
+RESPONDERS_GROUP = 'crisis_responders'
+
+SEVERITY_ORDER = ['low', 'medium', 'high', 'critical']
+# Alerts that new signals are folded into; resolved alerts are never reopened
+OPEN_STATUSES = ('active', 'acknowledged')
+
+
+def _rank(severity: str) -> int:
+    return SEVERITY_ORDER.index(severity) if severity in SEVERITY_ORDER else 1
+
+
+def _describe(keywords: Iterable[str]) -> str:
+    return f"Crisis keywords detected: {', '.join(keywords)}"
+
+
+def record_crisis_signal(user, room, severity: str, keywords: Iterable[str] = (),
+                         message=None, reason: str = None) -> Tuple[CrisisAlert, Optional[Dict]]:
+    """Fold a crisis signal into the user's open alert for the room, or open a new one.
+
+    Signals within CRISIS_ALERT_WINDOW seconds of the last one update that
+    alert in place: severity never drops, and every
+    CRISIS_ESCALATION_OCCURRENCES signals raise it one level. Returns the alert
+    and, when it is new or its severity rose, the event to push to responders.
+    """
+    window = timedelta(seconds=getattr(settings, 'CRISIS_ALERT_WINDOW', 900))
+    escalate_every = getattr(settings, 'CRISIS_ESCALATION_OCCURRENCES', 3)
+    keywords = list(dict.fromkeys(keywords))
+    now = timezone.now()
+
+    with transaction.atomic():
+        # Lock the user's row first: an alert lock alone cannot stop two concurrent
+        # messages that both find no open alert from each opening one
+        list(type(user).objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True))
+        alert = CrisisAlert.objects.select_for_update(of=('self',)).select_related(
+            'user', 'room', 'responder'
+        ).filter(
+            user=user, room=room, status__in=OPEN_STATUSES, last_triggered_at__gte=now - window
+        ).order_by('-last_triggered_at').first()
+
+        if alert is None:
+            alert = CrisisAlert.objects.create(
+                user=user,
+                room=room,
+                message=message,
+                severity=severity,
+                keywords=keywords,
+                alert_reason=reason or _describe(keywords),
+                last_triggered_at=now
+            )
+            return alert, alert_event(alert, 'created')
+
+        alert.occurrences += 1
+        new_severity = max(alert.severity, severity, key=_rank)
+        if escalate_every and alert.occurrences % escalate_every == 0:
+            new_severity = SEVERITY_ORDER[min(_rank(new_severity) + 1, len(SEVERITY_ORDER) - 1)]
+        escalated = _rank(new_severity) > _rank(alert.severity)
+
+        merged = list(dict.fromkeys(alert.keywords + keywords))
+        if merged != alert.keywords:
+            alert.keywords = merged
+            alert.alert_reason = _describe(merged)
+        alert.severity = new_severity
+        alert.message = message or alert.message
+        alert.last_triggered_at = now
+        alert.save(update_fields=[
+            'occurrences', 'severity', 'keywords', 'alert_reason', 'message', 'last_triggered_at', 'updated_at'
+        ])
+        return alert, alert_event(alert, 'escalated') if escalated else None
+
+
+def alert_event(alert: CrisisAlert, event: str) -> Dict:
+    """Channel-layer event announcing an alert change to the responders group"""
+    return frame_event({
+        'type': 'crisis_alert_update',
+        'event': event,
+        'alert': CrisisAlertSerializer(alert).data
+    })
+
+
+def publish_event(event: Dict):
+    """Send an alert event to responders from synchronous code (views)"""
+    try:
+        async_to_sync(get_channel_layer().group_send)(RESPONDERS_GROUP, event)
+    except Exception as e:
+        logger.error(f"Error publishing crisis alert: {str(e)}")
+
+
+def publish_alert(alert: CrisisAlert, event: str):
+    publish_event(alert_event(alert, event))
@@ -0,0 +1,282 @@
+import json
+import math
+import time
+import logging
+import threading
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import List, Dict, Any, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# z-score of the 90th percentile of a normal distribution
+P90_Z = 1.2816
+
+
+class LLMProviderError(Exception):
+    """Raised when a provider fails to return a usable completion"""
+
+
+class LatencyTracker:
+    """Exponentially weighted latency statistics for one provider"""
+
+    def __init__(self, alpha: float = 0.2, default_p90: float = 2.0, min_samples: int = 3):
+        self.alpha = alpha
+        self.default_p90 = default_p90
+        self.min_samples = min_samples
+        self.mean = None
+        self.variance = 0.0
+        self.samples = 0
+        self.failure_rate = 0.0
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: float):
+        with self._lock:
+            self.samples += 1
+            if self.mean is None:
+                self.mean = latency
+            else:
+                # Incremental EWMA of mean and variance (West, 1979)
+                diff = latency - self.mean
+                increment = self.alpha * diff
+                self.mean += increment
+                self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+            self.failure_rate *= (1 - self.alpha)
+
+    def record_failure(self):
+        with self._lock:
+            self.failure_rate = self.failure_rate * (1 - self.alpha) + self.alpha
+
+    def p90(self) -> float:
+        """Estimated 90th percentile latency, or the default until warmed up"""
+        with self._lock:
+            if self.mean is None or self.samples < self.min_samples:
+                return self.default_p90
+            return self.mean + P90_Z * math.sqrt(max(self.variance, 0.0))
+
+    def expected_latency(self) -> float:
+        """Mean latency inflated by the recent failure rate, used for routing"""
+        with self._lock:
+            mean = self.mean if self.mean is not None else self.default_p90
+            return mean / max(1.0 - self.failure_rate, 0.05)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'mean': self.mean,
+            'p90': self.p90(),
+            'samples': self.samples,
+            'failure_rate': round(self.failure_rate, 3)
+        }
+
+
+class LLMProvider:
+    """Base class for a text completion backend reached over HTTP"""
+
+    name = 'base'
+
+    def __init__(self, api_key: str, model: str, base_url: str, timeout: float = 30.0,
+                 default_p90: float = 2.0):
+        self.api_key = api_key
+        self.model = model
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.latency = LatencyTracker(default_p90=default_p90)
+
+    def generate(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def _post_json(self, url: str, payload: Dict, headers: Dict = None) -> Dict:
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json', **(headers or {})},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            raise LLMProviderError(f"{self.name} returned HTTP {e.code}") from e
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            raise LLMProviderError(f"{self.name} request failed: {e}") from e
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.model}>"
+
+
+class GeminiProvider(LLMProvider):
+    """Google Gemini via the generateContent REST endpoint"""
+
+    name = 'gemini'
+
+    def generate(self, prompt: str) -> str:
+        url = f"{self.base_url}/v1beta/models/{self.model}:generateContent?key={self.api_key}"
+        data = self._post_json(url, {'contents': [{'parts': [{'text': prompt}]}]})
+        try:
+            parts = data['candidates'][0]['content']['parts']
+            text = ''.join(part.get('text', '') for part in parts)
+        except (KeyError, IndexError, TypeError):
+            raise LLMProviderError("gemini response had no candidates")
+        if not text:
+            raise LLMProviderError("gemini returned an empty completion")
+        return text
+
+
+class OpenAIProvider(LLMProvider):
+    """OpenAI (or any compatible server) via the chat completions endpoint"""
+
+    name = 'openai'
+
+    def generate(self, prompt: str) -> str:
+        data = self._post_json(
+            f"{self.base_url}/chat/completions",
+            {'model': self.model, 'messages': [{'role': 'user', 'content': prompt}]},
+            headers={'Authorization': f"Bearer {self.api_key}"}
+        )
+        try:
+            text = data['choices'][0]['message']['content']
+        except (KeyError, IndexError, TypeError):
+            raise LLMProviderError("openai response had no choices")
+        if not text:
+            raise LLMProviderError("openai returned an empty completion")
+        return text
+
+
+class LLMResult:
+    """Completion text plus which provider produced it"""
+
+    def __init__(self, text: str, provider: str, latency: float, hedged: bool = False):
+        self.text = text
+        self.provider = provider
+        self.latency = latency
+        self.hedged = hedged
+
+
+class LLMRouter:
+    """Route prompts to the fastest healthy provider and hedge slow requests"""
+
+    def __init__(self, providers: List[LLMProvider], hedging: bool = True,
+                 min_hedge_delay: float = 0.05, max_workers: int = 8):
+        self.providers = providers
+        self.hedging = hedging
+        self.min_hedge_delay = min_hedge_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='llm')
+
+    def ordered_providers(self) -> List[LLMProvider]:
+        """Providers sorted by expected latency; configuration order breaks ties"""
+        return [
+            provider for _, provider in sorted(
+                enumerate(self.providers),
+                key=lambda item: (item[1].latency.expected_latency(), item[0])
+            )
+        ]
+
+    def generate(self, prompt: str) -> LLMResult:
+        """Return the first successful completion, hedging to a backup after the primary's p90"""
+        if not self.providers:
+            raise LLMProviderError("No LLM providers configured")
+
+        started = time.monotonic()
+        candidates = self.ordered_providers()
+        primary = candidates.pop(0)
+        pending = {self._executor.submit(self._call, primary, prompt): primary}
+        launched = 1
+        errors = []
+
+        hedge_at = None
+        if self.hedging and candidates:
+            hedge_at = started + max(primary.latency.p90(), self.min_hedge_delay)
+
+        while pending:
+            timeout = max(hedge_at - time.monotonic(), 0) if hedge_at is not None else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Primary is slower than its p90: fire a backup and take whichever answers first
+                hedge_at = None
+                backup = candidates.pop(0)
+                logger.debug(f"Hedging LLM request from {primary.name} to {backup.name}")
+                pending[self._executor.submit(self._call, backup, prompt)] = backup
+                launched += 1
+                continue
+
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    text = future.result()
+                except LLMProviderError as e:
+                    errors.append(str(e))
+                    continue
+                return LLMResult(
+                    text=text,
+                    provider=provider.name,
+                    latency=time.monotonic() - started,
+                    hedged=launched > 1
+                )
+
+            # Every in-flight request failed: fail over to the next provider immediately
+            if not pending and candidates:
+                hedge_at = None
+                provider = candidates.pop(0)
+                pending[self._executor.submit(self._call, provider, prompt)] = provider
+                launched += 1
+
+        raise LLMProviderError(f"All LLM providers failed: {'; '.join(errors)}")
+
+    def _call(self, provider: LLMProvider, prompt: str) -> str:
+        started = time.monotonic()
+        try:
+            text = provider.generate(prompt)
+        except LLMProviderError:
+            provider.latency.record_failure()
+            raise
+        except Exception as e:
+            provider.latency.record_failure()
+            raise LLMProviderError(f"{provider.name} failed: {e}") from e
+        provider.latency.record_success(time.monotonic() - started)
+        return text
+
+    def model_key(self) -> str:
+        """Identity of the models that may answer, for keying shared or cached completions"""
+        return ','.join(f"{provider.name}:{provider.model}" for provider in self.providers)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {provider.name: provider.latency.get_stats() for provider in self.providers}
+
+
+def build_llm_router() -> LLMRouter:
+    """Create a router for every provider with credentials, preferring AI_SERVICE"""
+    timeout = getattr(settings, 'LLM_REQUEST_TIMEOUT', 30.0)
+    default_p90 = getattr(settings, 'LLM_HEDGE_DEFAULT_DELAY', 2.0)
+    providers = []
+
+    if getattr(settings, 'GEMINI_API_KEY', ''):
+        providers.append(GeminiProvider(
+            api_key=settings.GEMINI_API_KEY,
+            model=getattr(settings, 'GEMINI_MODEL', 'gemini-1.5-flash'),
+            base_url=getattr(settings, 'GEMINI_API_BASE', 'https://generativelanguage.googleapis.com'),
+            timeout=timeout,
+            default_p90=default_p90
+        ))
+
+    if getattr(settings, 'OPENAI_API_KEY', ''):
+        providers.append(OpenAIProvider(
+            api_key=settings.OPENAI_API_KEY,
+            model=getattr(settings, 'DEFAULT_MODEL', 'gpt-3.5-turbo'),
+            base_url=getattr(settings, 'OPENAI_API_BASE', 'https://api.openai.com/v1'),
+            timeout=timeout,
+            default_p90=default_p90
+        ))
+
+    preferred = getattr(settings, 'AI_SERVICE', '')
+    providers.sort(key=lambda provider: provider.name != preferred)
+
+    return LLMRouter(
+        providers,
+        hedging=getattr(settings, 'LLM_HEDGING_ENABLED', True),
+        min_hedge_delay=getattr(settings, 'LLM_HEDGE_MIN_DELAY', 0.05),
+        max_workers=getattr(settings, 'LLM_MAX_WORKERS', 8)
+    )
@@ -0,0 +1,69 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from chat.broadcast import encode_frame, ORJSON_AVAILABLE
+
+
+class Command(BaseCommand):
+    help = 'Compare per-receiver JSON encoding with serialize-once fan-out for room broadcasts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='2,10,50,100,250,500',
+                            help='Comma-separated group sizes')
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Broadcasts to time for each group size')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        iterations = options['iterations']
+        payload = self.sample_payload()
+
+        self.stdout.write(
+            f"Encoder for serialize-once: {'orjson' if ORJSON_AVAILABLE else 'json'} "
+            f"({iterations} broadcasts per size)"
+        )
+        self.stdout.write(f"{'group':>6} {'per-receiver us':>16} {'encode-once us':>15} {'speedup':>8}")
+
+        for size in sizes:
+            per_receiver = self.time_per_broadcast(
+                lambda: [json.dumps(payload) for _ in range(size)], iterations
+            )
+            encode_once = self.time_per_broadcast(
+                lambda: [frame for frame in [encode_frame(payload)] for _ in range(size)], iterations
+            )
+            self.stdout.write(
+                f"{size:>6} {per_receiver:>16.1f} {encode_once:>15.1f} {per_receiver / encode_once:>7.1f}x"
+            )
+
+    def time_per_broadcast(self, broadcast, iterations):
+        """Mean microseconds per broadcast"""
+        started = time.perf_counter()
+        for _ in range(iterations):
+            broadcast()
+        return (time.perf_counter() - started) / iterations * 1_000_000
+
+    def sample_payload(self):
+        """A chat_message frame shaped like the ones ChatConsumer sends"""
+        return {
+            'type': 'chat_message',
+            'message': {
+                'id': 12345,
+                'content': "I've been feeling anxious before work lately, but the breathing exercise helped a bit today. " * 2,
+                'sender': {
+                    'id': 42,
+                    'username': 'demo',
+                    'first_name': 'Demo',
+                    'last_name': 'User'
+                },
+                'message_type': 'text',
+                'reply_to': None,
+                'created_at': '2025-01-01T12:00:00.000000+00:00',
+                'is_edited': False,
+                'edited_at': None,
+                'version': 1,
+                'reaction_counts': {}
+            },
+            'crisis_detected': False
+        }
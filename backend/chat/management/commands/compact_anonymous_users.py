@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.anonymous import abandoned_anonymous_users, purge_abandoned_anonymous_users
+
+
+class Command(BaseCommand):
+    help = 'Delete anonymous support users, with their rooms and messages, that have been inactive past the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=getattr(settings, 'CHAT_ANONYMOUS_RETENTION_DAYS', 30),
+                            help='Keep anonymous users with messages newer than this many days')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Users deleted per batch')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many users would be deleted')
+
+    def handle(self, *args, **options):
+        days = options['days']
+        if options['dry_run']:
+            count = abandoned_anonymous_users(days).count()
+            self.stdout.write(f"{count} abandoned anonymous users older than {days} days")
+            return
+
+        purged = purge_abandoned_anonymous_users(days, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} abandoned anonymous users"))
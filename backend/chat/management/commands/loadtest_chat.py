@@ -0,0 +1,257 @@
+import json
+import math
+import time
+import asyncio
+import logging
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from chat import consumers, presence
+from chat.ai_scheduler import ai_scheduler, LANES
+from chat.models import ChatRoom
+from chat.presence import InMemoryPresenceStore, LastSeenBuffer
+from chat.rate_limit import RateLimiter, DEFAULT_CONNECTION_LIMITS
+from chat.routing import websocket_urlpatterns
+
+User = get_user_model()
+
+CONSUMER_KINDS = ('chat', 'support', 'crisis')
+UNLIMITED = {message_type: (1e9, 1e9) for message_type in DEFAULT_CONNECTION_LIMITS}
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile: the smallest sample at or above pct percent of them"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Command(BaseCommand):
+    help = ('Drive ChatConsumer, SupportConsumer and CrisisConsumer with simulated clients on an '
+            'in-memory channel layer and a stubbed LLM, and report latency and queries per message. '
+            'Runs against a throwaway test database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--consumers', type=str, default='chat,support,crisis',
+                            help='Comma-separated consumers to drive: chat, support, crisis')
+        parser.add_argument('--rooms', type=int, default=20,
+                            help='Chat rooms, or support/crisis sessions (one client each)')
+        parser.add_argument('--clients', type=int, default=5,
+                            help='Clients per chat room')
+        parser.add_argument('--messages', type=int, default=10,
+                            help='Messages each client sends')
+        parser.add_argument('--interval', type=float, default=0.05,
+                            help='Seconds between one client\'s messages')
+        parser.add_argument('--llm-latency', type=float, default=0.2,
+                            help='Seconds the stubbed LLM takes per reply')
+        parser.add_argument('--timeout', type=float, default=60.0,
+                            help='Seconds to wait for outstanding frames after sending')
+        parser.add_argument('--rate-limits', action='store_true',
+                            help='Keep the configured WebSocket rate limits (disabled by default)')
+
+    def handle(self, *args, **options):
+        kinds = [kind.strip() for kind in options['consumers'].split(',') if kind.strip()]
+        unknown = set(kinds) - set(CONSUMER_KINDS)
+        if unknown:
+            raise CommandError(f"Unknown consumers: {', '.join(sorted(unknown))}")
+
+        latency = options['llm_latency']
+        if options['verbosity'] < 2:
+            # Per-message info logging would dominate the measurement
+            logging.getLogger('chat').setLevel(logging.WARNING)
+
+        def stub_llm(message, user=None, room=None, message_obj=None):
+            time.sleep(latency)
+            return {'response': f"Stub reply to: {message[:40]}"}
+
+        layer_settings = {'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}}
+        if not options['rate_limits']:
+            layer_settings.update(CHAT_RATE_LIMITS_CONNECTION=UNLIMITED, CHAT_RATE_LIMITS_USER=UNLIMITED)
+
+        self.stdout.write(
+            f"LLM stub latency {latency * 1000:.0f} ms, AI workers {ai_scheduler.workers} "
+            f"(+{ai_scheduler.crisis_workers} crisis)"
+        )
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            with override_settings(**layer_settings), \
+                    mock.patch.object(consumers, 'get_enhanced_ai_response', stub_llm), \
+                    mock.patch.object(consumers, 'user_rate_limiter',
+                                      RateLimiter(UNLIMITED) if not options['rate_limits'] else consumers.user_rate_limiter):
+                for kind in kinds:
+                    self.report(kind, self.run_phase(kind, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_phase(self, kind, options):
+        rooms, messages = options['rooms'], options['messages']
+        clients_per_room = options['clients'] if kind == 'chat' else 1
+
+        users = User.objects.bulk_create([
+            User(username=f'load_{kind}_{i}', email=f'load_{kind}_{i}@example.com')
+            for i in range(rooms * clients_per_room)
+        ])
+        if kind == 'chat':
+            ChatRoom.objects.bulk_create([
+                ChatRoom(name=f'loadtest_{i}', room_type='peer', created_by=users[i * clients_per_room])
+                for i in range(rooms)
+            ])
+            paths = [f'/ws/chat/loadtest_{i // clients_per_room}/' for i in range(len(users))]
+        else:
+            paths = [f'/ws/{kind}/{user.id}/' for user in users]
+
+        buffer = LastSeenBuffer(flush_interval=3600)
+        with mock.patch.object(presence, '_presence_store', InMemoryPresenceStore()), \
+                mock.patch.object(consumers, 'last_seen_buffer', buffer), \
+                CaptureQueriesContext(connection) as queries:
+            return async_to_sync(self.drive)(kind, users, paths, clients_per_room, buffer, queries, options)
+
+    async def drive(self, kind, users, paths, clients_per_room, buffer, queries, options):
+        application = URLRouter(websocket_urlpatterns)
+        communicators = []
+        for user, path in zip(users, paths):
+            communicator = WebsocketCommunicator(application, path)
+            communicator.scope['user'] = user
+            connected, _ = await communicator.connect(timeout=10)
+            if not connected:
+                raise CommandError(f"Connection to {path} was refused")
+            communicators.append(communicator)
+        for communicator in communicators:
+            await self.drain(communicator)
+
+        messages = options['messages']
+        expects_ai = kind != 'chat'
+        state = {'sent': {}, 'ids': {}, 'broadcast': [], 'ai': [], 'frames': 0}
+        shed_before = dict(ai_scheduler.shed)
+
+        queries_before = await sync_to_async(len)(queries)
+        started = time.perf_counter()
+        deadline = None
+
+        async def client(index, communicator):
+            nonlocal deadline
+            expected_chat = clients_per_room * messages
+            expected_ai = messages if expects_ai else 0
+            counts = {'chat': 0, 'ai': 0}
+
+            async def send_all():
+                for seq in range(messages):
+                    tag = f'lt{index}x{seq}'
+                    state['sent'][tag] = time.perf_counter()
+                    await communicator.send_to(text_data=json.dumps({
+                        'type': 'chat_message',
+                        'message': f'{tag} I had a long day and wanted to talk about it'
+                    }))
+                    await asyncio.sleep(options['interval'])
+
+            sender = asyncio.ensure_future(send_all())
+            while counts['chat'] < expected_chat or counts['ai'] < expected_ai:
+                remaining = options['timeout'] if deadline is None else deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                text = await self.next_frame(communicator, remaining)
+                if text is None:
+                    break
+                frame = json.loads(text)
+                now = time.perf_counter()
+                state['frames'] += 1
+                message = frame.get('message') or {}
+                if frame.get('type') == 'chat_message':
+                    tag = str(message.get('content', '')).split(' ', 1)[0]
+                    if tag in state['sent']:
+                        state['ids'][message['id']] = tag
+                        state['broadcast'].append(now - state['sent'][tag])
+                        counts['chat'] += 1
+                elif frame.get('type') == 'ai_response':
+                    tag = state['ids'].get(message.get('reply_to'))
+                    if tag is not None:
+                        state['ai'].append(now - state['sent'][tag])
+                        counts['ai'] += 1
+            await sender
+
+        async def start_deadline(tasks):
+            nonlocal deadline
+            # The timeout applies after the last client finished sending
+            await asyncio.sleep(messages * options['interval'])
+            deadline = time.perf_counter() + options['timeout']
+            await asyncio.gather(*tasks)
+
+        tasks = [asyncio.ensure_future(client(i, c)) for i, c in enumerate(communicators)]
+        await start_deadline(tasks)
+        elapsed = time.perf_counter() - started
+
+        await buffer.flush()
+        message_queries = await sync_to_async(len)(queries) - queries_before
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        if buffer._flush_task is not None:
+            buffer._flush_task.cancel()
+
+        sent = len(state['sent'])
+        return {
+            'clients': len(communicators),
+            'sent': sent,
+            'elapsed': elapsed,
+            'frames': state['frames'],
+            'broadcast': state['broadcast'],
+            'ai': state['ai'],
+            'expects_ai': expects_ai,
+            'queries_per_message': message_queries / sent if sent else 0,
+            'shed': sum(ai_scheduler.shed[lane] - shed_before.get(lane, 0) for lane in LANES),
+        }
+
+    async def next_frame(self, communicator, timeout):
+        """Next text frame, or None after `timeout` seconds.
+
+        receive_from() cancels the consumer when it times out, so the output
+        queue is awaited directly to keep idle clients connected.
+        """
+        while True:
+            try:
+                message = await asyncio.wait_for(communicator.output_queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return None
+            if message.get('type') == 'websocket.send' and message.get('text') is not None:
+                return message['text']
+
+    async def drain(self, communicator, idle=0.2):
+        """Discard the frames a consumer sends on connect"""
+        while await self.next_frame(communicator, idle) is not None:
+            pass
+
+    def report(self, kind, result):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n{kind}: {result['clients']} clients, {result['sent']} messages in {result['elapsed']:.2f}s"
+        ))
+        self.stdout.write(
+            f"  throughput        {result['sent'] / result['elapsed']:.1f} msg/s, "
+            f"{result['frames'] / result['elapsed']:.1f} frames/s delivered"
+        )
+        self.write_latency('message->broadcast', result['broadcast'])
+        if result['expects_ai']:
+            self.write_latency('message->AI reply', result['ai'])
+            missing = result['sent'] - len(result['ai'])
+            if missing:
+                self.stdout.write(self.style.WARNING(f"  {missing} AI replies did not arrive before the timeout"))
+            self.stdout.write(f"  template replies  {result['shed']} (AI queue saturated)")
+        self.stdout.write(f"  queries/message   {result['queries_per_message']:.2f}")
+
+    def write_latency(self, label, samples):
+        if not samples:
+            self.stdout.write(f"  {label:<17} no samples")
+            return
+        p50, p95, p99 = (percentile(samples, pct) * 1000 for pct in (50, 95, 99))
+        self.stdout.write(
+            f"  {label:<17} p50 {p50:.1f} ms  p95 {p95:.1f} ms  p99 {p99:.1f} ms  (n={len(samples)})"
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from chat.search import install_triggers, rebuild_index, search_backend
+
+
+class Command(BaseCommand):
+    help = 'Reinstall the chat search triggers and re-index every message, journal entry and memory'
+
+    def handle(self, *args, **options):
+        if not search_backend():
+            self.stdout.write(self.style.WARNING("No search index on this database; run migrate first"))
+            return
+
+        with transaction.atomic():
+            install_triggers(connection)
+            rebuild_index(connection)
+        self.stdout.write(self.style.SUCCESS("Rebuilt the chat search index"))
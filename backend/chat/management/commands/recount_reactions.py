@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from chat.reactions import recount_reactions
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-message reaction counts from the reaction rows'
+
+    def handle(self, *args, **options):
+        changed = recount_reactions()
+        self.stdout.write(self.style.SUCCESS(f"Corrected reaction counts on {changed} messages"))
@@ -56,6 +56,8 @@ class UserMemory(models.Model):
             models.Index(fields=['user', 'is_active']),
             models.Index(fields=['created_at']),
             models.Index(fields=['importance']),
+            # Keyset pagination of a user's memories, newest first
+            models.Index(fields=['user', 'is_active', 'created_at', 'id'], name='chat_usermem_user_recent_idx'),
         ]
     
     def __str__(self):
@@ -277,3 +279,142 @@ class PersonalizationProfile(models.Model):
         # This would contain logic to analyze recent interactions and update patterns
         self.last_pattern_update = timezone.now()
         self.save()
+
+class MemoryDigest(models.Model):
+    """Precomputed "about me" summary of a user's memories, kept up to date incrementally"""
+    
+    # Memory types that feed each section of the digest
+    FACT_TYPES = ['personal_info']
+    PREFERENCE_TYPES = ['preference']
+    MOOD_TYPES = ['mood_pattern']
+    CONTEXT_TYPES = ['goal', 'coping_strategy', 'progress']
+    DIGEST_TYPES = FACT_TYPES + PREFERENCE_TYPES + MOOD_TYPES + CONTEXT_TYPES
+    
+    MAX_ITEMS = 10
+    MAX_RECENT_MOODS = 5
+    
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='memory_digest')
+    
+    # Each list holds {'id': memory id, 'text': cleaned text}, newest first
+    facts = models.JSONField(default=list)
+    preferences = models.JSONField(default=list)
+    context_notes = models.JSONField(default=list)
+    mood_summary = models.JSONField(default=dict)  # {'counts': {...}, 'recent': [...], 'last': ...}
+    
+    memory_count = models.IntegerField(default=0)
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Memory digest: {self.user.email}"
+    
+    def apply_memory(self, memory: UserMemory):
+        """Fold a single memory into the digest without touching other rows"""
+        if memory.memory_type in self.FACT_TYPES:
+            self._push(self.facts, memory.id, describe_personal_info(memory.content))
+        elif memory.memory_type in self.PREFERENCE_TYPES:
+            text = memory.content.replace("User mentioned preferences/experiences:", "").strip()
+            self._push(self.preferences, memory.id, text)
+        elif memory.memory_type in self.MOOD_TYPES:
+            self._add_mood(memory)
+        elif memory.memory_type in self.CONTEXT_TYPES:
+            self._push(self.context_notes, memory.id, memory.content)
+        else:
+            return
+        self.memory_count += 1
+    
+    def reset(self):
+        """Clear all sections before a full rebuild"""
+        self.facts = []
+        self.preferences = []
+        self.context_notes = []
+        self.mood_summary = {}
+        self.memory_count = 0
+    
+    def memory_ids(self) -> list:
+        """IDs of the memories currently represented in the digest"""
+        return [item['id'] for section in (self.facts, self.preferences, self.context_notes)
+                for item in section] + (self.mood_summary or {}).get('recent_ids', [])
+    
+    def is_empty(self) -> bool:
+        return not (self.facts or self.preferences or self.context_notes or self.mood_summary.get('recent'))
+    
+    def as_dict(self) -> dict:
+        return {
+            'facts': [item['text'] for item in self.facts],
+            'preferences': [item['text'] for item in self.preferences],
+            'context': [item['text'] for item in self.context_notes],
+            'mood_summary': self.mood_summary,
+            'memory_count': self.memory_count,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
+    
+    def _push(self, items: list, memory_id: int, text: str):
+        text = text.strip()
+        if not text:
+            return
+        # Repeated statements move to the front instead of being listed twice
+        items[:] = [item for item in items if item['text'].lower() != text.lower()]
+        items.insert(0, {'id': memory_id, 'text': text})
+        del items[self.MAX_ITEMS:]
+    
+    def _add_mood(self, memory: UserMemory):
+        sentiment = (memory.context or {}).get('sentiment_analysis', {}).get('sentiment')
+        if not sentiment:
+            # "User mood: negative (...)" or "User logged mood: happy (score: ...)"
+            sentiment = memory.content.split("mood:")[-1].split('(')[0].strip() or 'neutral'
+        summary = self.mood_summary or {}
+        counts = summary.get('counts', {})
+        counts[sentiment] = counts.get(sentiment, 0) + 1
+        recent = [sentiment] + summary.get('recent', [])
+        recent_ids = [memory.id] + summary.get('recent_ids', [])
+        self.mood_summary = {
+            'counts': counts,
+            'recent': recent[:self.MAX_RECENT_MOODS],
+            'recent_ids': recent_ids[:self.MAX_RECENT_MOODS],
+            'last': sentiment,
+            'last_recorded': memory.created_at.isoformat() if memory.created_at else None,
+        }
+
+
+# Mental health topics and the words that indicate them
+TOPIC_KEYWORDS = {
+    'anxiety': ['anxiety', 'anxious', 'worried', 'panic', 'nervous'],
+    'depression': ['depression', 'depressed', 'sad', 'hopeless', 'down'],
+    'stress': ['stress', 'stressed', 'pressure', 'overwhelmed'],
+    'sleep': ['sleep', 'insomnia', 'tired', 'exhausted', 'rest'],
+    'work': ['work', 'job', 'career', 'boss', 'colleague'],
+    'relationships': ['relationship', 'partner', 'family', 'friend', 'love'],
+    'therapy': ['therapy', 'therapist', 'counseling', 'treatment'],
+    'medication': ['medication', 'pills', 'medicine', 'antidepressant'],
+    'self_care': ['self care', 'exercise', 'meditation', 'mindfulness'],
+    'crisis': ['suicide', 'self harm', 'crisis', 'emergency']
+}
+
+
+def extract_topics(text: str) -> list:
+    """Topics from TOPIC_KEYWORDS mentioned in the text"""
+    text_lower = text.lower()
+    return [topic for topic, keywords in TOPIC_KEYWORDS.items()
+            if any(keyword in text_lower for keyword in keywords)]
+
+def describe_personal_info(content: str) -> str:
+    """Turn a stored personal_info memory into a natural sentence"""
+    info = content.strip()
+    if info.startswith("Personal context:"):
+        return info.replace("Personal context:", "").strip()
+    if (info.startswith("User's name:") or info.startswith("User introduced")) and \
+            "name:" in info and "age:" in info and "occupation:" in info:
+        cleaned_parts = []
+        for part in info.split(", "):
+            if "name:" in part:
+                cleaned_parts.append(f"Your name is {part.split('name:')[-1].strip()}")
+            elif "age:" in part:
+                cleaned_parts.append(f"you're {part.split('age:')[-1].strip()} years old")
+            elif "occupation:" in part:
+                cleaned_parts.append(f"you work as a {part.split('occupation:')[-1].strip()}")
+            elif "company:" in part:
+                cleaned_parts.append(f"at {part.split('company:')[-1].strip()}")
+        if cleaned_parts:
+            return ', '.join(cleaned_parts)
+    return info
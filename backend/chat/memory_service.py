@@ -4,6 +4,8 @@ from typing import List, Dict, Any, Optional, Tuple
 from datetime import datetime, timedelta
 import json
 import uuid
+import queue
+import threading
 
 # Mem0 imports
 try:
@@ -29,17 +31,87 @@ except ImportError:
 
 from django.conf import settings
 from django.utils import timezone
+from django.db import close_old_connections, transaction
 from django.db.models import Q
 
 from .memory_models import (
     UserMemory, ConversationMemory, VectorMemory, 
-    KnowledgeBase, MemoryInteraction, PersonalizationProfile
+    KnowledgeBase, MemoryInteraction, PersonalizationProfile, MemoryDigest
 )
 from .models import Message, ChatRoom
+from .pagination import KEYSET, keyset_page, cursor_ranking, encode_rank_cursor, decode_rank_cursor
+from . import search as search_index
+from .recommendations import update_recommendations
 from users.models import CustomUser
 
 logger = logging.getLogger(__name__)
 
+# Dashboard categories mapped onto UserMemory types
+CATEGORY_MEMORY_TYPES = {
+    'mood_tracking': 'mood_pattern',
+    'mood': 'mood_pattern',
+    'journal': 'session_note',
+    'goals': 'goal',
+    'goal': 'goal',
+    'achievements': 'progress',
+    'meditation': 'coping_strategy',
+    'preference': 'preference',
+    'personal_info': 'personal_info',
+}
+
+SEARCH_STOPWORDS = {'and', 'the', 'for', 'with', 'about', 'what', 'how', 'are', 'you', 'that', 'this', 'from'}
+
+class EmbeddingQueue:
+    """Background worker that embeds newly added memories in batches"""
+    
+    def __init__(self, service, batch_size: int = 32, max_size: int = 10000):
+        self.service = service
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.dropped = 0
+    
+    def enqueue(self, memory_ids: List[int]):
+        """Queue memories for embedding without blocking the request"""
+        self._ensure_worker()
+        dropped = 0
+        for memory_id in memory_ids:
+            try:
+                self._queue.put_nowait(memory_id)
+            except queue.Full:
+                # Unembedded memories are still found by lexical search
+                dropped += 1
+        if dropped:
+            self.dropped += dropped
+            logger.warning(f"Embedding queue full, {dropped} memories left unembedded")
+    
+    def pending(self) -> int:
+        return self._queue.qsize()
+    
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='memory-embedder', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.service.embed_memories(batch)
+                self.processed += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to embed memory batch: {e}")
+            finally:
+                close_old_connections()
+
 class MemoryService:
     """Enhanced memory service integrating Mem0, vector databases, and personalization"""
     
@@ -61,6 +133,12 @@ class MemoryService:
         
         # Initialize embedding model
         self._init_embedding_model()
+        
+        self.embedding_queue = EmbeddingQueue(
+            self,
+            batch_size=getattr(settings, 'MEMORY_EMBEDDING_BATCH_SIZE', 32),
+            max_size=getattr(settings, 'MEMORY_EMBEDDING_QUEUE_SIZE', 10000)
+        )
     
     def _init_vector_db(self):
         """Initialize vector database (ChromaDB)"""
@@ -142,6 +220,8 @@ class MemoryService:
                     logger.error(f"Failed to store vector embedding: {e}")
             
             memory.save()
+            self._update_memory_digest(user.id, [memory])
+            update_recommendations(user.id, [memory])
             logger.info(f"Stored memory for user {user.id}: {content[:50]}...")
             return memory
             
@@ -149,6 +229,172 @@ class MemoryService:
             logger.error(f"Failed to store user memory: {e}")
             raise
     
+    def add_memory(self, user_id, content: str, category: str = 'general',
+                   metadata: Dict = None, importance: str = 'medium') -> UserMemory:
+        """Store a single memory from outside the chat flow; embedding happens in the background"""
+        return self.add_memories(int(user_id), [{
+            'content': content,
+            'category': category,
+            'metadata': metadata,
+            'importance': importance
+        }])[0]
+    
+    def add_memories(self, user_id: int, items: List[Dict]) -> List[UserMemory]:
+        """Store a batch of memories with one insert and queue them for embedding"""
+        session_id = f"{user_id}_{timezone.now().date().isoformat()}"
+        valid_importance = dict(UserMemory.IMPORTANCE_LEVELS)
+        memories = []
+        for item in items:
+            content = (item.get('content') or '').strip()
+            if not content:
+                raise ValueError("Memory content cannot be empty")
+            category = item.get('category') or 'general'
+            importance = item.get('importance') or 'medium'
+            memories.append(UserMemory(
+                user_id=user_id,
+                content=content,
+                memory_type=CATEGORY_MEMORY_TYPES.get(category, 'session_note'),
+                context={'category': category, **(item.get('metadata') or {})},
+                importance=importance if importance in valid_importance else 'medium',
+                session_id=session_id
+            ))
+        
+        memories = UserMemory.objects.bulk_create(memories)
+        self._update_memory_digest(user_id, memories)
+        update_recommendations(user_id, memories)
+        
+        if self.embedding_model and self.vector_db:
+            self.embedding_queue.enqueue([memory.id for memory in memories])
+        
+        logger.info(f"Added {len(memories)} memories for user {user_id}")
+        return memories
+    
+    def embed_memories(self, memory_ids: List[int]):
+        """Embed a batch of memories with a single model call per batch"""
+        if not self.embedding_model or not self.vector_db:
+            return
+        
+        memories = list(UserMemory.objects.filter(id__in=memory_ids, is_active=True, embedding_id=''))
+        if not memories:
+            return
+        
+        embeddings = self.embedding_model.encode([memory.content for memory in memories])
+        
+        by_user = {}
+        for memory, embedding in zip(memories, embeddings):
+            by_user.setdefault(memory.user_id, []).append((memory, embedding.tolist()))
+        
+        vector_rows = []
+        for user_id, entries in by_user.items():
+            collection_name = f"user_{user_id}_memories"
+            try:
+                collection = self.vector_db.get_collection(collection_name)
+            except Exception:
+                collection = self.vector_db.create_collection(
+                    name=collection_name,
+                    metadata={"hnsw:space": "cosine"}
+                )
+            
+            ids, vectors, documents, metadatas = [], [], [], []
+            for memory, embedding in entries:
+                memory.embedding_id = str(uuid.uuid4())
+                vector_metadata = {
+                    "content_type": "memory",
+                    "content_id": str(memory.id),
+                    "memory_type": memory.memory_type,
+                    "importance": memory.importance,
+                    "created_at": memory.created_at.isoformat(),
+                    "user_id": str(user_id)
+                }
+                ids.append(memory.embedding_id)
+                vectors.append(embedding)
+                documents.append(memory.content)
+                metadatas.append(vector_metadata)
+                vector_rows.append(VectorMemory(
+                    content_type='memory',
+                    content_id=str(memory.id),
+                    content_text=memory.content,
+                    vector_id=memory.embedding_id,
+                    collection_name=collection_name,
+                    user_id=user_id,
+                    metadata=vector_metadata
+                ))
+            collection.add(ids=ids, embeddings=vectors, documents=documents, metadatas=metadatas)
+        
+        VectorMemory.objects.bulk_create(vector_rows)
+        UserMemory.objects.bulk_update(memories, ['embedding_id'])
+    
+    def search_memories(self, user: CustomUser, query: str = '', limit: int = 10,
+                        cursor: str = None) -> Tuple[List[UserMemory], Optional[str]]:
+        """Paginated memory search; returns (memories, next_cursor).
+
+        With vector results, pages follow similarity to the query over the
+        nearest candidates. Otherwise the query terms are looked up in the
+        full-text index and pages follow its rank; databases without the index
+        match substrings instead. Without terms, pages are keyset ranges,
+        newest first.
+        """
+        memories = UserMemory.objects.filter(user=user, is_active=True)
+        ranking, terms = KEYSET, []
+        
+        query = (query or '').strip()
+        if query:
+            candidate_ids = self._vector_candidate_ids(user, query)
+            if candidate_ids:
+                ranking = 'vector'
+            else:
+                terms = [
+                    term for term in search_index.query_terms(query)
+                    if len(term) > 2 and term not in SEARCH_STOPWORDS
+                ][:5]
+                if terms and search_index.search_backend():
+                    ranking = 'lexical'
+        
+        if cursor and cursor_ranking(cursor) != ranking:
+            # Vector results came or went since the cursor was issued; its position means nothing here
+            cursor = None
+        
+        if ranking == 'vector':
+            return self._ranked_page(memories, candidate_ids, limit, cursor)
+        if ranking == 'lexical':
+            return self._lexical_page(user, memories, terms, limit, cursor)
+        if terms:
+            term_query = Q()
+            for term in terms:
+                term_query |= Q(content__icontains=term)
+            memories = memories.filter(term_query)
+        return keyset_page(memories, cursor, limit)
+    
+    def _ranked_page(self, memories, candidate_ids: List[int], limit: int,
+                     cursor: str = None) -> Tuple[List[UserMemory], Optional[str]]:
+        """A page of vector candidates in similarity order; the cursor is a rank offset"""
+        offset = decode_rank_cursor(cursor, 'vector') if cursor else 0
+        by_id = memories.in_bulk(candidate_ids)
+        ranked = [by_id[memory_id] for memory_id in candidate_ids if memory_id in by_id]
+        page = ranked[offset:offset + limit]
+        next_cursor = encode_rank_cursor(offset + limit, 'vector') if len(ranked) > offset + limit else None
+        return page, next_cursor
+    
+    def _lexical_page(self, user: CustomUser, memories, terms: List[str], limit: int,
+                      cursor: str = None) -> Tuple[List[UserMemory], Optional[str]]:
+        """A page of full-text matches in rank order; the cursor is a rank offset"""
+        offset = decode_rank_cursor(cursor, 'lexical') if cursor else 0
+        ids = search_index.search_memory_ids(user.id, terms, limit + 1, offset)
+        by_id = memories.in_bulk(ids[:limit])
+        page = [by_id[memory_id] for memory_id in ids[:limit] if memory_id in by_id]
+        next_cursor = encode_rank_cursor(offset + limit, 'lexical') if len(ids) > limit else None
+        return page, next_cursor
+    
+    def _vector_candidate_ids(self, user: CustomUser, query: str, limit: int = 100) -> List[int]:
+        """IDs of the memories nearest the query in the vector index"""
+        results = self._search_vector_memories(query=query, user=user, content_type='memory', limit=limit)
+        ids = []
+        for result in results:
+            content_id = result.get('metadata', {}).get('content_id')
+            if content_id and str(content_id).isdigit():
+                ids.append(int(content_id))
+        return ids
+    
     def retrieve_relevant_memories(self, user: CustomUser, query: str, 
                                  memory_types: List[str] = None, 
                                  limit: int = 5) -> List[UserMemory]:
@@ -188,8 +434,15 @@ class MemoryService:
                     'what do you know', 'tell me about me', 'remember about me', 
                     'what do you remember', 'my information', 'about me'
                 ]):
-                    # For "what do you know about me" type queries, return recent personal info
-                    db_query &= Q(memory_type__in=['personal_info', 'preference', 'mood_pattern'])
+                    # For "what do you know about me" type queries, the digest already names the rows to return
+                    digest = self.get_memory_digest(user)
+                    about_me = Q(id__in=digest.memory_ids()) if digest else Q(
+                        memory_type__in=['personal_info', 'preference', 'mood_pattern']
+                    )
+                    if digest and digest.mood_summary.get('recent') and 'recent_ids' not in digest.mood_summary:
+                        # Digests built before mood ids were kept name no mood rows until rebuilt
+                        about_me |= Q(memory_type__in=MemoryDigest.MOOD_TYPES)
+                    db_query &= about_me
                 elif any(keyword in query_lower for keyword in [
                     'anxiety', 'depression', 'stress', 'sad', 'happy', 'mood'
                 ]):
@@ -431,6 +684,55 @@ class MemoryService:
         except Exception as e:
             logger.error(f"Failed to learn from interaction: {e}")
     
+    def get_memory_digest(self, user: CustomUser) -> Optional[MemoryDigest]:
+        """Return the user's precomputed memory digest, building it on first use"""
+        try:
+            return MemoryDigest.objects.get(user=user)
+        except MemoryDigest.DoesNotExist:
+            return self.rebuild_memory_digest(user.id)
+        except Exception as e:
+            logger.error(f"Failed to get memory digest: {e}")
+            return None
+    
+    def rebuild_memory_digest(self, user_id: int) -> Optional[MemoryDigest]:
+        """Recompute a user's digest from their active memories"""
+        try:
+            with transaction.atomic():
+                digest, _ = MemoryDigest.objects.select_for_update().get_or_create(user_id=user_id)
+                digest.reset()
+                memories = UserMemory.objects.filter(
+                    user_id=user_id,
+                    is_active=True,
+                    memory_type__in=MemoryDigest.DIGEST_TYPES
+                ).only('id', 'memory_type', 'content', 'context', 'created_at').order_by('created_at', 'id')
+                for memory in memories.iterator():
+                    digest.apply_memory(memory)
+                digest.rebuilt_at = timezone.now()
+                digest.save()
+            return digest
+        except Exception as e:
+            logger.error(f"Failed to rebuild memory digest for user {user_id}: {e}")
+            return None
+    
+    def _update_memory_digest(self, user_id: int, memories: List[UserMemory]):
+        """Fold newly stored memories into their owner's digest"""
+        memories = [memory for memory in memories if memory.memory_type in MemoryDigest.DIGEST_TYPES]
+        if not memories:
+            return
+        try:
+            with transaction.atomic():
+                # Locked so concurrent stores for the same user cannot overwrite each other's updates
+                digest = MemoryDigest.objects.select_for_update().filter(user_id=user_id).first()
+                if digest is not None:
+                    for memory in memories:
+                        digest.apply_memory(memory)
+                    digest.save()
+                    return
+            # First digest for this user: include everything stored so far
+            self.rebuild_memory_digest(user_id)
+        except Exception as e:
+            logger.error(f"Failed to update memory digest: {e}")
+    
     def _get_session_id(self, user: CustomUser) -> str:
         """Generate or get current session ID for user"""
         # Simple session ID based on user and current day
@@ -445,8 +747,12 @@ class MemoryService:
                 is_active=True
             )
             
-            count = expired_memories.count()
-            expired_memories.update(is_active=False)
+            affected_users = set(expired_memories.values_list('user_id', flat=True))
+            count = expired_memories.update(is_active=False)
+            
+            # Expired memories may still be listed in digests, so rebuild those users
+            for user_id in affected_users:
+                self.rebuild_memory_digest(user_id)
             
             logger.info(f"Cleaned up {count} expired memories")
             
@@ -485,3 +791,17 @@ class MemoryService:
         except Exception as e:
             logger.error(f"Failed to get memory stats: {e}")
             return {}
+
+
+_shared_memory_service = None
+_shared_memory_service_lock = threading.Lock()
+
+
+def get_memory_service() -> MemoryService:
+    """Process-wide MemoryService, so the embedding model and queue are created once"""
+    global _shared_memory_service
+    if _shared_memory_service is None:
+        with _shared_memory_service_lock:
+            if _shared_memory_service is None:
+                _shared_memory_service = MemoryService()
+    return _shared_memory_service
@@ -0,0 +1,92 @@
+"""Edits and deletes of chat messages as compare-and-swap updates.
+
+A change reads the live message's version, then updates it only while the
+row still has that version, so the ownership check and the write cannot be
+split by another edit and each caller learns exactly the version it wrote.
+Every change bumps Message.version; the events broadcast for it carry that
+version and the stored timestamp, so clients, replay buffers and other
+replicas can tell which state is newer. The a-prefixed variants do the same
+through the async ORM for consumers.
+"""
+from typing import Dict, Optional
+
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from .models import Message
+
+
+def _owned(message_id, sender_id: int, room_id: Optional[int] = None) -> Optional[QuerySet]:
+    """The live message if the sender owns it, as a queryset; None for malformed ids"""
+    try:
+        message_id = int(message_id)
+    except (TypeError, ValueError):
+        return None
+    messages = Message.objects.filter(id=message_id, sender_id=sender_id, is_deleted=False)
+    if room_id is not None:
+        messages = messages.filter(room_id=room_id)
+    return messages
+
+
+def _conditional_update(assignments: Dict[str, object], message_id, sender_id: int,
+                        room_id: Optional[int] = None) -> Optional[int]:
+    """Apply assignments to a live message the sender owns; the new version, or None"""
+    messages = _owned(message_id, sender_id, room_id)
+    if messages is None:
+        return None
+    # A miss means another change landed between the read and the write; read again
+    while True:
+        version = messages.values_list('version', flat=True).first()
+        if version is None:
+            return None
+        if messages.filter(version=version).update(**assignments, version=version + 1):
+            return version + 1
+
+
+async def _aconditional_update(assignments: Dict[str, object], message_id, sender_id: int,
+                               room_id: Optional[int] = None) -> Optional[int]:
+    messages = _owned(message_id, sender_id, room_id)
+    if messages is None:
+        return None
+    while True:
+        version = await messages.values_list('version', flat=True).afirst()
+        if version is None:
+            return None
+        if await messages.filter(version=version).aupdate(**assignments, version=version + 1):
+            return version + 1
+
+
+def _edit_assignments(content: str) -> Dict[str, object]:
+    return {'content': content, 'is_edited': True, 'edited_at': timezone.now()}
+
+
+def edit_message(message_id, sender_id: int, content: str, room_id: Optional[int] = None) -> Optional[Dict]:
+    """Replace a message's content; version and edited_at as stored, or None if not allowed"""
+    assignments = _edit_assignments(content)
+    version = _conditional_update(assignments, message_id, sender_id, room_id)
+    if version is None:
+        return None
+    return {'version': version, 'edited_at': assignments['edited_at']}
+
+
+async def aedit_message(message_id, sender_id: int, content: str, room_id: Optional[int] = None) -> Optional[Dict]:
+    assignments = _edit_assignments(content)
+    version = await _aconditional_update(assignments, message_id, sender_id, room_id)
+    if version is None:
+        return None
+    return {'version': version, 'edited_at': assignments['edited_at']}
+
+
+def delete_message(message_id, sender_id: int, room_id: Optional[int] = None) -> Optional[Dict]:
+    """Leave a tombstone in place of a message; its version, or None if not allowed"""
+    version = _conditional_update({'is_deleted': True}, message_id, sender_id, room_id)
+    if version is None:
+        return None
+    return {'version': version}
+
+
+async def adelete_message(message_id, sender_id: int, room_id: Optional[int] = None) -> Optional[Dict]:
+    version = await _aconditional_update({'is_deleted': True}, message_id, sender_id, room_id)
+    if version is None:
+        return None
+    return {'version': version}
@@ -0,0 +1,32 @@
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import QuerySet
+
+from .models import ChatRoom, Message
+from .pagination import keyset_page
+
+
+def room_history_page(room: ChatRoom, cursor: Optional[str] = None, page_size: int = 50,
+                      queryset: Optional[QuerySet] = None) -> Tuple[List[Message], Optional[str]]:
+    """One page of a room's messages, newest first, and the cursor for the next page.
+
+    Pages are keyset ranges on (created_at, id) served from the
+    chat_message_history_idx index, so the cost does not grow with how far
+    back the client has scrolled. Pass queryset to add select_related or
+    prefetch_related for the caller's serializer.
+    """
+    if queryset is None:
+        queryset = Message.objects.all()
+    return keyset_page(queryset.filter(room=room, is_deleted=False), cursor, page_size)
+
+
+def approximate_message_count(room: ChatRoom) -> int:
+    """Room message count, recomputed at most once per CHAT_MESSAGE_COUNT_CACHE_TTL seconds"""
+    key = f"chat:room:{room.id}:message_count"
+    count = cache.get(key)
+    if count is None:
+        count = Message.objects.filter(room=room, is_deleted=False).count()
+        cache.set(key, count, getattr(settings, 'CHAT_MESSAGE_COUNT_CACHE_TTL', 300))
+    return count
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_knowledgebase_personalizationprofile_usermemory_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemoryDigest',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facts', models.JSONField(default=list)),
+                ('preferences', models.JSONField(default=list)),
+                ('context_notes', models.JSONField(default=list)),
+                ('mood_summary', models.JSONField(default=dict)),
+                ('memory_count', models.IntegerField(default=0)),
+                ('rebuilt_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='memory_digest', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-19 06:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_memorydigest'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usermemory',
+            index=models.Index(fields=['user', 'is_active', 'created_at', 'id'], name='chat_usermem_user_recent_idx'),
+        ),
+    ]
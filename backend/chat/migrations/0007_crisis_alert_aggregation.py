@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_room_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crisisalert',
+            name='keywords',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='crisisalert',
+            name='last_triggered_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='crisisalert',
+            name='occurrences',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddIndex(
+            model_name='crisisalert',
+            index=models.Index(fields=['user', 'room', 'status'], name='chat_crisis_open_alert_idx'),
+        ),
+    ]
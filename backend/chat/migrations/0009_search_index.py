@@ -0,0 +1,23 @@
+from django.db import migrations
+
+from chat.search import create_index, drop_index
+
+
+def forwards(apps, schema_editor):
+    create_index(schema_editor)
+
+
+def backwards(apps, schema_editor):
+    drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_message_history_index'),
+        ('dashboard', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, backwards),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecommendationSet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic_weights', models.JSONField(default=dict)),
+                ('mood_scores', models.JSONField(default=list)),
+                ('items', models.JSONField(default=list)),
+                ('signature', models.CharField(blank=True, max_length=200)),
+                ('memory_count', models.IntegerField(default=0)),
+                ('rebuilt_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='recommendation_set', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:40
+
+from django.db import migrations, models
+
+from chat.search import restore_triggers
+
+
+def forwards(apps, schema_editor):
+    # SQLite rebuilds chat_message to add the column, dropping the search triggers
+    restore_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_recommendation_set'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
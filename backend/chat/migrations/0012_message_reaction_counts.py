@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-19 07:43
+
+from django.db import migrations, models
+from django.db.models import Count
+
+from chat.search import restore_triggers
+
+
+def forwards(apps, schema_editor):
+    # SQLite rebuilds chat_message to add the column, dropping the search triggers
+    restore_triggers(schema_editor)
+
+    Message = apps.get_model('chat', 'Message')
+    MessageReaction = apps.get_model('chat', 'MessageReaction')
+    counts = {}
+    rows = MessageReaction.objects.values('message_id', 'reaction_type').annotate(total=Count('id')).order_by()
+    for row in rows.iterator():
+        counts.setdefault(row['message_id'], {})[row['reaction_type']] = row['total']
+    messages = []
+    for message in Message.objects.filter(id__in=list(counts)).only('id').iterator():
+        message.reaction_counts = counts[message.id]
+        messages.append(message)
+    Message.objects.bulk_update(messages, ['reaction_counts'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_message_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='reaction_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+from chat.search import reindex
+
+
+def forwards(apps, schema_editor):
+    # Document ids are renumbered to make room for memories, so every trigger is replaced
+    reindex(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_message_reaction_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(forwards, migrations.RunPython.noop),
+    ]
@@ -33,7 +33,7 @@ class ChatRoom(models.Model):
         return self.participants.count()
 
     def get_last_message(self):
-        return self.messages.first()  # Since messages are ordered by -created_at
+        return self.messages.filter(is_deleted=False).order_by('-created_at', '-id').first()
 
 class ChatParticipant(models.Model):
     PARTICIPANT_ROLES = [
@@ -75,11 +75,25 @@ class Message(models.Model):
     is_edited = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     edited_at = models.DateTimeField(blank=True, null=True)
+    # Bumped by every edit and delete so clients and caches can order changes
+    version = models.PositiveIntegerField(default=1)
+    # Reaction type -> number of users who gave it, maintained by chat.reactions
+    reaction_counts = models.JSONField(default=dict, blank=True)
     reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, blank=True, null=True, related_name='replies')
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Resumed sessions read a room's messages after a given id
+            models.Index(fields=['room', 'id'], name='chat_message_room_id_idx'),
+            # Keyset pages of a room's visible history, newest first
+            models.Index(
+                fields=['room', 'created_at', 'id'],
+                condition=models.Q(is_deleted=False),
+                name='chat_message_history_idx'
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender.email}: {self.content[:50]}..."
@@ -87,6 +101,7 @@ class Message(models.Model):
     def mark_as_edited(self):
         self.is_edited = True
         self.edited_at = timezone.now()
+        self.version += 1
         self.save()
 
 class MessageReaction(models.Model):
@@ -160,11 +175,18 @@ class CrisisAlert(models.Model):
     responder = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, blank=True, null=True, related_name='handled_alerts')
     responded_at = models.DateTimeField(blank=True, null=True)
     resolution_notes = models.TextField(blank=True)
+    # Repeated signals from the same user and room are folded into one alert
+    occurrences = models.PositiveIntegerField(default=1)
+    keywords = models.JSONField(default=list, blank=True)
+    last_triggered_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', 'room', 'status'], name='chat_crisis_open_alert_idx'),
+        ]
 
     def __str__(self):
         return f"Crisis Alert: {self.user.email} - {self.severity} ({self.status})"
@@ -0,0 +1,90 @@
+"""Opaque cursors for paging newest-first lists without OFFSET.
+
+Keyset cursors point just past a row by its (created_at, id), so each page
+is a range seek on an index ending in those columns and costs the same
+however deep the client has paged. Rank cursors page lists whose order is
+computed elsewhere, such as similarity or full-text rankings, by position
+instead, and name the ranking so a cursor is never applied to another one.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+
+
+# cursor_ranking() of keyset cursors
+KEYSET = 'keyset'
+
+
+def _encode(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode('utf-8')).decode('ascii')
+
+
+def _decode(cursor: str):
+    return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+
+
+def encode_keyset_cursor(row) -> str:
+    """Opaque cursor pointing just past the given row"""
+    return _encode([row.created_at.isoformat(), row.id])
+
+
+def decode_keyset_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_keyset_cursor; raises ValueError for malformed cursors"""
+    try:
+        created_at, row_id = _decode(cursor)
+        parsed = parse_datetime(created_at)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if parsed is None or not isinstance(row_id, int):
+        raise ValueError("Invalid cursor")
+    return parsed, row_id
+
+
+def keyset_page(queryset: QuerySet, cursor: Optional[str] = None,
+                page_size: int = 50) -> Tuple[List, Optional[str]]:
+    """One page of queryset, newest first by (created_at, id), and the cursor for the next page"""
+    if cursor:
+        created_at, row_id = decode_keyset_cursor(cursor)
+        # The redundant upper bound lets the index seek straight to the cursor
+        queryset = queryset.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=row_id)
+        )
+
+    # One extra row tells whether another page exists, without a COUNT
+    page = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    if len(page) > page_size:
+        page = page[:page_size]
+        return page, encode_keyset_cursor(page[-1])
+    return page, None
+
+
+def encode_rank_cursor(offset: int, ranking: str) -> str:
+    """Opaque cursor for the next page of a list ranked by the named ranking"""
+    return _encode(['rank', ranking, offset])
+
+
+def decode_rank_cursor(cursor: str, ranking: str) -> int:
+    """Inverse of encode_rank_cursor; raises ValueError for malformed cursors or another ranking's"""
+    try:
+        kind, named, offset = _decode(cursor)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if kind != 'rank' or named != ranking or not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+
+def cursor_ranking(cursor: str) -> str:
+    """The ranking a rank cursor pages through, or 'keyset'; raises ValueError for malformed cursors"""
+    try:
+        value = _decode(cursor)
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if isinstance(value, list) and len(value) == 3 and value[0] == 'rank' and isinstance(value[1], str):
+        return value[1]
+    decode_keyset_cursor(cursor)
+    return KEYSET
@@ -0,0 +1,243 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, List, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ChatRoom, ChatParticipant
+
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryPresenceStore:
+    """Presence kept in this process; for single-node deployments and tests"""
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        # room -> user_id -> {'info': {...}, 'channels': {channel_name: expires_at}}
+        self._rooms: Dict[str, Dict[int, Dict]] = {}
+
+    async def join(self, room: str, channel_name: str, info: Dict):
+        users = self._rooms.setdefault(room, {})
+        entry = users.setdefault(info['id'], {'info': info, 'channels': {}})
+        entry['info'] = info
+        entry['channels'][channel_name] = time.time() + self.ttl
+
+    async def heartbeat(self, room: str, channel_name: str, user_id: int):
+        entry = self._rooms.get(room, {}).get(user_id)
+        if entry is not None and channel_name in entry['channels']:
+            entry['channels'][channel_name] = time.time() + self.ttl
+
+    async def leave(self, room: str, channel_name: str, user_id: int) -> bool:
+        """Remove one connection; True if the user has no connections left in the room"""
+        users = self._rooms.get(room, {})
+        entry = users.get(user_id)
+        if entry is None:
+            return True
+        entry['channels'].pop(channel_name, None)
+        self._expire(entry)
+        if entry['channels']:
+            return False
+        del users[user_id]
+        if not users:
+            self._rooms.pop(room, None)
+        return True
+
+    async def members(self, room: str) -> List[Dict]:
+        users = self._rooms.get(room, {})
+        online = []
+        for user_id in list(users):
+            entry = users[user_id]
+            self._expire(entry)
+            if entry['channels']:
+                online.append({**entry['info'], 'is_online': True})
+            else:
+                del users[user_id]
+        return online
+
+    def _expire(self, entry: Dict):
+        now = time.time()
+        for channel_name, expires_at in list(entry['channels'].items()):
+            if expires_at <= now:
+                del entry['channels'][channel_name]
+
+
+class RedisPresenceStore:
+    """Presence in Redis with per-connection TTLs, shared by every worker"""
+
+    def __init__(self, url: str, ttl: float = 60.0, prefix: str = 'presence'):
+        self.url = url
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = None
+
+    @property
+    def client(self):
+        # Created lazily so the connection pool belongs to the serving event loop
+        if self._client is None:
+            self._client = aioredis.from_url(self.url, decode_responses=True)
+        return self._client
+
+    def _keys(self, room: str) -> Tuple[str, str]:
+        return f"{self.prefix}:{room}:conn", f"{self.prefix}:{room}:info"
+
+    async def join(self, room: str, channel_name: str, info: Dict):
+        conn_key, info_key = self._keys(room)
+        key_ttl = int(self.ttl * 2)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zadd(conn_key, {f"{info['id']}|{channel_name}": time.time() + self.ttl})
+            pipe.hset(info_key, str(info['id']), json.dumps(info))
+            pipe.expire(conn_key, key_ttl)
+            pipe.expire(info_key, key_ttl)
+            await pipe.execute()
+
+    async def heartbeat(self, room: str, channel_name: str, user_id: int):
+        conn_key, info_key = self._keys(room)
+        key_ttl = int(self.ttl * 2)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zadd(conn_key, {f"{user_id}|{channel_name}": time.time() + self.ttl}, xx=True)
+            pipe.expire(conn_key, key_ttl)
+            pipe.expire(info_key, key_ttl)
+            await pipe.execute()
+
+    async def leave(self, room: str, channel_name: str, user_id: int) -> bool:
+        conn_key, info_key = self._keys(room)
+        await self.client.zrem(conn_key, f"{user_id}|{channel_name}")
+        now = time.time()
+        # A large room takes several SCAN pages; the user is offline only if none has a live connection
+        cursor = 0
+        while True:
+            cursor, remaining = await self.client.zscan(conn_key, cursor, match=f"{user_id}|*", count=500)
+            if any(score > now for _, score in remaining):
+                return False
+            if not cursor:
+                break
+        await self.client.hdel(info_key, str(user_id))
+        return True
+
+    async def members(self, room: str) -> List[Dict]:
+        conn_key, info_key = self._keys(room)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.zremrangebyscore(conn_key, '-inf', time.time())
+            pipe.zrange(conn_key, 0, -1)
+            pipe.hgetall(info_key)
+            _, connections, infos = await pipe.execute()
+
+        online_ids = {member.split('|', 1)[0] for member in connections}
+        return [
+            {**json.loads(infos[user_id]), 'is_online': True}
+            for user_id in online_ids if user_id in infos
+        ]
+
+
+class LastSeenBuffer:
+    """Collect online/offline changes and persist them to ChatParticipant in batches"""
+
+    def __init__(self, flush_interval: float = 10.0, batch_size: int = 200):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        # (room_name, user_id) -> is_online; later events overwrite earlier ones
+        self._pending: Dict[Tuple[str, int], bool] = {}
+        self._flush_task = None
+        self.flushes = 0
+
+    def record(self, room_name: str, user_id: int, is_online: bool):
+        self._pending[(room_name, user_id)] = is_online
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Write every pending change with a handful of queries"""
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        try:
+            await database_sync_to_async(self._write)(pending)
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"Error persisting presence: {str(e)}")
+
+    def _write(self, pending: Dict[Tuple[str, int], bool]):
+        now = timezone.now()
+        room_ids = dict(
+            ChatRoom.objects.filter(name__in={room for room, _ in pending}).values_list('name', 'id')
+        )
+        rows = [
+            (room_ids[room], user_id, is_online)
+            for (room, user_id), is_online in pending.items() if room in room_ids
+        ]
+
+        # Users joining a room for the first time get a participant row
+        ChatParticipant.objects.bulk_create(
+            [ChatParticipant(room_id=room_id, user_id=user_id, is_online=is_online, last_seen=now)
+             for room_id, user_id, is_online in rows],
+            ignore_conflicts=True,
+            batch_size=self.batch_size
+        )
+
+        for is_online in (True, False):
+            pairs = [(room_id, user_id) for room_id, user_id, online in rows if online == is_online]
+            for start in range(0, len(pairs), self.batch_size):
+                condition = Q()
+                for room_id, user_id in pairs[start:start + self.batch_size]:
+                    condition |= Q(room_id=room_id, user_id=user_id)
+                ChatParticipant.objects.filter(condition).update(is_online=is_online, last_seen=now)
+
+
+def _redis_url_from_channel_layer() -> str:
+    """Reuse the channel layer's Redis host for presence"""
+    config = settings.CHANNEL_LAYERS.get('default', {}).get('CONFIG', {})
+    hosts = config.get('hosts') or [('127.0.0.1', 6379)]
+    host = hosts[0]
+    if isinstance(host, str):
+        return host
+    if isinstance(host, dict):
+        return host.get('address', 'redis://127.0.0.1:6379')
+    return f"redis://{host[0]}:{host[1]}"
+
+
+def build_presence_store():
+    """Redis-backed presence when the channel layer uses Redis, otherwise in-process"""
+    backend = getattr(settings, 'PRESENCE_BACKEND', 'auto')
+    ttl = getattr(settings, 'PRESENCE_TTL', 60.0)
+    channel_backend = settings.CHANNEL_LAYERS.get('default', {}).get('BACKEND', '')
+
+    use_redis = backend == 'redis' or (backend == 'auto' and 'Redis' in channel_backend)
+    if use_redis and REDIS_AVAILABLE:
+        url = getattr(settings, 'PRESENCE_REDIS_URL', '') or _redis_url_from_channel_layer()
+        return RedisPresenceStore(url, ttl=ttl)
+    if use_redis:
+        logger.warning("redis package not available, using in-process presence")
+    return InMemoryPresenceStore(ttl=ttl)
+
+
+_presence_store = None
+
+
+def get_presence_store():
+    global _presence_store
+    if _presence_store is None:
+        _presence_store = build_presence_store()
+    return _presence_store
+
+
+last_seen_buffer = LastSeenBuffer(flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 10.0))
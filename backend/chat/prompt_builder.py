@@ -0,0 +1,316 @@
+import re
+import logging
+from typing import List, Dict, Any, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text with GPT/Gemini style tokenizers
+CHARS_PER_TOKEN = 4
+_WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+IMPORTANCE_SCORES = {'critical': 1.0, 'high': 0.85, 'medium': 0.6, 'low': 0.4}
+
+# Instruction blocks are joined once at import time instead of on every request
+CRISIS_TEMPLATE = "\n".join([
+    "You are a compassionate mental health support AI. The user has expressed concerning content that suggests they may be in crisis.",
+    "",
+    "CRITICAL: This user has mentioned: {keywords}",
+    "",
+    "Please provide an immediate, caring response that:",
+    "1. Acknowledges their pain with empathy",
+    "2. Provides immediate crisis resources (988 Suicide Prevention Lifeline, Crisis Text Line: Text HOME to 741741, Emergency: 911)",
+    "3. Encourages them to seek immediate help",
+    "4. Does NOT provide therapy or attempt to solve their problems",
+    "5. Keeps the response under 300 words",
+    "",
+    'User message: "{message}"',
+    "",
+    "Remember: Safety first, provide resources, encourage professional help.",
+])
+
+INFORMATIONAL_INSTRUCTIONS = "\n".join([
+    "You are Hope, a knowledgeable mental health support AI assistant.",
+    "",
+    "The user is asking for specific information. Your role:",
+    "- Provide accurate, comprehensive, and well-organized information",
+    "- Answer the question directly and completely",
+    "- Use bullet points or numbered lists when appropriate",
+    "- Include practical examples and actionable advice",
+    "- Maintain a helpful and professional tone",
+    "- You may provide longer responses (up to 300 words) for informational content",
+    "",
+    "Guidelines:",
+    "- Answer the specific question asked",
+    "- Provide factual, evidence-based information",
+    "- Organize information clearly (use lists, bullet points, or categories)",
+    "- Include practical examples where relevant",
+    "- Always mention when professional help is recommended",
+    "- Do NOT deflect to emotional support when specific information is requested",
+])
+
+SUPPORTIVE_INSTRUCTIONS = "\n".join([
+    "You are Hope, a compassionate mental health support AI assistant.",
+    "",
+    "Your role:",
+    "- Provide emotional support and validation",
+    "- Share evidence-based coping strategies",
+    "- Encourage professional help when appropriate",
+    "- Maintain a warm, empathetic, and non-judgmental tone",
+    "",
+    "Guidelines:",
+    "- You are NOT a therapist and cannot provide therapy or medical advice",
+    "- Always prioritize user safety",
+    "- Encourage professional help for serious mental health concerns",
+    "- Keep responses between 50-80 words (2-3 sentences maximum)",
+    "- Use supportive emojis sparingly and appropriately",
+    "- Be concise but warm and empathetic",
+])
+
+MODE_GUIDANCE = {
+    'informational': "The user is asking for specific information. Please provide a comprehensive, well-organized answer that directly addresses their question.",
+    'struggling': "The user seems to be struggling. Please provide gentle support and practical coping strategies.",
+    'positive': "The user seems to be in a better mood. Reinforce their positive feelings while remaining supportive.",
+    'neutral': "Provide supportive guidance based on what the user has shared.",
+}
+
+PROMPT_FOOTER = "Please respond appropriately based on the type of question asked."
+
+PROMPT_MODES = ('crisis', 'informational', 'supportive')
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast token estimate without loading a real tokenizer"""
+    if not text:
+        return 0
+    # Short, punctuation-heavy text tokenizes closer to one token per word piece
+    by_chars = (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    if len(text) > 2000:
+        return by_chars
+    return max(by_chars, len(_WORD_PATTERN.findall(text)) * 3 // 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Trim text to roughly max_tokens, preferring a sentence or word boundary"""
+    estimate = estimate_tokens(text)
+    if estimate <= max_tokens:
+        return text
+    if max_tokens <= 1:
+        return ''
+    max_chars = len(text)
+    cut = text
+    # Word-dense text estimates above the character ratio, so shrink until it fits
+    while estimate > max_tokens and max_chars > 1:
+        max_chars = max(int(max_chars * max_tokens / estimate) - 3, 1)
+        cut = text[:max_chars]
+        boundary = max(cut.rfind('. '), cut.rfind('\n'))
+        if boundary > max_chars // 2:
+            cut = cut[:boundary + 1]
+        else:
+            space = cut.rfind(' ')
+            if space > max_chars // 2:
+                cut = cut[:space]
+        cut = cut.rstrip() + '...'
+        estimate = estimate_tokens(cut)
+    return cut
+
+
+# Token cost of the fixed template blocks, computed once
+TEMPLATE_TOKENS = {
+    'crisis': estimate_tokens(CRISIS_TEMPLATE),
+    'informational': estimate_tokens(INFORMATIONAL_INSTRUCTIONS),
+    'supportive': estimate_tokens(SUPPORTIVE_INSTRUCTIONS),
+}
+
+
+class AssembledPrompt:
+    """Final prompt text plus a per-section token report"""
+
+    def __init__(self, text: str, mode: str, token_usage: Dict[str, int],
+                 budget: int, dropped_items: int = 0, personalized: bool = False):
+        self.text = text
+        self.mode = mode
+        self.token_usage = token_usage
+        self.total_tokens = sum(token_usage.values())
+        self.budget = budget
+        self.dropped_items = dropped_items
+        self.personalized = personalized
+
+    def __str__(self):
+        return self.text
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'mode': self.mode,
+            'token_usage': self.token_usage,
+            'total_tokens': self.total_tokens,
+            'budget': self.budget,
+            'dropped_items': self.dropped_items,
+            'personalized': self.personalized,
+        }
+
+
+class PromptAssembler:
+    """Build LLM prompts from precompiled templates within a token budget"""
+
+    # Smallest knowledge/memory fragment worth truncating into leftover budget
+    MIN_FRAGMENT_TOKENS = 24
+
+    def __init__(self, token_budget: int = None, history_limit: int = None):
+        self.token_budget = token_budget or getattr(settings, 'AI_PROMPT_TOKEN_BUDGET', 1200)
+        self.history_limit = history_limit or getattr(settings, 'AI_PROMPT_HISTORY_MESSAGES', 6)
+
+    def build(self, message: str, mode: str = 'supportive', sentiment: str = 'neutral',
+              user_context: Dict = None, relevant_knowledge: List[Dict] = None,
+              history: List[Dict] = None, crisis_keywords: List[str] = None) -> AssembledPrompt:
+        """Assemble a prompt for the given mode, packing context by score until the budget is used"""
+        if mode not in PROMPT_MODES:
+            mode = 'supportive'
+
+        budget = self.token_budget
+
+        if mode == 'crisis':
+            # Crisis prompts stay minimal: no retrieved context, just the safety template
+            message_text = truncate_to_tokens(message, budget // 2)
+            text = CRISIS_TEMPLATE.format(
+                keywords=', '.join((crisis_keywords or [])[:3]),
+                message=message_text
+            )
+            usage = {
+                'instructions': TEMPLATE_TOKENS['crisis'],
+                'message': estimate_tokens(message_text),
+            }
+            return AssembledPrompt(text, mode, usage, budget)
+
+        instructions = INFORMATIONAL_INSTRUCTIONS if mode == 'informational' else SUPPORTIVE_INSTRUCTIONS
+        if mode == 'informational':
+            guidance = MODE_GUIDANCE['informational']
+        elif sentiment in ['negative', 'slightly_negative']:
+            guidance = MODE_GUIDANCE['struggling']
+        elif sentiment == 'positive':
+            guidance = MODE_GUIDANCE['positive']
+        else:
+            guidance = MODE_GUIDANCE['neutral']
+
+        # The user message is mandatory; cap it so context still has room
+        message_text = truncate_to_tokens(message, budget // 2)
+        message_block = f'User message: "{message_text}"'
+
+        profile_lines = self._profile_lines(user_context or {})
+
+        usage = {
+            'instructions': TEMPLATE_TOKENS[mode] + estimate_tokens(guidance) + estimate_tokens(PROMPT_FOOTER),
+            'profile': sum(estimate_tokens(line) for line in profile_lines),
+            'knowledge': 0,
+            'memories': 0,
+            'history': 0,
+            'message': estimate_tokens(message_block),
+        }
+        remaining = budget - sum(usage.values())
+
+        candidates = self._collect_candidates(user_context or {}, relevant_knowledge or [], history or [])
+        candidates.sort(key=lambda item: item['score'], reverse=True)
+
+        packed = {'knowledge': [], 'memories': [], 'history': []}
+        dropped = 0
+        for item in candidates:
+            cost = estimate_tokens(item['text'])
+            if cost <= remaining:
+                text = item['text']
+            elif item['section'] != 'history' and remaining >= self.MIN_FRAGMENT_TOKENS:
+                text = truncate_to_tokens(item['text'], remaining)
+                cost = estimate_tokens(text)
+            else:
+                dropped += 1
+                continue
+            packed[item['section']].append((item['order'], text))
+            usage[item['section']] += cost
+            remaining -= cost
+
+        parts = [instructions, ""]
+        if profile_lines:
+            parts.extend(["User context:", *profile_lines, ""])
+        if packed['memories']:
+            parts.extend(["What the user has shared before:",
+                          *[f"- {text}" for _, text in sorted(packed['memories'])], ""])
+        if packed['knowledge']:
+            parts.extend(["Relevant mental health information:",
+                          *[f"- {text}" for _, text in sorted(packed['knowledge'])], ""])
+        if packed['history']:
+            # History is rendered oldest first regardless of packing order
+            parts.extend(["Recent conversation:",
+                          *[text for _, text in sorted(packed['history'], reverse=True)], ""])
+        parts.extend([guidance, "", message_block, "", PROMPT_FOOTER])
+
+        # Tone is a coarse preference shared by many users; strategies, memories and history are not
+        personalized = bool(
+            (user_context or {}).get('effective_strategies') or packed['memories'] or packed['history']
+        )
+        return AssembledPrompt("\n".join(parts), mode, usage, budget, dropped, personalized)
+
+    def _profile_lines(self, user_context: Dict) -> List[str]:
+        """Small fixed-size facts about the user that are always included"""
+        lines = []
+        if user_context.get('effective_strategies'):
+            strategies = user_context['effective_strategies'][:3]
+            lines.append(f"- Strategies that have helped this user before: {', '.join(strategies)}")
+        if user_context.get('preferred_tone'):
+            lines.append(f"- User prefers {user_context['preferred_tone']} communication style")
+        return lines
+
+    def _collect_candidates(self, user_context: Dict, relevant_knowledge: List[Dict],
+                            history: List[Dict]) -> List[Dict]:
+        """Turn knowledge, memories and history into scored prompt fragments"""
+        candidates = []
+
+        for i, item in enumerate(relevant_knowledge):
+            content = (item.get('content') or '').strip()
+            if not content:
+                continue
+            if item.get('source') == 'user_memory':
+                importance = item.get('metadata', {}).get('importance', 'medium')
+                candidates.append({
+                    'section': 'memories',
+                    'order': i,
+                    'text': content,
+                    'score': max(item.get('relevance_score', 0.0), IMPORTANCE_SCORES.get(importance, 0.5)),
+                })
+            else:
+                title = item.get('metadata', {}).get('title', 'Mental Health Information')
+                candidates.append({
+                    'section': 'knowledge',
+                    'order': i,
+                    'text': f"{title}: {content}",
+                    'score': item.get('relevance_score', 0.5),
+                })
+
+        offset = len(relevant_knowledge)
+        for i, memory in enumerate(user_context.get('recent_memories') or []):
+            content = (memory.get('content') or '').strip()
+            if not content:
+                continue
+            candidates.append({
+                'section': 'memories',
+                'order': offset + i,
+                'text': content,
+                'score': IMPORTANCE_SCORES.get(memory.get('importance'), 0.5),
+            })
+
+        # Most recent turns score highest and decay with distance from the current message
+        for i, turn in enumerate(history[:self.history_limit]):
+            content = (turn.get('content') or '').strip()
+            if not content:
+                continue
+            role = 'Hope' if turn.get('role') == 'assistant' else 'User'
+            candidates.append({
+                'section': 'history',
+                'order': i,
+                'text': f"{role}: {truncate_to_tokens(content, 120)}",
+                'score': 0.8 * (0.85 ** i),
+            })
+
+        return candidates
+
+
+prompt_assembler = PromptAssembler()
@@ -43,17 +43,28 @@ class SimpleTextSplitter:
 from django.conf import settings
 from django.utils import timezone
 
-from .memory_models import KnowledgeBase, UserMemory, VectorMemory
-from .memory_service import MemoryService
+from .memory_models import KnowledgeBase, UserMemory, VectorMemory, describe_personal_info
+from .memory_service import get_memory_service
 from users.models import CustomUser
 
+MEMORY_QUERY_KEYWORDS = [
+    'what do you know', 'tell me about me', 'remember about me', 
+    'what do you remember', 'my information', 'about me', 'know about me'
+]
+
+
+def is_memory_query(text: str) -> bool:
+    """True when the user is asking what the assistant knows about them"""
+    text_lower = text.lower()
+    return any(keyword in text_lower for keyword in MEMORY_QUERY_KEYWORDS)
+
 logger = logging.getLogger(__name__)
 
 class RAGService:
     """Retrieval-Augmented Generation service for mental health knowledge"""
     
     def __init__(self):
-        self.memory_service = MemoryService()
+        self.memory_service = get_memory_service()
         self.text_splitter = SimpleTextSplitter(chunk_size=500, chunk_overlap=50)
     
     def initialize_knowledge_base(self):
@@ -527,12 +538,21 @@ Regular practice increases benefits over time.''',
                                    context: Dict = None) -> Dict[str, Any]:
         """Generate a response using RAG with relevant knowledge and user context"""
         try:
+            # "About me" questions are answered from the precomputed digest, not a memory scan
+            memory_digest = None
+            if user and is_memory_query(user_query):
+                digest = self.memory_service.get_memory_digest(user)
+                memory_digest = digest.as_dict() if digest else None
+            
             # Retrieve relevant knowledge
-            relevant_knowledge = self.retrieve_relevant_knowledge(
-                query=user_query,
-                user=user,
-                max_results=3
-            )
+            if memory_digest is not None:
+                relevant_knowledge = []
+            else:
+                relevant_knowledge = self.retrieve_relevant_knowledge(
+                    query=user_query,
+                    user=user,
+                    max_results=3
+                )
             
             # Get user personalization profile
             user_profile = None
@@ -561,6 +581,7 @@ Regular practice increases benefits over time.''',
                     'effective_strategies': user_profile.effective_strategies if user_profile else [],
                     'trigger_patterns': user_profile.trigger_patterns if user_profile else []
                 } if user_profile else None,
+                'memory_digest': memory_digest,
                 'context': context or {}
             }
             
@@ -604,24 +625,16 @@ Regular practice increases benefits over time.''',
                 return self._generate_crisis_response(context)
             
             # Detect different types of queries
-            informational_keywords = [
-                'list', 'what are', 'tell me about', 'explain', 'describe', 'causes of',
-                'symptoms of', 'types of', 'examples of', 'how to', 'ways to', 'methods',
-                'techniques', 'strategies for', 'signs of', 'reasons for', 'factors',
-                'what causes', 'why do', 'what is', 'define', 'difference between'
-            ]
-            
-            memory_query_keywords = [
-                'what do you know', 'tell me about me', 'remember about me', 
-                'what do you remember', 'my information', 'about me', 'know about me'
-            ]
+            from .ai_support import INFORMATIONAL_KEYWORDS
             
-            is_informational_query = any(keyword in user_query.lower() for keyword in informational_keywords)
-            is_memory_query = any(keyword in user_query.lower() for keyword in memory_query_keywords)
+            is_informational_query = any(keyword in user_query.lower() for keyword in INFORMATIONAL_KEYWORDS)
             
             # Handle memory queries (asking about themselves)
-            if is_memory_query:
-                return self._generate_memory_response(user_query, relevant_knowledge, user_profile)
+            if is_memory_query(user_query):
+                memory_digest = context.get('memory_digest')
+                if memory_digest is None:
+                    memory_digest = self._digest_from_knowledge(relevant_knowledge)
+                return self._generate_memory_response(user_query, memory_digest, user_profile)
             
             # Handle informational queries with direct knowledge-based responses
             if is_informational_query and relevant_knowledge:
@@ -635,7 +648,8 @@ Regular practice increases benefits over time.''',
                     message=user_query,
                     user_context=user_profile,
                     relevant_knowledge=relevant_knowledge,
-                    crisis_detected=crisis_detected
+                    crisis_detected=crisis_detected,
+                    history=context.get('context', {}).get('history')
                 )
                 
                 # If Gemini provides a good response, use it
@@ -812,88 +826,37 @@ Regular practice increases benefits over time.''',
             logger.error(f"Failed to generate informational response: {e}")
             return "I have comprehensive information about anxiety causes and symptoms. Could you be more specific about what aspect you'd like to know more about?"
     
-    def _generate_memory_response(self, user_query: str, relevant_knowledge: List[Dict], user_profile: Dict = None) -> str:
-        """Generate a response based on stored user memories"""
+    def _generate_memory_response(self, user_query: str, memory_digest: Dict, user_profile: Dict = None) -> str:
+        """Generate a response from the user's memory digest"""
         try:
-            user_memories = [item for item in relevant_knowledge if item['source'] == 'user_memory']
+            facts = memory_digest.get('facts', [])
+            preferences = memory_digest.get('preferences', [])
+            mood_summary = memory_digest.get('mood_summary') or {}
+            other_context = memory_digest.get('context', [])
             
-            if not user_memories:
+            if not (facts or preferences or mood_summary.get('recent') or other_context):
                 return "I don't have any specific information about you stored from our previous conversations. Feel free to share anything you'd like me to know about you!"
             
             response_parts = ["Based on what you've shared with me:"]
             
-            # Extract different types of information
-            personal_info = []
-            preferences = []
-            mood_patterns = []
-            other_context = []
-            
-            for memory in user_memories:
-                content = memory['content']
-                memory_type = memory.get('metadata', {}).get('memory_type', 'general')
-                
-                if memory_type == 'personal_info':
-                    personal_info.append(content)
-                elif memory_type == 'preference':
-                    preferences.append(content)
-                elif memory_type == 'mood_pattern':
-                    mood_patterns.append(content)
-                else:
-                    other_context.append(content)
-            
-            # Add personal information
-            if personal_info:
+            if facts:
                 response_parts.append("\n**About You:**")
-                for info in personal_info:
-                    # Clean up the content to make it more natural
-                    if info.startswith("Personal context:"):
-                        info = info.replace("Personal context:", "").strip()
-                    elif info.startswith("User's name:") or info.startswith("User introduced"):
-                        # Extract key details more naturally
-                        if "name:" in info and "age:" in info and "occupation:" in info:
-                            # Parse structured info
-                            parts = info.split(", ")
-                            cleaned_parts = []
-                            for part in parts:
-                                if "name:" in part:
-                                    name = part.split("name:")[-1].strip()
-                                    cleaned_parts.append(f"Your name is {name}")
-                                elif "age:" in part:
-                                    age = part.split("age:")[-1].strip()
-                                    cleaned_parts.append(f"you're {age} years old")
-                                elif "occupation:" in part:
-                                    job = part.split("occupation:")[-1].strip()
-                                    cleaned_parts.append(f"you work as a {job}")
-                                elif "company:" in part:
-                                    company = part.split("company:")[-1].strip()
-                                    cleaned_parts.append(f"at {company}")
-                            
-                            if cleaned_parts:
-                                response_parts.append(f"• {', '.join(cleaned_parts)}")
-                            else:
-                                response_parts.append(f"• {info}")
-                        else:
-                            response_parts.append(f"• {info}")
-                    else:
-                        response_parts.append(f"• {info}")
+                response_parts.extend(f"• {fact}" for fact in facts)
             
-            # Add preferences
             if preferences:
                 response_parts.append("\n**Your Preferences:**")
-                for pref in preferences:
-                    if pref.startswith("User mentioned preferences/experiences:"):
-                        pref = pref.replace("User mentioned preferences/experiences:", "").strip()
-                    response_parts.append(f"• {pref}")
+                response_parts.extend(f"• {pref}" for pref in preferences)
             
-            # Add mood patterns if relevant
-            if mood_patterns:
+            if mood_summary.get('recent'):
                 response_parts.append("\n**Recent Mood Context:**")
-                for mood in mood_patterns:
-                    if mood.startswith("User mood:"):
-                        mood = mood.replace("User mood:", "").strip()
-                    response_parts.append(f"• {mood}")
+                response_parts.append(f"• Most recently you seemed {mood_summary['last']}")
+                counts = mood_summary.get('counts', {})
+                if sum(counts.values()) > 1:
+                    breakdown = ', '.join(
+                        f"{count} {mood}" for mood, count in sorted(counts.items(), key=lambda item: -item[1])
+                    )
+                    response_parts.append(f"• Across our conversations: {breakdown}")
             
-            # Add other context
             if other_context:
                 response_parts.append("\n**Additional Context:**")
                 for context in other_context[:2]:  # Limit to avoid overwhelming
@@ -908,6 +871,25 @@ Regular practice increases benefits over time.''',
             logger.error(f"Failed to generate memory response: {e}")
             return "I'm having trouble accessing our conversation history right now, but I'm here to listen and support you. What would you like to talk about?"
     
+    def _digest_from_knowledge(self, relevant_knowledge: List[Dict]) -> Dict:
+        """Digest-shaped summary of retrieved memories, used when no stored digest is available"""
+        digest = {'facts': [], 'preferences': [], 'context': [], 'mood_summary': {}}
+        for item in relevant_knowledge:
+            if item.get('source') != 'user_memory':
+                continue
+            content = item['content']
+            memory_type = item.get('metadata', {}).get('memory_type', 'general')
+            if memory_type == 'personal_info':
+                digest['facts'].append(describe_personal_info(content))
+            elif memory_type == 'preference':
+                digest['preferences'].append(content.replace("User mentioned preferences/experiences:", "").strip())
+            elif memory_type == 'mood_pattern':
+                mood = content.split("mood:")[-1].split('(')[0].strip()
+                digest['mood_summary'] = {'counts': {mood: 1}, 'recent': [mood], 'last': mood}
+            else:
+                digest['context'].append(content)
+        return digest
+    
     def _generate_crisis_response(self, context: Dict) -> str:
         """Generate specialized crisis response"""
         crisis_keywords = context.get('crisis_keywords', [])
@@ -0,0 +1,142 @@
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# message type -> (tokens per second, burst); types not listed use 'default'
+DEFAULT_CONNECTION_LIMITS = {
+    'chat_message': (0.5, 5),
+    'typing': (5.0, 20),
+    'reaction': (2.0, 10),
+    'edit_message': (0.5, 5),
+    'delete_message': (0.5, 5),
+    'default': (2.0, 10),
+}
+DEFAULT_USER_LIMITS = {
+    'chat_message': (1.0, 10),
+    'typing': (10.0, 40),
+    'reaction': (4.0, 20),
+    'edit_message': (1.0, 10),
+    'delete_message': (1.0, 10),
+    'default': (4.0, 20),
+}
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `burst`"""
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float = None):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def consume(self, now: float = None, tokens: float = 1.0) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def refund(self, tokens: float = 1.0):
+        self.tokens = min(self.burst, self.tokens + tokens)
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` are available"""
+        if self.tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+
+class RateLimiter:
+    """Token buckets per key and message type.
+
+    A bucket that has refilled completely behaves exactly like a new one, so
+    idle buckets are pruned once the table grows past `max_keys`.
+    """
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], max_keys: int = 10000):
+        self.limits = limits
+        self.max_keys = max_keys
+        self._buckets: Dict[Tuple, TokenBucket] = {}
+        self.rejected = 0
+
+    def limit_for(self, message_type: str) -> Optional[Tuple[float, float]]:
+        return self.limits.get(message_type, self.limits.get('default'))
+
+    def bucket(self, key, message_type: str, now: float = None) -> Optional[TokenBucket]:
+        limit = self.limit_for(message_type)
+        if limit is None:
+            return None
+        bucket_type = message_type if message_type in self.limits else 'default'
+        bucket = self._buckets.get((key, bucket_type))
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._prune(time.monotonic() if now is None else now)
+            bucket = self._buckets[(key, bucket_type)] = TokenBucket(*limit, now=now)
+        return bucket
+
+    def check(self, key, message_type: str, now: float = None) -> float:
+        """Take a token; 0 when allowed, otherwise seconds to wait"""
+        bucket = self.bucket(key, message_type, now)
+        if bucket is None or bucket.consume(now):
+            return 0.0
+        self.rejected += 1
+        return max(bucket.retry_after(), 0.001)
+
+    def _prune(self, now: float):
+        for key in [key for key, bucket in self._buckets.items() if bucket.is_full(now)]:
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ConnectionRateLimit:
+    """Per-connection buckets backed by a shared per-user limiter.
+
+    A frame is accepted only when both the connection and the user have a
+    token, so opening more sockets does not raise a user's budget.
+    """
+
+    def __init__(self, user_key, user_limiter: RateLimiter, limits: Dict[str, Tuple[float, float]] = None):
+        self.user_key = user_key
+        self.user_limiter = user_limiter
+        self.connection = RateLimiter(limits or get_connection_limits())
+        self.violations = 0
+
+    def check(self, message_type: str, now: float = None) -> float:
+        now = time.monotonic() if now is None else now
+        wait = self.connection.check(None, message_type, now)
+        if not wait:
+            wait = self.user_limiter.check(self.user_key, message_type, now)
+            if wait:
+                # Give the connection token back; the frame was not processed
+                self.connection.bucket(None, message_type, now).refund()
+        self.violations = self.violations + 1 if wait else 0
+        return wait
+
+
+def get_connection_limits() -> Dict[str, Tuple[float, float]]:
+    return {**DEFAULT_CONNECTION_LIMITS, **getattr(settings, 'CHAT_RATE_LIMITS_CONNECTION', {})}
+
+
+def get_user_limits() -> Dict[str, Tuple[float, float]]:
+    return {**DEFAULT_USER_LIMITS, **getattr(settings, 'CHAT_RATE_LIMITS_USER', {})}
+
+
+# Shared by every socket in this process
+user_rate_limiter = RateLimiter(get_user_limits())
@@ -0,0 +1,107 @@
+"""Message reactions with denormalized per-message counts.
+
+Message.reaction_counts maps each reaction type to how many users gave it,
+so message lists read the counts with the messages themselves instead of
+loading every MessageReaction row. Reactions are added and removed with
+the message row locked, so concurrent reactions cannot lose an update.
+Rows removed without going through here, such as cascades from deleted
+users, leave the counts high until recount_reactions() runs.
+"""
+from typing import Dict, Iterable, Optional, Tuple
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+
+from .models import Message, MessageReaction
+
+REACTION_TYPES = {code for code, _ in MessageReaction.REACTION_TYPES}
+
+
+def _locked_message(message_id, room_id: Optional[int] = None, live_only: bool = True) -> Optional[Message]:
+    filters = {'id': message_id}
+    if room_id is not None:
+        filters['room_id'] = room_id
+    if live_only:
+        filters['is_deleted'] = False
+    try:
+        return Message.objects.select_for_update().only('id', 'reaction_counts').filter(**filters).first()
+    except (TypeError, ValueError):
+        return None
+
+
+def _add_reaction(message_id, user, reaction_type: str, room_id: Optional[int]):
+    with transaction.atomic():
+        message = _locked_message(message_id, room_id)
+        if message is None:
+            return None
+        # The message lock serializes reactions to it, so no get_or_create savepoint is needed
+        reaction = MessageReaction.objects.filter(
+            message=message, user=user, reaction_type=reaction_type
+        ).first()
+        if reaction is not None:
+            return reaction, False, message.reaction_counts
+        reaction = MessageReaction.objects.create(message=message, user=user, reaction_type=reaction_type)
+        counts = message.reaction_counts
+        counts[reaction_type] = counts.get(reaction_type, 0) + 1
+        message.save(update_fields=['reaction_counts'])
+    return reaction, True, message.reaction_counts
+
+
+def add_reaction(message_id, user, reaction_type: str,
+                 room_id: Optional[int] = None) -> Optional[Tuple[MessageReaction, bool, Dict[str, int]]]:
+    """Add a user's reaction; the reaction, whether it is new, and the message's counts.
+
+    None when the message does not exist, is deleted or is outside room_id.
+    """
+    try:
+        return _add_reaction(message_id, user, reaction_type, room_id)
+    except IntegrityError:
+        # Databases without row locks, like SQLite, can let the same reaction race in twice;
+        # the one that won has been counted, so this one finds it
+        return _add_reaction(message_id, user, reaction_type, room_id)
+
+
+def remove_reaction(message_id, user, reaction_type: str) -> Optional[Dict[str, int]]:
+    """Remove a user's reaction; the message's counts, or None if there was none"""
+    with transaction.atomic():
+        message = _locked_message(message_id, live_only=False)
+        if message is None:
+            return None
+        deleted, _ = MessageReaction.objects.filter(
+            message=message, user=user, reaction_type=reaction_type
+        ).delete()
+        if not deleted:
+            return None
+        counts = message.reaction_counts
+        remaining = counts.get(reaction_type, 0) - 1
+        if remaining > 0:
+            counts[reaction_type] = remaining
+        else:
+            counts.pop(reaction_type, None)
+        message.save(update_fields=['reaction_counts'])
+    return message.reaction_counts
+
+
+def recount_reactions(message_ids: Optional[Iterable[int]] = None, batch_size: int = 500) -> int:
+    """Recompute reaction_counts from the reaction rows; the number of messages changed"""
+    reactions = MessageReaction.objects.all()
+    messages = Message.objects.exclude(reaction_counts={})
+    if message_ids is not None:
+        message_ids = list(message_ids)
+        reactions = reactions.filter(message_id__in=message_ids)
+        messages = messages.filter(id__in=message_ids)
+
+    counts: Dict[int, Dict[str, int]] = {}
+    for row in reactions.values('message_id', 'reaction_type').annotate(total=Count('id')).order_by():
+        counts.setdefault(row['message_id'], {})[row['reaction_type']] = row['total']
+    # Messages whose reactions are all gone still carry their old counts
+    for message_id in messages.values_list('id', flat=True):
+        counts.setdefault(message_id, {})
+
+    changed = []
+    for message in Message.objects.filter(id__in=list(counts)).only('id', 'reaction_counts').iterator():
+        if message.reaction_counts != counts[message.id]:
+            message.reaction_counts = counts[message.id]
+            changed.append(message)
+    Message.objects.bulk_update(changed, ['reaction_counts'], batch_size=batch_size)
+    return len(changed)
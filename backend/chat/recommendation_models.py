@@ -0,0 +1,61 @@
+from django.db import models
+from users.models import CustomUser
+from chat.memory_models import UserMemory, extract_topics
+
+
+class RecommendationSet(models.Model):
+    """Precomputed dashboard recommendations for a user, kept up to date incrementally.
+
+    New memories fold their topics and mood scores in as they are stored;
+    items are only rebuilt when the leading topics or the mood band change.
+    """
+    
+    MAX_TOPICS = 3
+    MAX_MOOD_SCORES = 7
+    
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='recommendation_set')
+    
+    topic_weights = models.JSONField(default=dict)  # {'anxiety': 4, 'sleep': 2}
+    mood_scores = models.JSONField(default=list)  # Dashboard mood scores (1-10), newest first
+    items = models.JSONField(default=list)  # [{'title', 'description', 'icon', 'source'}]
+    signature = models.CharField(max_length=200, blank=True)  # Mood band and topics the items were built for
+    
+    memory_count = models.IntegerField(default=0)
+    rebuilt_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Recommendations: {self.user.email}"
+    
+    def apply_memory(self, memory: UserMemory):
+        """Fold a single memory's topics and mood score into the set"""
+        for topic in extract_topics(memory.content):
+            self.topic_weights[topic] = self.topic_weights.get(topic, 0) + 1
+        score = (memory.context or {}).get('score')
+        if memory.memory_type == 'mood_pattern' and isinstance(score, int):
+            self.add_mood_score(score)
+        self.memory_count += 1
+    
+    def add_mood_score(self, score: int):
+        self.mood_scores = ([score] + self.mood_scores)[:self.MAX_MOOD_SCORES]
+    
+    def reset(self):
+        """Clear all signals before a full rebuild"""
+        self.topic_weights = {}
+        self.mood_scores = []
+        self.memory_count = 0
+    
+    def top_topics(self) -> list:
+        ranked = sorted(self.topic_weights.items(), key=lambda item: (-item[1], item[0]))
+        return [topic for topic, _ in ranked[:self.MAX_TOPICS]]
+    
+    def mood_band(self) -> str:
+        if not self.mood_scores:
+            return ''
+        average = sum(self.mood_scores) / len(self.mood_scores)
+        if average < 4:
+            return 'low'
+        return 'steady' if average < 7 else 'high'
+    
+    def current_signature(self) -> str:
+        return f"{self.mood_band()}|{','.join(self.top_topics())}"
@@ -0,0 +1,170 @@
+import logging
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from dashboard.models import MoodEntry
+from .memory_models import UserMemory
+from .recommendation_models import RecommendationSet
+
+logger = logging.getLogger(__name__)
+
+# Memories read when a user's set is first built
+REBUILD_MEMORY_LIMIT = 200
+MAX_ITEMS = 4
+
+TOPIC_RECOMMENDATIONS = {
+    'anxiety': {'query': 'anxiety', 'icon': 'wind', 'title': 'Grounding for anxious moments',
+                'description': 'Try the 5-4-3-2-1 exercise: name five things you see, four you can touch, three you hear, two you smell and one you taste.'},
+    'depression': {'query': 'depression', 'icon': 'sun', 'title': 'One small, doable step',
+                   'description': 'Pick one gentle activity for today, like a short walk or a shower, and count it as a win.'},
+    'stress': {'query': 'stress', 'icon': 'spa', 'title': 'Release built-up stress',
+               'description': 'Progressive muscle relaxation takes ten minutes: tense and release each muscle group from feet to face.'},
+    'sleep': {'query': 'sleep', 'icon': 'moon', 'title': 'Wind down for better sleep',
+              'description': 'Keep a steady bedtime and put screens away 30 minutes before sleep.'},
+    'work': {'query': 'work', 'icon': 'briefcase', 'title': 'Boundaries around work',
+             'description': 'Set a clear end to your workday and take short breaks between tasks.'},
+    'relationships': {'query': 'relationship', 'icon': 'users', 'title': 'Reconnect with someone',
+                      'description': 'Reach out to someone you trust today, even with a short message.'},
+    'therapy': {'query': 'therapy', 'icon': 'user-md', 'title': 'Prepare for your next session',
+                'description': 'Note down what you would like to talk about with your therapist this week.'},
+    'medication': {'query': 'medication', 'icon': 'pills', 'title': 'Medication check-in',
+                   'description': 'Keep a simple log of doses and side effects to share with your prescriber.'},
+    'self_care': {'query': 'self care', 'icon': 'heart', 'title': 'Keep up your self-care',
+                  'description': 'Schedule your next meditation or exercise session so it becomes a routine.'},
+    'crisis': {'query': 'crisis', 'icon': 'phone', 'title': 'Support is always available',
+               'description': 'If you are in crisis, call or text 988 to reach the Suicide & Crisis Lifeline at any time.'},
+}
+
+MOOD_RECOMMENDATIONS = {
+    'low': {'icon': 'hands-helping', 'title': 'Your mood has been low lately',
+            'description': 'Consider talking to someone you trust or booking a session with a counselor this week.'},
+    'steady': {'icon': 'book', 'title': 'Reflect in your journal',
+               'description': 'A few minutes of writing about your day can help you spot what lifts your mood.'},
+    'high': {'icon': 'smile', 'title': 'Keep the momentum going',
+             'description': 'Write down three things that went well today so you can come back to them later.'},
+}
+
+DEFAULT_RECOMMENDATIONS = [
+    {'icon': 'wind', 'title': 'Take a mindful breath',
+     'description': 'Breathe in for four counts, hold for seven and breathe out for eight. Repeat four times.'},
+    {'icon': 'chart-line', 'title': 'Check in with your mood',
+     'description': 'Logging your mood daily helps you and your care team see patterns over time.'},
+    {'icon': 'book', 'title': 'Start a journal entry',
+     'description': 'Writing for five minutes about how you feel is a simple way to process the day.'},
+]
+
+
+def topic_knowledge(topic: str) -> Optional[Dict]:
+    """Best knowledge base entry for a topic, shared by all users and cached"""
+    key = f"chat:recommendations:knowledge:{topic}"
+    entry = cache.get(key)
+    if entry is None:
+        from .ai_support import rag_service
+        results = []
+        if rag_service:
+            results = [
+                result for result in rag_service.retrieve_relevant_knowledge(
+                    query=TOPIC_RECOMMENDATIONS[topic]['query'],
+                    knowledge_types=['technique', 'resource'],
+                    max_results=1
+                ) if result.get('source') == 'knowledge_base'
+            ]
+        # An empty dict caches the miss too
+        entry = results[0] if results else {}
+        cache.set(key, entry, getattr(settings, 'RECOMMENDATION_KNOWLEDGE_TTL', 3600))
+    return entry or None
+
+
+def build_items(recommendations: RecommendationSet) -> List[Dict]:
+    items = []
+    band = recommendations.mood_band()
+    if band:
+        items.append({**MOOD_RECOMMENDATIONS[band], 'source': 'mood'})
+
+    for topic in recommendations.top_topics():
+        spec = TOPIC_RECOMMENDATIONS[topic]
+        item = {'icon': spec['icon'], 'title': spec['title'], 'description': spec['description'],
+                'source': 'topic', 'topic': topic}
+        knowledge = topic_knowledge(topic)
+        if knowledge:
+            item['title'] = knowledge['metadata'].get('title') or item['title']
+            content = knowledge['content'].strip()
+            item['description'] = content if len(content) <= 200 else content[:197].rstrip() + '...'
+            item['source'] = 'knowledge_base'
+        items.append(item)
+
+    for default in DEFAULT_RECOMMENDATIONS:
+        if len(items) >= MAX_ITEMS:
+            break
+        items.append({**default, 'source': 'default'})
+    return items[:MAX_ITEMS]
+
+
+def refresh_items(recommendations: RecommendationSet) -> bool:
+    """Rebuild the items if the signals they were built from have changed"""
+    signature = recommendations.current_signature()
+    if recommendations.items and signature == recommendations.signature:
+        return False
+    recommendations.items = build_items(recommendations)
+    recommendations.signature = signature
+    return True
+
+
+def rebuild_recommendations(user_id: int, recommendations: RecommendationSet = None) -> Optional[RecommendationSet]:
+    """Recompute a user's recommendations from their recent memories and mood entries"""
+    try:
+        if recommendations is None:
+            recommendations = RecommendationSet.objects.filter(user_id=user_id).first() or \
+                RecommendationSet(user_id=user_id)
+        recommendations.reset()
+        memories = UserMemory.objects.filter(user_id=user_id, is_active=True).only(
+            'id', 'memory_type', 'content', 'context'
+        ).order_by('-created_at', '-id')[:REBUILD_MEMORY_LIMIT]
+        for memory in memories.iterator():
+            recommendations.apply_memory(memory)
+        # Mood entries are the source of truth for scores, including ones logged before memories existed
+        recommendations.mood_scores = list(MoodEntry.objects.filter(user_id=user_id).order_by(
+            '-date', '-created_at'
+        ).values_list('score', flat=True)[:RecommendationSet.MAX_MOOD_SCORES])
+        recommendations.signature = ''
+        refresh_items(recommendations)
+        recommendations.rebuilt_at = timezone.now()
+        # A savepoint of its own, so a lost race leaves the caller's transaction usable
+        with transaction.atomic():
+            recommendations.save()
+        return recommendations
+    except IntegrityError:
+        # Another request built the first set for this user at the same time
+        return RecommendationSet.objects.filter(user_id=user_id).first()
+    except Exception as e:
+        logger.error(f"Failed to rebuild recommendations for user {user_id}: {e}")
+        return None
+
+
+def get_recommendations(user) -> Optional[RecommendationSet]:
+    """The user's precomputed recommendations, building them on first use"""
+    recommendations = RecommendationSet.objects.filter(user=user).first()
+    if recommendations is None:
+        return rebuild_recommendations(user.id, RecommendationSet(user=user))
+    return recommendations
+
+
+def update_recommendations(user_id: int, memories: List[UserMemory]):
+    """Fold newly stored memories into their owner's recommendations, if built yet"""
+    try:
+        with transaction.atomic():
+            # Locked so concurrent stores for the same user cannot overwrite each other's updates
+            recommendations = RecommendationSet.objects.select_for_update().filter(user_id=user_id).first()
+            if recommendations is None:
+                # Built from scratch on the first read instead
+                return
+            for memory in memories:
+                recommendations.apply_memory(memory)
+            refresh_items(recommendations)
+            recommendations.save()
+    except Exception as e:
+        logger.error(f"Failed to update recommendations: {e}")
@@ -0,0 +1,126 @@
+import logging
+from collections import deque
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Broadcast frames that carry a saved message and can be replayed to a resumed session
+REPLAYABLE_TYPES = ('chat_message', 'ai_response', 'crisis_alert')
+
+
+class _RoomBuffer:
+    __slots__ = ('connections', 'frames', 'versions', 'floor')
+
+    def __init__(self, size: int):
+        self.connections = 0
+        self.frames: deque = deque(maxlen=size)  # (message_id, frame), in arrival order
+        self.versions: Dict[int, int] = {}  # message_id -> version of its buffered frame
+        self.floor: Optional[int] = None  # lowest resume_from the buffer can serve
+
+    def raise_floor(self, dropped_id: int):
+        """A frame left the buffer, so resumes from before it are no longer complete"""
+        self.floor = max(self.floor, dropped_id + 1)
+
+
+class RoomHistory:
+    """Recent broadcast frames per room, for replaying to reconnecting clients.
+
+    A room is tracked only while this process has a socket in it; every
+    broadcast then reaches this process, so the buffer holds every message
+    newer than its oldest entry. When that cannot be guaranteed, replay()
+    returns None and the caller reads the database instead.
+
+    Edits and deletes arrive as versioned invalidations. A buffered frame is
+    dropped only by a newer version than its own, so redelivered or reordered
+    events from other replicas cannot evict a frame that is already current.
+
+    Frames from different replicas can arrive out of id order, so replay
+    sorts by message id, the order the database fallback uses. Coverage is
+    tracked as a floor raised past every dropped id, not read off the oldest
+    arrival, so a late frame cannot hide one evicted before it.
+    """
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._rooms: Dict[str, _RoomBuffer] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def attach(self, room: str):
+        buffer = self._rooms.get(room)
+        if buffer is None:
+            buffer = self._rooms[room] = _RoomBuffer(self.size)
+        buffer.connections += 1
+
+    def detach(self, room: str):
+        buffer = self._rooms.get(room)
+        if buffer is None:
+            return
+        buffer.connections -= 1
+        if buffer.connections <= 0:
+            # Nobody here receives the room's broadcasts any more, so the buffer would go stale
+            del self._rooms[room]
+
+    def observe(self, room: str, event: Dict):
+        """Update the buffer from a broadcast_frame event; every local receiver calls this"""
+        buffer = self._rooms.get(room)
+        if buffer is None:
+            return
+        if event.get('message_id') is not None:
+            self._record(buffer, event['message_id'], event['frame'], event.get('version', 1))
+        elif event.get('invalidates') is not None:
+            self._invalidate(buffer, event['invalidates'], event.get('version'))
+
+    def _record(self, buffer: _RoomBuffer, message_id: int, frame: str, version: int = 1):
+        if message_id in buffer.versions:
+            return
+        if buffer.floor is None:
+            buffer.floor = message_id
+        if len(buffer.frames) == buffer.frames.maxlen:
+            evicted_id = buffer.frames[0][0]
+            buffer.versions.pop(evicted_id, None)
+            buffer.raise_floor(evicted_id)
+        buffer.frames.append((message_id, frame))
+        buffer.versions[message_id] = version
+
+    def _invalidate(self, buffer: _RoomBuffer, message_id, version: Optional[int] = None):
+        """Drop the stale frame and everything older, so the rest stays a complete suffix"""
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return
+        buffered = buffer.versions.get(message_id)
+        if buffered is None or (version is not None and version <= buffered):
+            return
+        while buffer.frames:
+            oldest_id, _ = buffer.frames.popleft()
+            buffer.versions.pop(oldest_id, None)
+            buffer.raise_floor(oldest_id)
+            if oldest_id == message_id:
+                break
+
+    def replay(self, room: str, resume_from: int) -> Optional[List[str]]:
+        """Frames newer than resume_from, or None when the buffer does not cover that range"""
+        buffer = self._rooms.get(room)
+        if buffer is None or not buffer.frames or buffer.floor > resume_from:
+            self.misses += 1
+            return None
+        self.hits += 1
+        newer = sorted(
+            ((message_id, frame) for message_id, frame in buffer.frames if message_id > resume_from),
+            key=lambda item: item[0]
+        )
+        return [frame for _, frame in newer]
+
+    def get_stats(self) -> Dict:
+        return {
+            'rooms': len(self._rooms),
+            'frames': sum(len(buffer.frames) for buffer in self._rooms.values()),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+room_history = RoomHistory(size=getattr(settings, 'CHAT_REPLAY_BUFFER_SIZE', 200))
@@ -0,0 +1,413 @@
+"""Full-text search over a user's chat history, journal entries and memories.
+
+One index table, chat_search_index, holds a document per non-deleted chat
+message, per journal entry and per active memory. On SQLite it is an FTS5 virtual table ranked
+with bm25; on PostgreSQL a regular table with a generated tsvector column
+under a GIN index, ranked with ts_rank. Other databases, or SQLite builds
+without FTS5, fall back to substring matching ordered by recency.
+
+Database triggers on chat_message, dashboard_journalentry and chat_usermemory
+keep the index in step with every write, including the queryset update()s and bulk deletes
+that bypass model signals. SQLite drops a table's triggers when a migration
+rebuilds it, so a migration that alters one of them must call
+restore_triggers(); ChatSearchIndexTests fails until it does.
+
+Each document carries a scope token, 'r<room id>' for messages and
+'u<user id>' for journals and memories, and queries are restricted to the
+caller's scopes inside the index itself, so the cost follows the caller's
+own history rather than everyone's.
+"""
+import re
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from django.db import connection
+from django.db.models import Q
+
+from dashboard.models import JournalEntry
+from .models import ChatParticipant, Message
+
+logger = logging.getLogger(__name__)
+
+INDEX_TABLE = 'chat_search_index'
+# Kinds the history search covers; memories are searched through MemoryService
+KINDS = ('message', 'journal')
+MAX_QUERY_TERMS = 8
+SNIPPET_LENGTH = 160
+
+# Document ids interleave the sources: 3n for message n, 3n + 1 for journal entry n, 3n + 2 for memory n
+_MESSAGE_DOC = "{row}.id * 3, 'message', {row}.id, 'r' || {row}.room_id, {row}.content"
+_JOURNAL_DOC = "{row}.id * 3 + 1, 'journal', {row}.id, 'u' || {row}.user_id, {row}.title || ' ' || {row}.content"
+_MEMORY_DOC = "{row}.id * 3 + 2, 'memory', {row}.id, 'u' || {row}.user_id, {row}.content"
+
+_SQLITE_TRIGGER_NAMES = [
+    f"chat_search_{source}_{event}" for source in ('message', 'journal', 'memory') for event in ('ai', 'au', 'ad')
+]
+
+_SQLITE_TRIGGERS = [
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_message_ai AFTER INSERT ON chat_message
+    WHEN NOT NEW.is_deleted BEGIN
+        INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, scope, content) VALUES ({_MESSAGE_DOC.format(row='NEW')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_message_au AFTER UPDATE ON chat_message
+    WHEN OLD.content IS NOT NEW.content OR OLD.is_deleted IS NOT NEW.is_deleted BEGIN
+        DELETE FROM {INDEX_TABLE} WHERE rowid = OLD.id * 3;
+        INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, scope, content)
+            SELECT {_MESSAGE_DOC.format(row='NEW')} WHERE NOT NEW.is_deleted;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_message_ad AFTER DELETE ON chat_message BEGIN
+        DELETE FROM {INDEX_TABLE} WHERE rowid = OLD.id * 3;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_journal_ai AFTER INSERT ON dashboard_journalentry BEGIN
+        INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, scope, content) VALUES ({_JOURNAL_DOC.format(row='NEW')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_journal_au AFTER UPDATE ON dashboard_journalentry
+    WHEN OLD.title IS NOT NEW.title OR OLD.content IS NOT NEW.content BEGIN
+        DELETE FROM {INDEX_TABLE} WHERE rowid = OLD.id * 3 + 1;
+        INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, scope, content) VALUES ({_JOURNAL_DOC.format(row='NEW')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_journal_ad AFTER DELETE ON dashboard_journalentry BEGIN
+        DELETE FROM {INDEX_TABLE} WHERE rowid = OLD.id * 3 + 1;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_memory_ai AFTER INSERT ON chat_usermemory
+    WHEN NEW.is_active BEGIN
+        INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, scope, content) VALUES ({_MEMORY_DOC.format(row='NEW')});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_memory_au AFTER UPDATE ON chat_usermemory
+    WHEN OLD.content IS NOT NEW.content OR OLD.is_active IS NOT NEW.is_active BEGIN
+        DELETE FROM {INDEX_TABLE} WHERE rowid = OLD.id * 3 + 2;
+        INSERT INTO {INDEX_TABLE} (rowid, kind, object_id, scope, content)
+            SELECT {_MEMORY_DOC.format(row='NEW')} WHERE NEW.is_active;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS chat_search_memory_ad AFTER DELETE ON chat_usermemory BEGIN
+        DELETE FROM {INDEX_TABLE} WHERE rowid = OLD.id * 3 + 2;
+    END""",
+]
+
+_POSTGRES_TRIGGERS = [
+    f"""CREATE OR REPLACE FUNCTION chat_search_index_message() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.content IS NOT DISTINCT FROM NEW.content
+                AND OLD.is_deleted = NEW.is_deleted THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            DELETE FROM {INDEX_TABLE} WHERE doc_id = OLD.id * 3;
+        END IF;
+        IF TG_OP <> 'DELETE' AND NOT NEW.is_deleted THEN
+            INSERT INTO {INDEX_TABLE} (doc_id, kind, object_id, scope, content)
+                VALUES ({_MESSAGE_DOC.format(row='NEW')});
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    f"""CREATE OR REPLACE FUNCTION chat_search_index_journal() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.title IS NOT DISTINCT FROM NEW.title
+                AND OLD.content IS NOT DISTINCT FROM NEW.content THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            DELETE FROM {INDEX_TABLE} WHERE doc_id = OLD.id * 3 + 1;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            INSERT INTO {INDEX_TABLE} (doc_id, kind, object_id, scope, content)
+                VALUES ({_JOURNAL_DOC.format(row='NEW')});
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    f"""CREATE OR REPLACE FUNCTION chat_search_index_memory() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'UPDATE' AND OLD.content IS NOT DISTINCT FROM NEW.content
+                AND OLD.is_active = NEW.is_active THEN
+            RETURN NULL;
+        END IF;
+        IF TG_OP <> 'INSERT' THEN
+            DELETE FROM {INDEX_TABLE} WHERE doc_id = OLD.id * 3 + 2;
+        END IF;
+        IF TG_OP <> 'DELETE' AND NEW.is_active THEN
+            INSERT INTO {INDEX_TABLE} (doc_id, kind, object_id, scope, content)
+                VALUES ({_MEMORY_DOC.format(row='NEW')});
+        END IF;
+        RETURN NULL;
+    END $$ LANGUAGE plpgsql""",
+    "DROP TRIGGER IF EXISTS chat_search_message ON chat_message",
+    """CREATE TRIGGER chat_search_message AFTER INSERT OR UPDATE OR DELETE ON chat_message
+    FOR EACH ROW EXECUTE FUNCTION chat_search_index_message()""",
+    "DROP TRIGGER IF EXISTS chat_search_journal ON dashboard_journalentry",
+    """CREATE TRIGGER chat_search_journal AFTER INSERT OR UPDATE OR DELETE ON dashboard_journalentry
+    FOR EACH ROW EXECUTE FUNCTION chat_search_index_journal()""",
+    "DROP TRIGGER IF EXISTS chat_search_memory ON chat_usermemory",
+    """CREATE TRIGGER chat_search_memory AFTER INSERT OR UPDATE OR DELETE ON chat_usermemory
+    FOR EACH ROW EXECUTE FUNCTION chat_search_index_memory()""",
+]
+
+_backend_cache: Dict[str, Optional[str]] = {}
+
+
+def fts5_available(cursor) -> bool:
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE temp.chat_search_probe USING fts5(content)")
+        cursor.execute("DROP TABLE temp.chat_search_probe")
+        return True
+    except Exception:
+        return False
+
+
+def create_index(schema_editor):
+    """Create the index table and its triggers, and index existing rows"""
+    vendor = schema_editor.connection.vendor
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            if not fts5_available(cursor):
+                logger.error("SQLite was built without FTS5; chat search will use substring matching")
+                return
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {INDEX_TABLE} USING fts5("
+                "kind UNINDEXED, object_id UNINDEXED, scope, content, tokenize='porter unicode61')"
+            )
+        elif vendor == 'postgresql':
+            cursor.execute(
+                f"""CREATE TABLE IF NOT EXISTS {INDEX_TABLE} (
+                    doc_id bigint PRIMARY KEY,
+                    kind varchar(16) NOT NULL,
+                    object_id bigint NOT NULL,
+                    scope varchar(32) NOT NULL,
+                    content text NOT NULL,
+                    document tsvector GENERATED ALWAYS AS (to_tsvector('english', content)) STORED
+                )"""
+            )
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_document ON {INDEX_TABLE} USING GIN (document)")
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {INDEX_TABLE}_scope ON {INDEX_TABLE} (scope)")
+        else:
+            return
+    install_triggers(schema_editor.connection)
+    rebuild_index(schema_editor.connection)
+
+
+def drop_triggers(conn=connection):
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for name in _SQLITE_TRIGGER_NAMES:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute("DROP TRIGGER IF EXISTS chat_search_message ON chat_message")
+            cursor.execute("DROP TRIGGER IF EXISTS chat_search_journal ON dashboard_journalentry")
+            cursor.execute("DROP TRIGGER IF EXISTS chat_search_memory ON chat_usermemory")
+            cursor.execute("DROP FUNCTION IF EXISTS chat_search_index_message()")
+            cursor.execute("DROP FUNCTION IF EXISTS chat_search_index_journal()")
+            cursor.execute("DROP FUNCTION IF EXISTS chat_search_index_memory()")
+
+
+def drop_index(schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor not in ('sqlite', 'postgresql'):
+        return
+    drop_triggers(conn)
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {INDEX_TABLE}")
+
+
+def install_triggers(conn=connection):
+    statements = {'sqlite': _SQLITE_TRIGGERS, 'postgresql': _POSTGRES_TRIGGERS}.get(conn.vendor, [])
+    with conn.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def _index_exists(conn) -> bool:
+    with conn.cursor() as cursor:
+        return INDEX_TABLE in conn.introspection.table_names(cursor)
+
+
+def restore_triggers(schema_editor):
+    """Re-create the triggers in a migration that rebuilt one of the indexed tables"""
+    conn = schema_editor.connection
+    if _index_exists(conn):
+        install_triggers(conn)
+
+
+def reindex(schema_editor):
+    """Replace the triggers and re-index everything, for migrations that change what is indexed"""
+    conn = schema_editor.connection
+    if _index_exists(conn):
+        drop_triggers(conn)
+        install_triggers(conn)
+        rebuild_index(conn)
+
+
+def rebuild_index(conn=connection):
+    """Re-index every message, journal entry and memory from scratch"""
+    key = 'rowid' if conn.vendor == 'sqlite' else 'doc_id'
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {INDEX_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {INDEX_TABLE} ({key}, kind, object_id, scope, content) "
+            f"SELECT {_MESSAGE_DOC.format(row='m')} FROM chat_message m WHERE NOT m.is_deleted"
+        )
+        cursor.execute(
+            f"INSERT INTO {INDEX_TABLE} ({key}, kind, object_id, scope, content) "
+            f"SELECT {_JOURNAL_DOC.format(row='j')} FROM dashboard_journalentry j"
+        )
+        cursor.execute(
+            f"INSERT INTO {INDEX_TABLE} ({key}, kind, object_id, scope, content) "
+            f"SELECT {_MEMORY_DOC.format(row='u')} FROM chat_usermemory u WHERE u.is_active"
+        )
+
+
+def search_backend() -> Optional[str]:
+    """'fts5', 'postgres', or None when the index is unavailable"""
+    alias = connection.alias
+    if alias not in _backend_cache:
+        backend = None
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                if INDEX_TABLE in connection.introspection.table_names(cursor):
+                    backend = 'fts5' if connection.vendor == 'sqlite' else 'postgres'
+        _backend_cache[alias] = backend
+    return _backend_cache[alias]
+
+
+def query_terms(query: str) -> List[str]:
+    """Word tokens of the query; punctuation and search operators are dropped"""
+    return re.findall(r'\w+', query.lower())[:MAX_QUERY_TERMS]
+
+
+def make_snippet(content: str, terms: List[str]) -> str:
+    """Window of the content around the first matching term"""
+    if len(content) <= SNIPPET_LENGTH:
+        return content
+    lowered = content.lower()
+    positions = [lowered.find(term) for term in terms]
+    start = min([position for position in positions if position >= 0], default=0)
+    start = max(start - SNIPPET_LENGTH // 4, 0)
+    snippet = content[start:start + SNIPPET_LENGTH]
+    return ('…' if start else '') + snippet + ('…' if start + SNIPPET_LENGTH < len(content) else '')
+
+
+def _fts5_page(terms: List[str], scopes: List[str], kinds, limit: int, offset: int,
+               match_any: bool = False) -> List[Tuple[str, int, float]]:
+    # Terms are \w+ tokens, so quoting them is enough to keep them from being
+    # read as FTS5 syntax; the last one matches as a prefix for search-as-you-type
+    phrases = [f'"{term}"' for term in terms]
+    phrases[-1] += '*'
+    joiner = ' OR ' if match_any else ' '
+    match = f"scope : ({' OR '.join(scopes)}) AND content : ({joiner.join(phrases)})"
+    kinds = list(kinds)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT kind, object_id, bm25({INDEX_TABLE}, 0.0, 0.0, 0.0, 1.0) AS score "
+            f"FROM {INDEX_TABLE} WHERE {INDEX_TABLE} MATCH %s AND kind IN ({', '.join(['%s'] * len(kinds))}) "
+            f"ORDER BY score, rowid DESC LIMIT %s OFFSET %s",
+            [match, *kinds, limit, offset]
+        )
+        return [(kind, object_id, -score) for kind, object_id, score in cursor.fetchall()]
+
+
+def _postgres_page(terms: List[str], scopes: List[str], kinds, limit: int, offset: int,
+                   match_any: bool = False) -> List[Tuple[str, int, float]]:
+    if match_any:
+        tsquery, text = "to_tsquery('english', %s)", ' | '.join(terms)
+    else:
+        tsquery, text = "plainto_tsquery('english', %s)", ' '.join(terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT kind, object_id, ts_rank(document, query) AS score "
+            f"FROM {INDEX_TABLE}, {tsquery} query "
+            f"WHERE document @@ query AND scope = ANY(%s) AND kind = ANY(%s) "
+            f"ORDER BY score DESC, doc_id DESC LIMIT %s OFFSET %s",
+            [text, scopes, list(kinds), limit, offset]
+        )
+        return cursor.fetchall()
+
+
+def _substring_page(user, terms: List[str], kinds, limit: int, offset: int) -> List[Tuple[str, int, float]]:
+    rows = []
+    if 'message' in kinds:
+        messages = Message.objects.filter(room__participants=user, is_deleted=False)
+        for term in terms:
+            messages = messages.filter(content__icontains=term)
+        rows += [('message', pk, created_at) for pk, created_at in
+                 messages.order_by('-created_at').values_list('pk', 'created_at')[:offset + limit]]
+    if 'journal' in kinds:
+        entries = JournalEntry.objects.filter(user=user)
+        for term in terms:
+            entries = entries.filter(Q(title__icontains=term) | Q(content__icontains=term))
+        rows += [('journal', pk, created_at) for pk, created_at in
+                 entries.order_by('-created_at').values_list('pk', 'created_at')[:offset + limit]]
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return [(kind, pk, None) for kind, pk, _ in rows[offset:offset + limit]]
+
+
+def search_memory_ids(user_id: int, terms: List[str], limit: int, offset: int = 0) -> Optional[List[int]]:
+    """Ids of the user's active memories matching any of the terms, best match first.
+
+    None when the database has no index, so the caller can fall back to
+    substring matching.
+    """
+    backend = search_backend()
+    if not backend or not terms:
+        return None
+    page_rows = _fts5_page if backend == 'fts5' else _postgres_page
+    rows = page_rows(terms, [f"u{user_id}"], ['memory'], limit, offset, match_any=True)
+    return [object_id for _, object_id, _ in rows]
+
+
+def search(user, query: str, kinds=KINDS, page: int = 1, page_size: int = 20) -> Tuple[List[Dict], bool]:
+    """One page of the user's matching messages and journal entries, best match first.
+
+    Messages are searched in rooms the user currently participates in.
+    Returns the results and whether another page follows.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return [], False
+    offset = (page - 1) * page_size
+    backend = search_backend()
+
+    if backend:
+        scopes = []
+        if 'message' in kinds:
+            scopes += [f"r{room_id}" for room_id in
+                       ChatParticipant.objects.filter(user=user).values_list('room_id', flat=True)]
+        if 'journal' in kinds:
+            scopes.append(f"u{user.id}")
+        if not scopes:
+            return [], False
+        page_rows = _fts5_page if backend == 'fts5' else _postgres_page
+        rows = page_rows(terms, scopes, kinds, page_size + 1, offset)
+    else:
+        rows = _substring_page(user, terms, kinds, page_size + 1, offset)
+
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    message_ids = [object_id for kind, object_id, _ in rows if kind == 'message']
+    journal_ids = [object_id for kind, object_id, _ in rows if kind == 'journal']
+    messages = Message.objects.select_related('room', 'sender').in_bulk(message_ids) if message_ids else {}
+    entries = JournalEntry.objects.in_bulk(journal_ids) if journal_ids else {}
+
+    results = []
+    for kind, object_id, score in rows:
+        if kind == 'message' and object_id in messages:
+            message = messages[object_id]
+            results.append({
+                'type': 'message',
+                'id': message.id,
+                'room_id': message.room_id,
+                'room_name': message.room.name,
+                'sender': message.sender.username,
+                'snippet': make_snippet(message.content, terms),
+                'created_at': message.created_at.isoformat(),
+                'score': score,
+            })
+        elif kind == 'journal' and object_id in entries:
+            entry = entries[object_id]
+            results.append({
+                'type': 'journal',
+                'id': entry.id,
+                'title': entry.title,
+                'snippet': make_snippet(entry.content, terms),
+                'created_at': entry.created_at.isoformat(),
+                'score': score,
+            })
+    return results, has_more
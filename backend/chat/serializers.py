@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
+from django.db.models import Count, IntegerField, Manager, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
 from .models import (
     ChatRoom, Message, ChatParticipant, CrisisAlert, 
     AIResponse, MessageReaction, ChatSession
@@ -29,17 +31,36 @@ class MessageReactionSerializer(serializers.ModelSerializer):
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
-    reactions = MessageReactionSerializer(many=True, read_only=True)
+    my_reactions = serializers.SerializerMethodField()
     reply_to_message = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = [
             'id', 'content', 'sender', 'message_type', 'created_at', 
-            'is_edited', 'edited_at', 'reply_to', 'reply_to_message',
-            'reactions', 'file_attachment', 'image_attachment'
+            'is_edited', 'edited_at', 'version', 'reply_to', 'reply_to_message',
+            'reaction_counts', 'my_reactions', 'file_attachment', 'image_attachment'
         ]
-        read_only_fields = ['id', 'sender', 'created_at', 'is_edited', 'edited_at']
+        read_only_fields = ['id', 'sender', 'created_at', 'is_edited', 'edited_at', 'version', 'reaction_counts']
+
+    @staticmethod
+    def setup_eager_loading(queryset, user=None):
+        """Load senders and replies up front so a page costs a fixed number of queries.
+
+        Reaction counts are a column of the message itself; only the given
+        user's own reactions are prefetched, however popular the messages are.
+        """
+        queryset = queryset.select_related('sender', 'reply_to__sender')
+        if user is None:
+            return queryset
+        return queryset.prefetch_related(Prefetch(
+            'reactions',
+            queryset=MessageReaction.objects.filter(user=user).only('message_id', 'reaction_type'),
+            to_attr='viewer_reactions'
+        ))
+
+    def get_my_reactions(self, obj):
+        return [reaction.reaction_type for reaction in getattr(obj, 'viewer_reactions', [])]
     
     def get_reply_to_message(self, obj):
         if obj.reply_to:
@@ -50,11 +71,76 @@ class MessageSerializer(serializers.ModelSerializer):
             }
         return None
 
+def _truncate(content, length):
+    return content[:length] + '...' if len(content) > length else content
+
+
+def load_last_messages(rooms):
+    """Attach the messages named by annotate_rooms() to the rooms, with one query for all of them"""
+    ids = [room.last_message_id for room in rooms if room.last_message_id is not None]
+    messages = Message.objects.select_related('sender').order_by().in_bulk(ids) if ids else {}
+    for room in rooms:
+        room.loaded_last_message = messages.get(room.last_message_id)
+
+
+class AnnotatedRoomListSerializer(serializers.ListSerializer):
+    """Loads the last messages of a whole page of annotated rooms before serializing it"""
+
+    def to_representation(self, data):
+        rooms = list(data.all() if isinstance(data, Manager) else data)
+        annotated = [room for room in rooms if hasattr(room, 'last_message_id')]
+        if annotated:
+            load_last_messages(annotated)
+        return super().to_representation(rooms)
+
+
+def _annotated_last_message(obj):
+    """Last message of a room annotated by annotate_rooms(), or from the database when not annotated"""
+    if hasattr(obj, 'last_message_id'):
+        if not hasattr(obj, 'loaded_last_message'):
+            load_last_messages([obj])
+        last_message = obj.loaded_last_message
+    else:
+        last_message = obj.get_last_message()
+    if last_message:
+        return {
+            'id': last_message.id,
+            'content': last_message.content,
+            'sender': last_message.sender.username,
+            'created_at': last_message.created_at
+        }
+    return None
+
+
+def annotate_rooms(queryset, user=None):
+    """Annotate rooms with their last message id, participant count and the user's role.
+
+    Each value is a correlated subquery, so listing rooms costs the same
+    number of queries however many rooms there are. The last messages
+    themselves are loaded together by AnnotatedRoomListSerializer.
+    """
+    last_message = Message.objects.filter(
+        room=OuterRef('pk'), is_deleted=False
+    ).order_by('-created_at', '-id')
+    participant_total = ChatParticipant.objects.filter(room=OuterRef('pk')).order_by().values(
+        'room'
+    ).annotate(total=Count('id')).values('total')
+    queryset = queryset.annotate(
+        last_message_id=Subquery(last_message.values('id')[:1]),
+        participant_total=Coalesce(Subquery(participant_total, output_field=IntegerField()), 0)
+    )
+    if user is not None and user.is_authenticated:
+        queryset = queryset.annotate(user_role=Subquery(
+            ChatParticipant.objects.filter(room=OuterRef('pk'), user=user).values('role')[:1]
+        ))
+    return queryset
+
+
 class ChatRoomSerializer(serializers.ModelSerializer):
     created_by = UserSerializer(read_only=True)
     participants = ChatParticipantSerializer(source='chatparticipant_set', many=True, read_only=True)
     last_message = serializers.SerializerMethodField()
-    participant_count = serializers.ReadOnlyField()
+    participant_count = serializers.SerializerMethodField()
     
     class Meta:
         model = ChatRoom
@@ -64,17 +150,24 @@ class ChatRoomSerializer(serializers.ModelSerializer):
             'participant_count', 'last_message', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'created_by', 'created_at', 'updated_at']
+        list_serializer_class = AnnotatedRoomListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset, user=None):
+        return annotate_rooms(queryset, user).select_related('created_by').prefetch_related(
+            Prefetch('chatparticipant_set', queryset=ChatParticipant.objects.select_related('user'))
+        )
     
     def get_last_message(self, obj):
-        last_message = obj.get_last_message()
+        last_message = _annotated_last_message(obj)
         if last_message:
-            return {
-                'id': last_message.id,
-                'content': last_message.content[:50] + '...' if len(last_message.content) > 50 else last_message.content,
-                'sender': last_message.sender.username,
-                'created_at': last_message.created_at
-            }
-        return None
+            last_message['content'] = _truncate(last_message['content'], 50)
+        return last_message
+
+    def get_participant_count(self, obj):
+        if hasattr(obj, 'participant_total'):
+            return obj.participant_total
+        return obj.participant_count
 
 class CrisisAlertSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -86,10 +179,12 @@ class CrisisAlertSerializer(serializers.ModelSerializer):
         fields = [
             'id', 'user', 'room', 'severity', 'status', 'alert_reason',
             'location', 'emergency_contacts_notified', 'responder',
-            'responded_at', 'resolution_notes', 'created_at', 'updated_at'
+            'responded_at', 'resolution_notes', 'occurrences', 'keywords',
+            'last_triggered_at', 'created_at', 'updated_at'
         ]
         read_only_fields = [
-            'id', 'user', 'responder', 'responded_at', 'created_at', 'updated_at'
+            'id', 'user', 'responder', 'responded_at', 'occurrences', 'keywords',
+            'last_triggered_at', 'created_at', 'updated_at'
         ]
 
 class AIResponseSerializer(serializers.ModelSerializer):
@@ -121,7 +216,7 @@ class ChatSessionSerializer(serializers.ModelSerializer):
 
 class ChatRoomListSerializer(serializers.ModelSerializer):
     """Lightweight serializer for listing chat rooms"""
-    participant_count = serializers.ReadOnlyField()
+    participant_count = serializers.SerializerMethodField()
     last_message_preview = serializers.SerializerMethodField()
     user_role = serializers.SerializerMethodField()
     
@@ -131,18 +226,30 @@ class ChatRoomListSerializer(serializers.ModelSerializer):
             'id', 'name', 'room_type', 'description', 'participant_count',
             'last_message_preview', 'user_role', 'updated_at'
         ]
+        list_serializer_class = AnnotatedRoomListSerializer
+
+    @staticmethod
+    def setup_eager_loading(queryset, user=None):
+        return annotate_rooms(queryset, user)
     
+    def get_participant_count(self, obj):
+        if hasattr(obj, 'participant_total'):
+            return obj.participant_total
+        return obj.participant_count
+
     def get_last_message_preview(self, obj):
-        last_message = obj.get_last_message()
+        last_message = _annotated_last_message(obj)
         if last_message:
             return {
-                'content': last_message.content[:30] + '...' if len(last_message.content) > 30 else last_message.content,
-                'sender': last_message.sender.username,
-                'created_at': last_message.created_at
+                'content': _truncate(last_message['content'], 30),
+                'sender': last_message['sender'],
+                'created_at': last_message['created_at']
             }
         return None
     
     def get_user_role(self, obj):
+        if hasattr(obj, 'user_role'):
+            return obj.user_role
         request = self.context.get('request')
         if request and request.user:
             try:
@@ -219,6 +326,8 @@ class WSChatMessageSerializer(serializers.Serializer):
     created_at = serializers.DateTimeField()
     is_edited = serializers.BooleanField()
     edited_at = serializers.DateTimeField(allow_null=True)
+    version = serializers.IntegerField()
+    reaction_counts = serializers.DictField(child=serializers.IntegerField())
     reply_to = serializers.IntegerField(allow_null=True)
 
 class WSTypingIndicatorSerializer(serializers.Serializer):
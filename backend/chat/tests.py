@@ -1,3 +1,2130 @@
-from django.test import TestCase
+import json
+import zlib
+import asyncio
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connection, transaction
+from django.db.models import F, QuerySet
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .llm_router import GeminiProvider, OpenAIProvider, LLMRouter, LLMProviderError, LatencyTracker
+from .memory_models import MemoryDigest, KnowledgeBase, UserMemory
+from .recommendation_models import RecommendationSet
+from . import recommendations
+from .memory_service import MemoryService, EmbeddingQueue
+from .rag_service import RAGService
+from .typing_indicator import TypingTracker
+from .presence import InMemoryPresenceStore, LastSeenBuffer
+from .models import ChatRoom, ChatParticipant, Message, MessageReaction, CrisisAlert
+from .crisis_alerts import record_crisis_signal
+from .message_history import room_history_page
+from .pagination import encode_rank_cursor
+from . import message_edits
+from . import reactions
+from . import search
+from dashboard.models import JournalEntry
+from .anonymous import (
+    AnonymousSession, SESSION_PROTOCOL, TOKEN_PROTOCOL_PREFIX, load_session, token_from_protocols
+)
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from .broadcast import frame_event
+from .consumers import ChatConsumer
+from .serializers import ChatRoomListSerializer
+from .routing import websocket_urlpatterns
+from . import presence
+from .ai_scheduler import AIScheduler, ai_scheduler
+from .rate_limit import TokenBucket, RateLimiter, ConnectionRateLimit
+from . import consumers
+from . import ai_batch
+from .management.commands import loadtest_chat
+from .ai_support import (
+    CRISIS_KEYWORDS, POSITIVE_KEYWORDS, crisis_screener, detect_crisis_keywords,
+    check_message_urgency, analyze_sentiment, _generate_llm_text
+)
+from .replay import RoomHistory
+from .singleflight import SingleFlight, prompt_key
+from .prompt_builder import PromptAssembler, estimate_tokens, truncate_to_tokens
+from .wire_protocol import MsgPackProtocol, negotiate, MSGPACK_DEFLATE_PROTOCOL, HEADER_DEFLATE, HEADER_PLAIN
+from . import urls
+from mental_health_backend.perf_budget import BudgetTestMixin, Endpoint
+
+User = get_user_model()
+
+
+class FakeProviderServer:
+    """Local HTTP server that answers like OpenAI or Gemini after a delay"""
+
+    def __init__(self, style='openai', delay=0.0, status=200, text='fake reply'):
+        self.style = style
+        self.delay = delay
+        self.status = status
+        self.text = text
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                server.requests += 1
+                time.sleep(server.delay)
+                if server.style == 'gemini':
+                    body = {'candidates': [{'content': {'parts': [{'text': server.text}]}}]}
+                else:
+                    body = {'choices': [{'message': {'role': 'assistant', 'content': server.text}}]}
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(server.status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def warm_up(provider, latency, samples=5):
+    for _ in range(samples):
+        provider.latency.record_success(latency)
+
+
+class LLMRouterTests(SimpleTestCase):
+    def test_openai_and_gemini_wire_formats(self):
+        with FakeProviderServer('openai', text='from openai') as openai_server, \
+                FakeProviderServer('gemini', text='from gemini') as gemini_server:
+            openai = OpenAIProvider('key', 'gpt-test', openai_server.url)
+            gemini = GeminiProvider('key', 'gemini-test', gemini_server.url)
+
+            self.assertEqual(openai.generate('hi'), 'from openai')
+            self.assertEqual(gemini.generate('hi'), 'from gemini')
+
+    def test_hedges_to_backup_after_primary_p90(self):
+        with FakeProviderServer('gemini', delay=1.0, text='slow') as slow, \
+                FakeProviderServer('openai', delay=0.0, text='fast') as fast:
+            primary = GeminiProvider('key', 'gemini-test', slow.url)
+            backup = OpenAIProvider('key', 'gpt-test', fast.url)
+            # The primary is normally quick, so its p90 is well under the 1s stall
+            warm_up(primary, 0.02)
+            warm_up(backup, 0.05)
+            router = LLMRouter([primary, backup], min_hedge_delay=0.01)
+
+            started = time.monotonic()
+            result = router.generate('hello')
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(result.text, 'fast')
+        self.assertEqual(result.provider, 'openai')
+        self.assertTrue(result.hedged)
+        self.assertLess(elapsed, 0.8)
+
+    def test_no_hedge_when_primary_answers_in_time(self):
+        with FakeProviderServer('gemini', text='primary') as first, \
+                FakeProviderServer('openai', text='backup') as second:
+            primary = GeminiProvider('key', 'gemini-test', first.url)
+            backup = OpenAIProvider('key', 'gpt-test', second.url)
+            router = LLMRouter([primary, backup])
+
+            result = router.generate('hello')
+
+        self.assertEqual(result.text, 'primary')
+        self.assertFalse(result.hedged)
+        self.assertEqual(second.requests, 0)
+
+    def test_fails_over_on_provider_error(self):
+        with FakeProviderServer('gemini', status=500) as broken, \
+                FakeProviderServer('openai', text='recovered') as healthy:
+            router = LLMRouter([
+                GeminiProvider('key', 'gemini-test', broken.url),
+                OpenAIProvider('key', 'gpt-test', healthy.url),
+            ])
+
+            result = router.generate('hello')
+
+        self.assertEqual(result.text, 'recovered')
+        self.assertGreater(router.providers[0].latency.failure_rate, 0)
+
+    def test_raises_when_all_providers_fail(self):
+        with FakeProviderServer('openai', status=503) as broken:
+            router = LLMRouter([OpenAIProvider('key', 'gpt-test', broken.url)])
+            with self.assertRaises(LLMProviderError):
+                router.generate('hello')
+
+    def test_routes_to_lowest_ewma_latency(self):
+        slow = GeminiProvider('key', 'gemini-test', 'http://127.0.0.1:9')
+        quick = OpenAIProvider('key', 'gpt-test', 'http://127.0.0.1:9')
+        warm_up(slow, 0.9)
+        warm_up(quick, 0.1)
+
+        router = LLMRouter([slow, quick])
+
+        self.assertEqual(router.ordered_providers()[0], quick)
+
+    def test_latency_tracker_p90_above_mean(self):
+        tracker = LatencyTracker(default_p90=5.0)
+        self.assertEqual(tracker.p90(), 5.0)
+
+        for latency in [0.1, 0.3, 0.2, 0.4, 0.1, 0.3]:
+            tracker.record_success(latency)
+
+        self.assertGreater(tracker.p90(), tracker.mean)
+        self.assertLess(tracker.p90(), 1.0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def run_concurrently(self, flight, key, fn, callers):
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(flight.do(key, fn))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def wait_for_waiters(self, flight, key, count):
+        deadline = time.monotonic() + 2
+        while flight._calls[key].waiters < count:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.001)
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(2)
+            return 'answer'
+
+        threads, results, errors = self.run_concurrently(flight, 'k', fn, 4)
+        self.wait_for_waiters(flight, 'k', 3)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(results), [('answer', False)] + [('answer', True)] * 3)
+        self.assertEqual(flight.get_stats(), {'executions': 1, 'shared': 3, 'in_flight': 0})
+
+    def test_leader_error_reaches_every_waiter(self):
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def fn():
+            release.wait(2)
+            raise LLMProviderError('provider down')
+
+        threads, results, errors = self.run_concurrently(flight, 'k', fn, 3)
+        self.wait_for_waiters(flight, 'k', 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ['provider down'] * 3)
+
+    def test_key_is_forgotten_once_the_call_completes(self):
+        flight = SingleFlight()
+        self.assertEqual(flight.do('k', lambda: 1), (1, False))
+        self.assertEqual(flight.in_flight(), 0)
+        # Later calls run again rather than reusing the finished result
+        self.assertEqual(flight.do('k', lambda: 2), (2, False))
+        with self.assertRaises(ValueError):
+            flight.do('k', mock.Mock(side_effect=ValueError))
+        self.assertEqual(flight.do('k', lambda: 3), (3, False))
+        self.assertEqual(flight.executions, 4)
+
+    def test_prompt_key_includes_the_model(self):
+        self.assertNotEqual(prompt_key('hello', model='openai:gpt-a'), prompt_key('hello', model='openai:gpt-b'))
+        router = LLMRouter([GeminiProvider('key', 'gemini-test', 'http://127.0.0.1:9'),
+                            OpenAIProvider('key', 'gpt-test', 'http://127.0.0.1:9')])
+        self.assertEqual(router.model_key(), 'gemini:gemini-test,openai:gpt-test')
+
+        assembled = SimpleNamespace(text='hello', personalized=False)
+        with mock.patch('chat.ai_support.llm_router', router), \
+                mock.patch('chat.ai_support.llm_singleflight') as flight:
+            flight.do.return_value = ('reply', False)
+            self.assertEqual(_generate_llm_text(assembled), 'reply')
+        self.assertEqual(flight.do.call_args.args[0], prompt_key('hello', model=router.model_key()))
+
+
+class PromptBuilderTests(SimpleTestCase):
+    def knowledge(self, title, content, score):
+        return {'content': content, 'relevance_score': score, 'metadata': {'title': title}}
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(''), 0)
+        self.assertEqual(estimate_tokens('abcd'), 1)
+        # Word-dense text estimates by word pieces rather than characters
+        self.assertEqual(estimate_tokens('a, b, c, d.'), 6)
+        long_text = 'x' * 4001
+        self.assertEqual(estimate_tokens(long_text), 1001)
+
+    def test_truncate_to_tokens(self):
+        text = 'First sentence here. Second sentence is a good deal longer than the first one.'
+        self.assertIs(truncate_to_tokens(text, 100), text)
+        self.assertEqual(truncate_to_tokens(text, 1), '')
+
+        # Sentence boundaries win over word boundaries when one falls in the second half of the cut
+        cut = truncate_to_tokens(text, 10)
+        self.assertLessEqual(estimate_tokens(cut), 10)
+        self.assertEqual(cut, 'First sentence here....')
+        self.assertEqual(truncate_to_tokens(text, 6), 'First sentence...')
+
+        words = ' '.join(['word'] * 200)
+        cut = truncate_to_tokens(words, 40)
+        self.assertLessEqual(estimate_tokens(cut), 40)
+        self.assertTrue(cut.endswith('word...'))
+
+    def test_sections_are_packed_by_score_within_the_budget(self):
+        assembler = PromptAssembler(token_budget=400)
+        relevant = [
+            self.knowledge('Low', 'low priority tip ' * 40, 0.2),
+            self.knowledge('High', 'Breathe in for four counts.', 0.9),
+        ]
+        history = [{'role': 'user', 'content': f'turn {i}'} for i in range(3)]
+        prompt = assembler.build('How do I calm down?', user_context={}, relevant_knowledge=relevant,
+                                 history=history)
+
+        self.assertLessEqual(prompt.total_tokens, 400)
+        self.assertIn('High: Breathe in for four counts.', prompt.text)
+        # The low-scoring entry only gets what is left after everything ranked above it
+        self.assertGreater(prompt.token_usage['knowledge'], estimate_tokens('High: Breathe in for four counts.'))
+        self.assertTrue(prompt.text.index('User: turn 2') < prompt.text.index('User: turn 0'))
+        self.assertTrue(prompt.personalized)
+
+    def test_overflowing_items_are_dropped(self):
+        budget = 600
+        assembler = PromptAssembler(token_budget=budget)
+        relevant = [self.knowledge(f'Tip {i}', 'steady breathing helps ' * 30, 0.5) for i in range(5)]
+        history = [{'role': 'assistant', 'content': 'an earlier reply ' * 30} for _ in range(3)]
+        prompt = assembler.build('hello ' * 400, relevant_knowledge=relevant, history=history)
+
+        self.assertLessEqual(prompt.total_tokens, budget)
+        # The message is capped at half the budget, plus its label
+        self.assertLessEqual(prompt.token_usage['message'], budget // 2 + 5)
+        # One tip is truncated into the leftover budget; the other tips and all history are dropped
+        self.assertGreater(prompt.token_usage['knowledge'], PromptAssembler.MIN_FRAGMENT_TOKENS)
+        self.assertEqual(prompt.text.count('Tip '), 1)
+        self.assertEqual(prompt.token_usage['history'], 0)
+        self.assertEqual(prompt.dropped_items, 7)
+        self.assertFalse(prompt.personalized)
+
+    def test_crisis_prompts_leave_out_context(self):
+        prompt = PromptAssembler(token_budget=400).build(
+            'I want to end it', mode='crisis', crisis_keywords=['end it'],
+            relevant_knowledge=[self.knowledge('Tip', 'breathe', 0.9)],
+            history=[{'role': 'user', 'content': 'earlier'}]
+        )
+        self.assertEqual(set(prompt.token_usage), {'instructions', 'message'})
+        self.assertIn('end it', prompt.text)
+        self.assertNotIn('breathe', prompt.text)
+        self.assertFalse(prompt.personalized)
+
+
+class MemoryDigestTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='digest@example.com', username='digest', password='pass12345',
+            first_name='Dee', last_name='Gest'
+        )
+        self.service = MemoryService()
+
+    def test_store_updates_digest_incrementally(self):
+        self.service.store_user_memory(self.user, "Personal context: I am a nurse", 'personal_info')
+        self.service.store_user_memory(
+            self.user, "User mood: negative (confidence: 0.80)", 'mood_pattern',
+            context={'sentiment_analysis': {'sentiment': 'negative'}}
+        )
+        self.service.store_user_memory(
+            self.user, "User mentioned preferences/experiences: walking helps", 'preference'
+        )
+        self.service.store_user_memory(self.user, "Personal context: I am a nurse", 'personal_info')
+
+        digest = MemoryDigest.objects.get(user=self.user)
+        self.assertEqual(digest.as_dict()['facts'], ["I am a nurse"])
+        self.assertEqual(digest.as_dict()['preferences'], ["walking helps"])
+        self.assertEqual(digest.mood_summary['last'], 'negative')
+        self.assertEqual(digest.memory_count, 4)
+
+    def test_about_me_retrieval_includes_recent_moods(self):
+        fact = self.service.store_user_memory(self.user, "Personal context: I am a nurse", 'personal_info')
+        mood = self.service.store_user_memory(
+            self.user, "User mood: negative (confidence: 0.80)", 'mood_pattern',
+            context={'sentiment_analysis': {'sentiment': 'negative'}}
+        )
+        self.service.store_user_memory(self.user, "Tried a new recipe", 'session_note')
+
+        found = self.service.retrieve_relevant_memories(self.user, "What do you know about me?")
+        self.assertEqual({memory.id for memory in found}, {fact.id, mood.id})
+
+    def test_digest_updates_lock_the_digest_row(self):
+        self.service.store_user_memory(self.user, "Personal context: I am a nurse", 'personal_info')
+        with mock.patch.object(MemoryDigest.objects, 'select_for_update',
+                               wraps=MemoryDigest.objects.select_for_update) as lock:
+            self.service.store_user_memory(self.user, "Personal context: I have a dog", 'personal_info')
+        lock.assert_called_once_with()
+        self.assertEqual(MemoryDigest.objects.get(user=self.user).memory_count, 2)
+
+    def test_rebuild_drops_inactive_memories(self):
+        memory = self.service.store_user_memory(self.user, "Personal context: I have a dog", 'personal_info')
+        memory.is_active = False
+        memory.save()
+
+        digest = self.service.rebuild_memory_digest(self.user.id)
+
+        self.assertTrue(digest.is_empty())
+
+    def test_memory_query_answered_from_digest(self):
+        self.service.store_user_memory(self.user, "Personal context: I am a nurse", 'personal_info')
+        self.service.get_personalization_profile(self.user)
+        rag = RAGService()
+
+        # Digest lookup, profile lookup, then no memory or knowledge scans
+        with self.assertNumQueries(2):
+            result = rag.generate_contextual_response("What do you know about me?", user=self.user)
+
+        self.assertIn("I am a nurse", result['response'])
+
+    def test_profile_endpoint(self):
+        self.service.store_user_memory(self.user, "Personal context: I am a nurse", 'personal_info')
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(reverse('memory_profile'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['success'])
+        self.assertEqual(response.data['profile']['facts'], ["I am a nurse"])
+
+
+class MemoryApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            email='memories@example.com', username='memories', password='pass12345',
+            first_name='Mem', last_name='Ory'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_add_single_and_batch(self):
+        response = self.client.post(reverse('memory_add'), {
+            'content': 'Gratitude journaling before bed', 'category': 'journal',
+            'metadata': {'source': 'dashboard'}
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        batch = [{'content': f'Walked outside, day {i}', 'category': 'goals'} for i in range(5)]
+        response = self.client.post(reverse('memory_add'), {'memories': batch}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 5)
+        self.assertEqual(self.user.memories.filter(memory_type='goal').count(), 5)
+
+    def test_add_rejects_empty_content(self):
+        response = self.client.post(reverse('memory_add'), {'memories': [{'content': ' '}]}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_pages_with_cursor(self):
+        MemoryService().add_memories(self.user.id, [
+            {'content': f'Breathing exercise helped my mood {i}', 'category': 'meditation'} for i in range(7)
+        ] + [{'content': 'Unrelated note', 'category': 'journal'}])
+
+        seen = []
+        cursor = None
+        while True:
+            response = self.client.post(reverse('memory_search'), {
+                'query': 'mood patterns', 'limit': 3, 'cursor': cursor
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            seen.extend(memory['id'] for memory in response.data['memories'])
+            cursor = response.data['next_cursor']
+            if not cursor:
+                break
+
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_vector_results_page_in_similarity_order(self):
+        memories = MemoryService().add_memories(self.user.id, [
+            {'content': f'Note {i}', 'category': 'journal'} for i in range(4)
+        ])
+        nearest = [memories[2].id, memories[0].id, memories[3].id, memories[1].id]
+
+        seen = []
+        cursor = None
+        with mock.patch.object(MemoryService, '_vector_candidate_ids', return_value=nearest):
+            while True:
+                response = self.client.post(reverse('memory_search'), {
+                    'query': 'notes', 'limit': 3, 'cursor': cursor
+                }, format='json')
+                self.assertEqual(response.status_code, 200)
+                seen.extend(memory['id'] for memory in response.data['memories'])
+                cursor = response.data['next_cursor']
+                if not cursor:
+                    break
+
+        self.assertEqual(seen, nearest)
+
+    def test_cursor_from_another_ranking_restarts_the_search(self):
+        memories = MemoryService().add_memories(self.user.id, [
+            {'content': f'Note {i}', 'category': 'journal'} for i in range(4)
+        ])
+
+        def search(cursor=None):
+            return self.client.post(reverse('memory_search'), {
+                'query': 'notes', 'limit': 2, 'cursor': cursor
+            }, format='json')
+
+        with mock.patch.object(MemoryService, '_vector_candidate_ids', return_value=[m.id for m in memories]):
+            cursor = search().data['next_cursor']
+
+        # The vector index stopped answering mid-scroll: start over instead of failing
+        with mock.patch.object(MemoryService, '_vector_candidate_ids', return_value=[]):
+            response = search(cursor)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['memories']), 2)
+        self.assertEqual(search(response.data['next_cursor']).status_code, 200)
+
+    def test_add_rejects_non_object_metadata(self):
+        for metadata in ('x', ['a']):
+            response = self.client.post(reverse('memory_add'), {
+                'content': 'Tea helps', 'metadata': metadata
+            }, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_search_rejects_bad_cursor(self):
+        response = self.client.post(reverse('memory_search'), {'cursor': 'not-a-cursor'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_logged_mood_feeds_digest(self):
+        MemoryService().add_memory(
+            user_id=str(self.user.id),
+            content="User logged mood: calm (score: 7) on 2026-01-01",
+            category="mood_tracking"
+        )
+
+        digest = MemoryDigest.objects.get(user=self.user)
+        self.assertEqual(digest.mood_summary['last'], 'calm')
+
+
+class RoomHistoryApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='reader', email='reader@example.com')
+        self.room = ChatRoom.objects.create(name='history', room_type='peer', created_by=self.user)
+        ChatParticipant.objects.create(room=self.room, user=self.user)
+        Message.objects.bulk_create([
+            Message(room=self.room, sender=self.user, content=f'message {i}', is_deleted=(i == 3))
+            for i in range(7)
+        ])
+        # Identical timestamps force the id tie-breaker
+        Message.objects.filter(room=self.room).update(created_at=timezone.now())
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse('chatroom-messages', args=[self.room.pk])
+
+    def test_cursor_pages_walk_history_without_counting(self):
+        seen, cursor = [], None
+        while True:
+            params = {'page_size': 2, **({'cursor': cursor} if cursor else {})}
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(any('COUNT(' in q['sql'].upper() for q in queries.captured_queries))
+            seen += [m['content'] for m in response.data['messages']]
+            cursor = response.data['next_cursor']
+            self.assertEqual(response.data['has_more'], cursor is not None)
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [f'message {i}' for i in (6, 5, 4, 2, 1, 0)])
+        self.assertNotIn('total_count', response.data)
+
+    def test_total_is_cached_and_bad_cursor_rejected(self):
+        cache.clear()
+        self.assertEqual(self.client.get(self.url, {'include_total': 'true'}).data['total_count'], 6)
+        Message.objects.create(room=self.room, sender=self.user, content='new')
+        self.assertEqual(self.client.get(self.url, {'include_total': 'true'}).data['total_count'], 6)
+
+        self.assertEqual(self.client.get(self.url, {'cursor': 'garbage'}).status_code, 400)
+        # Rank cursors from ranked memory search are not keyset cursors
+        self.assertEqual(self.client.get(self.url, {'cursor': encode_rank_cursor(2, 'vector')}).status_code, 400)
+
+    def test_history_query_uses_composite_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('query plan check is SQLite-specific')
+        page, cursor = room_history_page(self.room, page_size=2)
+        for cursor in (None, cursor):
+            with CaptureQueriesContext(connection) as queries:
+                room_history_page(self.room, cursor=cursor, page_size=2)
+            with connection.cursor() as db:
+                db.execute('EXPLAIN QUERY PLAN ' + queries.captured_queries[0]['sql'])
+                plan = ' '.join(str(row) for row in db.fetchall())
+            self.assertIn('chat_message_history_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ChatSearchIndexTests(TestCase):
+    def setUp(self):
+        if not search.search_backend():
+            self.skipTest('no full-text index on this database')
+        self.user = User.objects.create(username='seeker', email='seeker@example.com')
+        self.other = User.objects.create(username='other', email='other@example.com')
+        self.room = ChatRoom.objects.create(name='walkers', room_type='peer', created_by=self.user)
+        self.private = ChatRoom.objects.create(name='private', room_type='peer', created_by=self.other)
+        ChatParticipant.objects.create(room=self.room, user=self.user)
+        ChatParticipant.objects.create(room=self.private, user=self.other)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def ids(self, query, **params):
+        response = self.client.get(reverse('search_history'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [(result['type'], result['id']) for result in response.data['results']], response.data
+
+    def test_results_are_ranked_and_limited_to_the_users_rooms_and_journal(self):
+        passing = Message.objects.create(room=self.room, sender=self.user, content='Went for a walk, then breakfast and calls')
+        focused = Message.objects.create(room=self.room, sender=self.user, content='walking walks walked')
+        Message.objects.create(room=self.private, sender=self.other, content='a walk nobody else should see')
+        entry = JournalEntry.objects.create(user=self.user, title='Evening walk', content='Calm')
+        JournalEntry.objects.create(user=self.other, title='Their walk', content='Private')
+
+        results, _ = self.ids('walking')
+        self.assertEqual(results[0], ('message', focused.id))
+        self.assertEqual(set(results), {('message', focused.id), ('message', passing.id), ('journal', entry.id)})
+        self.assertEqual(self.ids('walk', kinds='journal')[0], [('journal', entry.id)])
+        self.assertEqual(self.client.get(reverse('search_history')).status_code, 400)
+
+    def test_index_follows_updates_soft_and_bulk_deletes(self):
+        message = Message.objects.create(room=self.room, sender=self.user, content='anxious about the exam')
+        entry = JournalEntry.objects.create(user=self.user, title='Exam', content='Revision plan')
+        self.assertEqual(len(self.ids('exam')[0]), 2)
+
+        Message.objects.filter(pk=message.pk).update(content='relaxed now')
+        self.assertEqual(self.ids('exam')[0], [('journal', entry.id)])
+        self.assertEqual(self.ids('relaxed')[0], [('message', message.id)])
+
+        Message.objects.filter(pk=message.pk).update(is_deleted=True)
+        self.assertEqual(self.ids('relaxed')[0], [])
+        JournalEntry.objects.filter(user=self.user).delete()
+        self.assertEqual(self.ids('exam')[0], [])
+
+        # Leaving a room removes its messages from the user's results
+        Message.objects.create(room=self.room, sender=self.user, content='final note')
+        ChatParticipant.objects.filter(user=self.user).delete()
+        self.assertEqual(self.ids('final')[0], [])
+
+    def test_pages_and_operator_characters(self):
+        Message.objects.bulk_create([
+            Message(room=self.room, sender=self.user, content=f'gratitude note {i}') for i in range(5)
+        ])
+        seen, page = [], 1
+        while page:
+            results, data = self.ids('gratitude', page=page, page_size=2)
+            seen += results
+            page = data['next_page']
+        self.assertEqual(len(set(seen)), 5)
+        self.assertEqual(len(self.ids('"gratitude" (note* -')[0]), 5)
+        self.assertEqual(len(self.ids('grati')[0]), 5)
+
+    def test_memories_are_indexed_per_user_and_ranked(self):
+        service = MemoryService()
+        passing, focused, painting = service.add_memories(self.user.id, [
+            {'content': 'Could not sleep, so a long walk and a call with mum', 'category': 'journal'},
+            {'content': 'Sleep sleep sleep: poor sleep all week', 'category': 'journal'},
+            {'content': 'Enjoys painting', 'category': 'preference'},
+        ])
+        service.add_memory(self.other.id, 'Their sleep is private', category='journal')
+
+        with mock.patch.object(MemoryService, '_vector_candidate_ids', return_value=[]):
+            memories, _ = service.search_memories(self.user, 'how can I sleep better')
+            self.assertEqual([memory.id for memory in memories], [focused.id, passing.id])
+            # Memories share the user's scope with journals but stay out of history search
+            self.assertEqual(self.ids('sleep')[0], [])
+
+            UserMemory.objects.filter(pk=focused.pk).update(is_active=False)
+            UserMemory.objects.filter(pk=passing.pk).update(content='Painting again')
+            self.assertEqual(service.search_memories(self.user, 'sleep')[0], [])
+            self.assertEqual({m.id for m in service.search_memories(self.user, 'painting')[0]}, {passing.id, painting.id})
+
+    def test_rebuild_restores_the_index(self):
+        Message.objects.create(room=self.room, sender=self.user, content='rebuild me')
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.INDEX_TABLE}")
+        self.assertEqual(self.ids('rebuild')[0], [])
+        call_command('rebuild_search_index', stdout=open('/dev/null', 'w'))
+        self.assertEqual(len(self.ids('rebuild')[0]), 1)
+
+    def test_triggers_survive_later_migrations(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('table rebuilds only drop triggers on SQLite')
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'chat_search_%'")
+            self.assertEqual(len(cursor.fetchall()), 9)
+
+
+class AIBatchTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create(username='moderator', email='moderator@example.com', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def test_screener_matches_single_message_functions(self):
+        keywords = [keyword for level in CRISIS_KEYWORDS.values() for keyword in level] + POSITIVE_KEYWORDS
+        texts = [template.format(keyword) for keyword in keywords for template in (
+            '{}', 'I feel {} right now', 'what are the signs of {}?', 'so {} but happy and calm', 'ready to {} tonight'
+        )]
+        for text in texts:
+            screen = crisis_screener.screen(text)
+            self.assertEqual(screen['keywords_detected'], detect_crisis_keywords(text), text)
+            self.assertEqual(screen['urgency_level'], check_message_urgency(text), text)
+            self.assertEqual(screen['sentiment'], analyze_sentiment(text)['sentiment'], text)
+
+    def test_check_crisis_batch_keeps_order(self):
+        response = self.client.post(reverse('aiassistant-check-crisis-batch'), {
+            'messages': ['I want to die', 'lovely walk today', 'I feel hopeless']
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['is_crisis'] for r in response.data['results']], [True, False, True])
+        self.assertEqual([r['index'] for r in response.data['results']], [0, 1, 2])
+        self.assertEqual(response.data['crisis_count'], 2)
+        self.assertIn('elapsed_ms', response.data['results'][0])
+
+    def test_batch_validation_and_permissions(self):
+        url = reverse('aiassistant-check-crisis-batch')
+        self.assertEqual(self.client.post(url, {'messages': []}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(url, {'messages': ['ok', '']}, format='json').status_code, 400)
+        with override_settings(AI_BATCH_MAX_ITEMS=2):
+            self.assertEqual(self.client.post(url, {'messages': ['a', 'b', 'c']}, format='json').status_code, 400)
+
+        member = User.objects.create(username='member', email='member@example.com')
+        self.client.force_authenticate(member)
+        self.assertEqual(self.client.post(url, {'messages': ['a']}, format='json').status_code, 403)
+
+    def test_responses_run_concurrently_under_the_pool_bound(self):
+        running, peak, lock = [0], [0], threading.Lock()
+
+        def slow_response(message, is_crisis=False, user_context=None):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            if message == 'broken':
+                raise RuntimeError('generation failed')
+            return f'reply to {message}'
+
+        pool = ai_batch.ThreadPoolExecutor(max_workers=3)
+        with mock.patch.object(ai_batch, '_executor', pool), \
+                mock.patch('chat.views.get_ai_response', side_effect=slow_response):
+            response = self.client.post(reverse('aiassistant-get-response-batch'), {
+                'messages': [f'message {i}' for i in range(11)] + ['broken', {'message': 'help', 'is_crisis': True}]
+            }, format='json')
+        pool.shutdown()
+
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual(results[0]['response'], 'reply to message 0')
+        self.assertEqual(results[11]['error'], 'generation failed')
+        self.assertEqual(results[12]['response_type'], 'crisis_intervention')
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(peak[0], 3)
+
+
+    def test_screened_crisis_gets_the_crisis_template(self):
+        with mock.patch('chat.views.get_ai_response', return_value='reply') as respond:
+            response = self.client.post(reverse('aiassistant-get-response-batch'), {
+                'messages': ['I want to die', 'lovely walk today']
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        flags = {call.kwargs['message']: call.kwargs['is_crisis'] for call in respond.call_args_list}
+        self.assertEqual(flags, {'I want to die': True, 'lovely walk today': False})
+        self.assertEqual(response.data['results'][0]['response_type'], 'crisis_intervention')
+
+    @override_settings(AI_BATCH_LLM_MAX_ITEMS=2)
+    def test_llm_batches_have_a_lower_cap(self):
+        url = reverse('aiassistant-get-response-batch')
+        with mock.patch('chat.views.generate_gemini_response', return_value='reply'):
+            self.assertEqual(self.client.post(url, {'messages': ['a', 'b', 'c'], 'generator': 'llm'},
+                                              format='json').status_code, 400)
+            self.assertEqual(self.client.post(url, {'messages': ['a', 'b'], 'generator': 'llm'},
+                                              format='json').status_code, 200)
+
+    def test_items_past_the_batch_deadline_time_out(self):
+        release = threading.Event()
+
+        def handler(item):
+            if item == 'slow':
+                release.wait(1)
+            return {'response': item}
+
+        pool = ai_batch.ThreadPoolExecutor(max_workers=1)
+        with mock.patch.object(ai_batch, '_executor', pool):
+            results = ai_batch.run_batch(['fast', 'slow', 'queued'], handler, timeout=0.05)
+        release.set()
+        pool.shutdown()
+
+        self.assertEqual(results[0]['response'], 'fast')
+        self.assertEqual([result.get('error') for result in results[1:]], ['timed out', 'timed out'])
+        self.assertEqual([result['index'] for result in results], [0, 1, 2])
+
+
+class DashboardAIPanelTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='panel', email='panel@example.com', password='pw')
+        self.service = MemoryService()
+        self.client = APIClient()
+        self.client.force_login(self.user)
+
+    def get_items(self):
+        response = self.client.post(reverse('recommendations'), {'use_memory': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['recommendations']
+
+    def test_recommendations_are_built_once_then_folded_forward(self):
+        self.assertEqual([item['source'] for item in self.get_items()], ['default'] * 3)
+
+        for score in (2, 3, 2):
+            self.service.add_memory(self.user.id, f'User logged mood: low (score: {score})',
+                                    category='mood_tracking', metadata={'score': score})
+        self.service.add_memory(self.user.id, 'Feeling anxious before exams, anxiety at night', category='journal')
+        items = self.get_items()
+        self.assertEqual(items[0]['source'], 'mood')
+        self.assertEqual(items[0]['title'], recommendations.MOOD_RECOMMENDATIONS['low']['title'])
+        self.assertEqual(items[1]['topic'], 'anxiety')
+
+        # Signals that leave the mood band and leading topics unchanged do not rebuild the items
+        with mock.patch.object(recommendations, 'build_items', wraps=recommendations.build_items) as build:
+            self.service.add_memory(self.user.id, 'Still anxious today', category='journal')
+            self.assertFalse(build.called)
+            self.service.add_memory(self.user.id, 'Could not sleep, so tired', category='journal')
+            self.assertTrue(build.called)
+        self.assertEqual(RecommendationSet.objects.get(user=self.user).top_topics(), ['anxiety', 'sleep'])
+
+    def test_topic_items_use_cached_knowledge_base_entries(self):
+        KnowledgeBase.objects.create(
+            title='Box breathing for anxiety', content='Breathe in for four, hold for four, out for four.',
+            knowledge_type='technique', effectiveness_rating=8.0
+        )
+        self.service.add_memory(self.user.id, 'My anxiety is bad', category='journal')
+        items = self.get_items()
+        self.assertEqual(items[0]['title'], 'Box breathing for anxiety')
+        self.assertEqual(items[0]['source'], 'knowledge_base')
+
+        RecommendationSet.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            self.get_items()
+        self.assertFalse(any('chat_knowledgebase' in q['sql'] for q in queries.captured_queries))
+
+    def test_updates_lock_the_recommendation_row(self):
+        self.get_items()
+        with mock.patch.object(RecommendationSet.objects, 'select_for_update',
+                               wraps=RecommendationSet.objects.select_for_update) as lock:
+            self.service.add_memory(self.user.id, 'Feeling anxious again', category='journal')
+        lock.assert_called_once_with()
+
+    def test_lost_first_build_race_leaves_the_transaction_usable(self):
+        winner = RecommendationSet.objects.create(user=self.user)
+        with transaction.atomic():
+            # The caller saw no set yet, but another request created one meanwhile
+            result = recommendations.rebuild_recommendations(self.user.id, RecommendationSet(user=self.user))
+            self.assertEqual(result, winner)
+            self.assertEqual(RecommendationSet.objects.filter(user=self.user).count(), 1)
+
+    def test_ai_chat_runs_on_the_scheduler_lanes(self):
+        url = reverse('ai_chat')
+        anonymous = APIClient()
+        self.assertEqual(anonymous.post(url, {'message': 'hi'}, format='json').status_code, 401)
+        self.assertEqual(self.client.post(url, {'message': ' '}, format='json').status_code, 400)
+
+        reply = {'response': 'Here is something that may help.', 'personalized': True, 'knowledge_used': [{}]}
+        with mock.patch('chat.views.get_dashboard_ai_response', return_value=reply) as generate:
+            data = self.client.post(url, {'message': 'I had a long day', 'use_memory': False}, format='json').json()
+            self.assertEqual(data['response'], reply['response'])
+            self.assertTrue(data['personalized'])
+            self.assertEqual(generate.call_args.kwargs['use_memory'], False)
+
+            data = self.client.post(url, {'message': 'I want to end my life'}, format='json').json()
+            self.assertTrue(data['crisis_detected'])
+            self.assertTrue(generate.call_args.kwargs['is_crisis'])
+            self.assertTrue(data['resources'])
+
+            with mock.patch.object(ai_scheduler, 'saturated', return_value=True), \
+                    mock.patch('chat.views.get_ai_response', return_value='Template reply'):
+                generate.reset_mock()
+                data = self.client.post(url, {'message': 'Just checking in'}, format='json').json()
+            self.assertEqual(data['response'], 'Template reply')
+            self.assertFalse(generate.called)
+
+
+class SerializerQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='lister', email='lister@example.com')
+        self.other = User.objects.create(username='friend', email='friend@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def add_rooms(self, count):
+        for i in range(count):
+            room = ChatRoom.objects.create(name=f'room {i}', room_type='peer', created_by=self.user)
+            ChatParticipant.objects.create(room=room, user=self.user, role='moderator')
+            ChatParticipant.objects.create(room=room, user=self.other)
+            Message.objects.create(room=room, sender=self.other, content=f'latest in {i}')
+
+    def add_messages(self, room, count):
+        first = Message.objects.create(room=room, sender=self.other, content='original')
+        for i in range(count):
+            message = Message.objects.create(room=room, sender=self.user, content=f'reply {i}', reply_to=first)
+            reactions.add_reaction(message.id, self.other, 'support')
+        reactions.add_reaction(message.id, self.user, 'love')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries.captured_queries), response.data
+
+    def test_room_list_query_count_is_constant(self):
+        url = reverse('chatroom-list')
+        self.add_rooms(2)
+        small, _ = self.count_queries(url)
+        self.add_rooms(6)
+        large, data = self.count_queries(url)
+
+        self.assertEqual(small, large)
+        rooms = data['results'] if isinstance(data, dict) else data
+        self.assertEqual(len(rooms), 8)
+        self.assertEqual(rooms[0]['participant_count'], 2)
+        self.assertEqual(rooms[0]['last_message']['sender'], 'friend')
+        self.assertEqual(len(rooms[0]['participants']), 2)
+
+    def test_message_page_query_count_is_constant(self):
+        room = ChatRoom.objects.create(name='busy', room_type='peer', created_by=self.user)
+        ChatParticipant.objects.create(room=room, user=self.user)
+        url = reverse('chatroom-messages', args=[room.pk])
+        self.add_messages(room, 2)
+        small, _ = self.count_queries(url)
+        self.add_messages(room, 10)
+        large, data = self.count_queries(url)
+
+        self.assertEqual(small, large)
+        newest = data['messages'][0]
+        self.assertEqual(newest['reply_to_message']['sender'], 'friend')
+        self.assertEqual(newest['reaction_counts'], {'support': 1, 'love': 1})
+        self.assertEqual(newest['my_reactions'], ['love'])
+        self.assertEqual(data['messages'][1]['my_reactions'], [])
+
+    def test_list_serializer_reads_annotations(self):
+        self.add_rooms(3)
+        rooms = ChatRoomListSerializer.setup_eager_loading(ChatRoom.objects.all(), self.user)
+        with CaptureQueriesContext(connection) as queries:
+            data = ChatRoomListSerializer(rooms, many=True).data
+        # The rooms with their annotations, then every last message at once
+        self.assertEqual(len(queries.captured_queries), 2)
+        self.assertEqual({room['user_role'] for room in data}, {'moderator'})
+        self.assertTrue(all(room['last_message_preview']['sender'] == 'friend' for room in data))
+
+
+class EmbeddingQueueTests(SimpleTestCase):
+    def test_batches_queued_memories(self):
+        batches = []
+        finished = threading.Event()
+
+        class FakeService:
+            def embed_memories(self, memory_ids):
+                batches.append(list(memory_ids))
+                if sum(len(batch) for batch in batches) == 10:
+                    finished.set()
+
+        embedding_queue = EmbeddingQueue(FakeService(), batch_size=4)
+        embedding_queue.enqueue(list(range(10)))
+
+        self.assertTrue(finished.wait(2))
+        self.assertEqual(sorted(i for batch in batches for i in batch), list(range(10)))
+        self.assertTrue(all(len(batch) <= 4 for batch in batches))
+
+
+class TypingTrackerTests(SimpleTestCase):
+    def setUp(self):
+        self.sent = []
+
+    async def broadcast(self, is_typing):
+        self.sent.append(is_typing)
+
+    def test_keystrokes_coalesce_into_one_start(self):
+        async def scenario():
+            tracker = TypingTracker(debounce=0.05, throttle=0.05, timeout=1.0)
+            for _ in range(50):
+                await tracker.update('room', 1, True, self.broadcast)
+            await tracker.stop('room', 1, self.broadcast)
+            return tracker
+
+        tracker = asyncio.run(scenario())
+
+        self.assertEqual(self.sent, [True, False])
+        self.assertEqual(tracker.get_stats()['tracked'], 0)
+
+    def test_pause_shorter_than_debounce_does_not_flap(self):
+        async def scenario():
+            tracker = TypingTracker(debounce=0.1, throttle=0.0, timeout=1.0)
+            await tracker.update('room', 1, True, self.broadcast)
+            await tracker.update('room', 1, False, self.broadcast)
+            await asyncio.sleep(0.02)
+            await tracker.update('room', 1, True, self.broadcast)
+            await asyncio.sleep(0.15)
+            await tracker.update('room', 1, False, self.broadcast)
+            await asyncio.sleep(0.15)
+
+        asyncio.run(scenario())
+
+        self.assertEqual(self.sent, [True, False])
+
+    def test_throttle_bounds_transitions(self):
+        now = [0.0]
+        throttle = 0.1
+
+        async def scenario():
+            tracker = TypingTracker(debounce=0.0, throttle=throttle, timeout=1.0, clock=lambda: now[0])
+            # Rapid start/stop toggling still yields at most one transition per window
+            for _ in range(20):
+                await tracker.update('room', 1, True, self.broadcast)
+                await tracker.update('room', 1, False, self.broadcast)
+                now[0] += 0.01
+                await asyncio.sleep(0)
+            # Let the pending stop fire once its window has passed
+            now[0] += 0.15
+            await asyncio.sleep(throttle + 0.05)
+
+        asyncio.run(scenario())
+
+        self.assertLessEqual(len(self.sent), int(now[0] / throttle) + 1)
+        self.assertEqual(self.sent[-1], False)
+
+    def test_timeout_stops_silent_typist(self):
+        async def scenario():
+            tracker = TypingTracker(debounce=0.0, throttle=0.0, timeout=0.05)
+            await tracker.update('room', 1, True, self.broadcast)
+            self.assertEqual(tracker.typing_users('room'), [1])
+            await asyncio.sleep(0.1)
+            return tracker
+
+        tracker = asyncio.run(scenario())
+
+        self.assertEqual(self.sent, [True, False])
+        self.assertEqual(tracker.typing_users('room'), [])
+
+
+class PresenceTests(TestCase):
+    def test_members_dedupe_connections_and_expire(self):
+        async def scenario():
+            store = InMemoryPresenceStore(ttl=0.05)
+            await store.join('room', 'tab-1', {'id': 1, 'username': 'a', 'role': 'user'})
+            await store.join('room', 'tab-2', {'id': 1, 'username': 'a', 'role': 'user'})
+            await store.join('room', 'tab-3', {'id': 2, 'username': 'b', 'role': 'therapist'})
+            self.assertEqual(len(await store.members('room')), 2)
+
+            # Closing one of two tabs keeps the user online
+            self.assertFalse(await store.leave('room', 'tab-1', 1))
+            self.assertTrue(await store.leave('room', 'tab-2', 1))
+            self.assertEqual([m['id'] for m in await store.members('room')], [2])
+
+            await asyncio.sleep(0.06)
+            return await store.members('room')
+
+        self.assertEqual(asyncio.run(scenario()), [])
+
+    def test_redis_leave_scans_every_page_for_live_connections(self):
+        class PagedClient:
+            """Serves ZSCAN one member per page, like a large sorted set"""
+            def __init__(self, members):
+                self.members = members
+                self.deleted = []
+
+            async def zrem(self, key, member):
+                self.members.pop(member, None)
+
+            async def zscan(self, key, cursor=0, match=None, count=None):
+                prefix = match.rstrip('*')
+                items = sorted(self.members.items())
+                page = [item for item in items[cursor:cursor + 1] if item[0].startswith(prefix)]
+                next_cursor = cursor + 1 if cursor + 1 < len(items) else 0
+                return next_cursor, page
+
+            async def hdel(self, key, field):
+                self.deleted.append(field)
+
+        live = time.time() + 60
+        store = presence.RedisPresenceStore('redis://unused')
+        store._client = PagedClient({f'{i}|other': live for i in range(10, 15)} | {'1|tab-1': live, '1|tab-2': live})
+
+        # The remaining tab sorts after other users' connections
+        self.assertFalse(asyncio.run(store.leave('room', 'tab-1', 1)))
+        self.assertEqual(store._client.deleted, [])
+        self.assertTrue(asyncio.run(store.leave('room', 'tab-2', 1)))
+        self.assertEqual(store._client.deleted, ['1'])
+
+    def test_last_seen_written_in_batches(self):
+        users = User.objects.bulk_create([
+            User(email=f'user{i}@example.com', username=f'user{i}') for i in range(31)
+        ])
+        creator = users.pop()
+        room = ChatRoom.objects.create(name='lobby', created_by=creator)
+        ChatParticipant.objects.create(room=room, user=users[0], is_online=False)
+
+        pending = {('lobby', user.id): True for user in users}
+        pending[('lobby', users[1].id)] = False
+
+        # Room lookup, one insert for new rows, one update per online state
+        with self.assertNumQueries(4):
+            LastSeenBuffer()._write(pending)
+
+        self.assertEqual(ChatParticipant.objects.filter(room=room, is_online=True).count(), 29)
+        self.assertFalse(ChatParticipant.objects.get(room=room, user=users[1]).is_online)
+
+
+class BroadcastFrameTests(SimpleTestCase):
+    def test_receivers_forward_preencoded_frame(self):
+        payload = {'type': 'message_deleted', 'message_id': 7, 'deleted_by': 1}
+        event = frame_event(payload, exclude_user=1)
+        sent = {}
+
+        def receiver(user_id):
+            consumer = ChatConsumer()
+            consumer.user = SimpleNamespace(id=user_id)
+            consumer.room_group_name = 'chat_peers'
+
+            async def send(text_data=None, bytes_data=None):
+                sent.setdefault(user_id, []).append(text_data)
+            consumer.send = send
+            return consumer
+
+        async def fan_out():
+            for user_id in (1, 2, 3):
+                await receiver(user_id).broadcast_frame(event)
+
+        asyncio.run(fan_out())
+
+        self.assertNotIn(1, sent)
+        self.assertIs(sent[2][0], event['frame'])
+        self.assertEqual(json.loads(sent[3][0]), payload)
+
+
+class MessageEditTests(TestCase):
+    def setUp(self):
+        self.author, self.other = User.objects.bulk_create([
+            User(email='author@example.com', username='author'),
+            User(email='other@example.com', username='other'),
+        ])
+        self.room = ChatRoom.objects.create(name='edits', room_type='peer', created_by=self.author)
+        self.message = Message.objects.create(room=self.room, sender=self.author, content='first draft')
+
+    def test_edit_is_a_versioned_update_returning_the_version(self):
+        with self.assertNumQueries(2):
+            edit = message_edits.edit_message(self.message.id, self.author.id, 'second draft', self.room.id)
+        self.message.refresh_from_db()
+        self.assertEqual(edit['version'], 2)
+        self.assertEqual(self.message.version, 2)
+        self.assertEqual(self.message.edited_at, edit['edited_at'])
+        self.assertEqual(self.message.content, 'second draft')
+        self.assertTrue(self.message.is_edited)
+
+    def test_only_the_sender_can_change_a_live_message_in_its_room(self):
+        other_room = ChatRoom.objects.create(name='elsewhere', room_type='peer', created_by=self.author)
+        self.assertIsNone(message_edits.edit_message(self.message.id, self.other.id, 'hijacked'))
+        self.assertIsNone(message_edits.edit_message(self.message.id, self.author.id, 'moved', other_room.id))
+        self.assertIsNone(message_edits.edit_message('not-an-id', self.author.id, 'bad'))
+        self.assertIsNone(message_edits.delete_message(self.message.id, self.other.id))
+
+        self.assertEqual(message_edits.delete_message(self.message.id, self.author.id, self.room.id), {'version': 2})
+        self.assertIsNone(message_edits.delete_message(self.message.id, self.author.id))
+        self.assertIsNone(message_edits.edit_message(self.message.id, self.author.id, 'too late'))
+        self.message.refresh_from_db()
+        self.assertEqual((self.message.content, self.message.version), ('first draft', 2))
+        self.assertTrue(self.message.is_deleted)
+
+    def test_edit_that_loses_a_race_retries_on_the_new_version(self):
+        update = QuerySet.update
+
+        def concurrent_edit_first(queryset, **kwargs):
+            # Another edit lands between this edit's read and its write, once
+            concurrent_edit_first.calls += 1
+            if concurrent_edit_first.calls == 1:
+                Message.objects.filter(pk=self.message.pk).update(content='theirs', version=F('version') + 1)
+            return update(queryset, **kwargs)
+        concurrent_edit_first.calls = 0
+
+        with mock.patch.object(QuerySet, 'update', concurrent_edit_first):
+            edit = message_edits.edit_message(self.message.id, self.author.id, 'mine')
+        self.message.refresh_from_db()
+        self.assertEqual(edit['version'], 3)
+        self.assertEqual((self.message.content, self.message.version), ('mine', 3))
+
+    def test_async_edit_and_delete_match_the_sync_ones(self):
+        async def change():
+            edit = await message_edits.aedit_message(self.message.id, self.author.id, 'async draft', self.room.id)
+            self.assertIsNone(await message_edits.aedit_message(self.message.id, self.other.id, 'hijacked'))
+            self.assertIsNone(await message_edits.adelete_message('not-an-id', self.author.id))
+            return edit, await message_edits.adelete_message(self.message.id, self.author.id)
+
+        edit, tombstone = async_to_sync(change)()
+        self.message.refresh_from_db()
+        self.assertEqual((edit['version'], tombstone['version']), (2, 3))
+        self.assertEqual(self.message.edited_at, edit['edited_at'])
+        self.assertEqual(self.message.content, 'async draft')
+        self.assertTrue(self.message.is_deleted)
+
+    def test_search_index_follows_edits_and_deletes(self):
+        if not search.search_backend():
+            self.skipTest('no full-text index on this database')
+        ChatParticipant.objects.create(room=self.room, user=self.author)
+        message_edits.edit_message(self.message.id, self.author.id, 'revised wording')
+        self.assertEqual([result['id'] for result in search.search(self.author, 'revised')[0]], [self.message.id])
+        self.assertEqual(search.search(self.author, 'draft')[0], [])
+
+        message_edits.delete_message(self.message.id, self.author.id)
+        self.assertEqual(search.search(self.author, 'revised')[0], [])
+
+
+class ReactionCountTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob = User.objects.bulk_create([
+            User(email='alice@example.com', username='alice'),
+            User(email='bob@example.com', username='bob'),
+        ])
+        self.room = ChatRoom.objects.create(name='support', room_type='support', created_by=self.alice)
+        self.message = Message.objects.create(room=self.room, sender=self.alice, content='rough day')
+
+    def counts(self):
+        self.message.refresh_from_db()
+        return self.message.reaction_counts
+
+    def test_counts_follow_reactions_added_and_removed(self):
+        reaction, created, counts = reactions.add_reaction(self.message.id, self.bob, 'support', self.room.id)
+        self.assertTrue(created)
+        self.assertEqual(counts, {'support': 1})
+        self.assertFalse(reactions.add_reaction(self.message.id, self.bob, 'support')[1])
+        reactions.add_reaction(self.message.id, self.alice, 'support')
+        reactions.add_reaction(self.message.id, self.alice, 'love')
+        self.assertEqual(self.counts(), {'support': 2, 'love': 1})
+
+        self.assertEqual(reactions.remove_reaction(self.message.id, self.alice, 'love'), {'support': 2})
+        self.assertIsNone(reactions.remove_reaction(self.message.id, self.alice, 'love'))
+        self.assertEqual(self.counts(), {'support': 2})
+        self.assertEqual(MessageReaction.objects.filter(message=self.message).count(), 2)
+
+    def test_deleted_and_out_of_room_messages_take_no_reactions(self):
+        elsewhere = ChatRoom.objects.create(name='elsewhere', room_type='peer', created_by=self.alice)
+        self.assertIsNone(reactions.add_reaction(self.message.id, self.bob, 'like', elsewhere.id))
+        self.assertIsNone(reactions.add_reaction('nope', self.bob, 'like'))
+        Message.objects.filter(id=self.message.id).update(is_deleted=True)
+        self.assertIsNone(reactions.add_reaction(self.message.id, self.bob, 'like'))
+        self.assertEqual(self.counts(), {})
+
+    def test_recount_repairs_counts_after_cascading_deletes(self):
+        reactions.add_reaction(self.message.id, self.alice, 'like')
+        reactions.add_reaction(self.message.id, self.bob, 'like')
+        reactions.add_reaction(self.message.id, self.bob, 'sad')
+        # Deleting the user cascades past the counters
+        self.bob.delete()
+        self.assertEqual(self.counts(), {'like': 2, 'sad': 1})
+
+        self.assertEqual(reactions.recount_reactions(), 1)
+        self.assertEqual(self.counts(), {'like': 1})
+        self.assertEqual(reactions.recount_reactions([self.message.id]), 0)
+
+    def test_react_endpoint_validates_type_and_returns_counts(self):
+        ChatParticipant.objects.create(room=self.room, user=self.bob)
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        url = reverse('message-react', args=[self.message.id])
+        self.assertEqual(client.post(url, {'reaction_type': 'shrug'}, format='json').status_code, 400)
+        response = client.post(url, {'reaction_type': 'support'}, format='json')
+        self.assertEqual(response.data['reaction_counts'], {'support': 1})
+        response = client.delete(reverse('message-unreact', args=[self.message.id]),
+                                 {'reaction_type': 'support'}, format='json')
+        self.assertEqual(response.data['reaction_counts'], {})
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatConsumerTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob = User.objects.bulk_create([
+            User(email='alice@example.com', username='alice'),
+            User(email='bob@example.com', username='bob'),
+        ])
+        self.room = ChatRoom.objects.create(name='peers', room_type='peer', created_by=self.alice)
+        patches = [
+            mock.patch.object(presence, '_presence_store', InMemoryPresenceStore()),
+            mock.patch.object(presence.last_seen_buffer, 'record'),
+            mock.patch.object(consumers, 'user_rate_limiter', RateLimiter({'default': (100.0, 100)})),
+            mock.patch.object(consumers, 'room_history', RoomHistory(size=50)),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def queries_during(self, coroutine):
+        """Run a coroutine and count the queries it causes on the database thread"""
+        context = CaptureQueriesContext(connection)
+        await sync_to_async(context.__enter__)()
+        try:
+            result = await coroutine
+        finally:
+            await sync_to_async(context.__exit__)(None, None, None)
+        return result, await sync_to_async(len)(context)
+
+    def connect(self, user, query='', subprotocols=None):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/chat/peers/{query}', subprotocols=subprotocols
+        )
+        communicator.scope['user'] = user
+        return communicator
+
+    async def test_message_round_trip_query_counts(self):
+        alice, bob = self.connect(self.alice), self.connect(self.bob)
+        self.assertTrue((await alice.connect())[0])
+        self.assertTrue((await bob.connect())[0])
+        room_info = await bob.receive_json_from()
+        self.assertEqual({p['username'] for p in room_info['participants']}, {'alice', 'bob'})
+        await alice.receive_json_from()
+
+        async def send_message():
+            await alice.send_json_to({'type': 'chat_message', 'message': 'hello there'})
+            return await bob.receive_json_from()
+
+        frame, queries = await self.queries_during(send_message())
+        self.assertEqual(queries, 1)
+        self.assertEqual(frame['type'], 'chat_message')
+        self.assertEqual(frame['message']['content'], 'hello there')
+        self.assertEqual(frame['message']['sender']['username'], 'alice')
+
+        async def edit_message():
+            await alice.send_json_to({
+                'type': 'edit_message', 'message_id': frame['message']['id'], 'new_content': 'hi'
+            })
+            return await bob.receive_json_from()
+
+        edited, queries = await self.queries_during(edit_message())
+        self.assertEqual(queries, 2)
+        self.assertEqual(edited['new_content'], 'hi')
+        stored = await Message.objects.aget(id=frame['message']['id'])
+        self.assertEqual(frame['message']['version'], 1)
+        self.assertEqual((edited['version'], edited['edited_at']), (2, stored.edited_at.isoformat()))
+        await alice.receive_json_from()
+
+        async def delete_message():
+            await alice.send_json_to({'type': 'delete_message', 'message_id': frame['message']['id']})
+            return await bob.receive_json_from()
+
+        deleted, queries = await self.queries_during(delete_message())
+        self.assertEqual(queries, 2)
+        self.assertEqual((deleted['type'], deleted['version']), ('message_deleted', 3))
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+    @override_settings(CHAT_RATE_LIMITS_CONNECTION={'chat_message': (0.001, 2)})
+    async def test_message_flood_is_rate_limited(self):
+        alice = self.connect(self.alice)
+        await alice.connect()
+        await alice.receive_json_from()
+
+        for i in range(3):
+            await alice.send_json_to({'type': 'chat_message', 'message': f'spam {i}'})
+        frames = [await alice.receive_json_from() for _ in range(3)]
+
+        rejected = [frame for frame in frames if frame['type'] == 'error']
+        self.assertEqual(len(rejected), 1)
+        self.assertEqual(rejected[0]['code'], 'rate_limited')
+        self.assertGreater(rejected[0]['retry_after'], 0)
+        self.assertEqual(await Message.objects.filter(room=self.room).acount(), 2)
+        await alice.disconnect()
+
+    async def test_saturated_queue_falls_back_to_template_reply(self):
+        self.room.room_type = 'ai'
+        await self.room.asave()
+        alice = self.connect(self.alice)
+        await alice.connect()
+        await alice.receive_json_from()
+
+        with mock.patch.object(ai_scheduler, 'saturated', return_value=True), \
+                mock.patch.object(consumers, 'get_enhanced_ai_response') as llm:
+            await alice.send_json_to({'type': 'chat_message', 'message': 'I feel a bit stressed'})
+            frames = [await alice.receive_json_from() for _ in range(2)]
+
+        self.assertEqual([frame['type'] for frame in frames], ['chat_message', 'ai_response'])
+        self.assertTrue(frames[1]['message']['content'])
+        llm.assert_not_called()
+        await alice.disconnect()
+
+
+    async def test_shed_reply_is_awaited_before_the_next_frame(self):
+        consumer = ChatConsumer()
+        with mock.patch.object(ai_scheduler, 'saturated', return_value=True), \
+                mock.patch.object(ChatConsumer, 'generate_ai_response') as generate:
+            await consumer.queue_ai_response('message', False, SimpleNamespace(room_type='ai'))
+        generate.assert_awaited_once_with('message', False, use_llm=False)
+
+
+    async def test_reconnect_replays_missed_messages(self):
+        alice, bob = self.connect(self.alice), self.connect(self.bob)
+        await alice.connect()
+        await bob.connect()
+        await alice.receive_json_from()
+        await bob.receive_json_from()
+
+        await alice.send_json_to({'type': 'chat_message', 'message': 'before the drop'})
+        seen = (await bob.receive_json_from())['message']['id']
+        await alice.receive_json_from()
+        await bob.disconnect()
+
+        await alice.send_json_to({'type': 'chat_message', 'message': 'during the drop'})
+        await alice.receive_json_from()
+
+        # Alice stayed connected, so this process kept the room's recent frames
+        bob = self.connect(self.bob, f'?resume_from={seen}')
+        await bob.connect()
+        self.assertEqual((await bob.receive_json_from())['type'], 'room_info')
+        missed = await bob.receive_json_from()
+        done = await bob.receive_json_from()
+        self.assertEqual(missed['message']['content'], 'during the drop')
+        self.assertEqual((done['type'], done['count'], done['source']), ('replay_complete', 1, 'buffer'))
+
+        await alice.disconnect()
+        await bob.disconnect()
+
+        # With nobody left in the room the buffer is gone and the database answers
+        bob = self.connect(self.bob, '?resume_from=0')
+        await bob.connect()
+        await bob.receive_json_from()
+        replayed = [(await bob.receive_json_from())['message']['content'] for _ in range(2)]
+        done = await bob.receive_json_from()
+        self.assertEqual(replayed, ['before the drop', 'during the drop'])
+        self.assertEqual((done['count'], done['source'], done['truncated']), (2, 'database', False))
+        await bob.disconnect()
+
+
+    async def test_support_welcome_and_crisis_message_are_buffered_for_replay(self):
+        def support(path, query=''):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/{path}/{self.alice.id}/{query}')
+            communicator.scope['user'] = self.alice
+            return communicator
+
+        first = support('support')
+        await first.connect()
+        welcome = await first.receive_json_from()
+        self.assertEqual(welcome['type'], 'ai_response')
+
+        # The crisis channel shares the support room, so its messages reach the first socket too
+        crisis = support('crisis')
+        await crisis.connect()
+        later = [await first.receive_json_from() for _ in range(2)]
+        self.assertEqual([frame['type'] for frame in later], ['ai_response', 'crisis_alert'])
+
+        resumed = support('support', f"?resume_from={welcome['message']['id']}")
+        await resumed.connect()
+        replayed = [await resumed.receive_json_from() for _ in range(2)]
+        done = await resumed.receive_json_from()
+        self.assertEqual([frame['message']['id'] for frame in replayed], [frame['message']['id'] for frame in later])
+        self.assertEqual((done['type'], done['count'], done['source']), ('replay_complete', 2, 'buffer'))
+
+        for communicator in (first, crisis, resumed):
+            await communicator.disconnect()
+
+
+    async def test_crisis_room_resumes_from_the_database_with_the_same_frames(self):
+        def crisis(query=''):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/crisis/{self.alice.id}/{query}')
+            communicator.scope['user'] = self.alice
+            return communicator
+
+        live = crisis()
+        await live.connect()
+        sent = [await live.receive_json_from() for _ in range(2)]
+        self.assertEqual([frame['type'] for frame in sent], ['ai_response', 'crisis_alert'])
+        await live.disconnect()
+
+        # Nobody is left in the room, so the replay is rebuilt from saved messages
+        resumed = crisis(f"?resume_from={sent[0]['message']['id'] - 1}")
+        await resumed.connect()
+        replayed = [await resumed.receive_json_from() for _ in range(2)]
+        done = await resumed.receive_json_from()
+        self.assertEqual((done['type'], done['source']), ('replay_complete', 'database'))
+        self.assertEqual(replayed, sent)
+        await resumed.disconnect()
+
+
+    async def test_msgpack_subprotocol_is_negotiated(self):
+        alice = self.connect(self.alice, subprotocols=['hh.unknown', MSGPACK_DEFLATE_PROTOCOL])
+        json_client = self.connect(self.bob)
+        self.assertEqual(await alice.connect(), (True, MSGPACK_DEFLATE_PROTOCOL))
+        self.assertEqual((await json_client.connect())[1], None)
+        wire = negotiate([MSGPACK_DEFLATE_PROTOCOL])
+
+        self.assertEqual(wire.decode(await alice.receive_from())['type'], 'room_info')
+        await json_client.receive_json_from()
+
+        await alice.send_to(bytes_data=wire.encode({'type': 'chat_message', 'message': 'packed hello'}))
+        packed = await alice.receive_from()
+        self.assertIsInstance(packed, bytes)
+        self.assertEqual(wire.decode(packed)['message']['content'], 'packed hello')
+        self.assertEqual((await json_client.receive_json_from())['message']['content'], 'packed hello')
+
+        await json_client.send_to(bytes_data=b'not negotiated')
+        self.assertEqual((await json_client.receive_json_from())['type'], 'error')
+        await alice.disconnect()
+        await json_client.disconnect()
+
+
+    async def test_crisis_alerts_are_aggregated_and_pushed_to_responders(self):
+        staff = await User.objects.acreate(username='counselor', email='counselor@example.com', is_staff=True)
+        responder = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/crisis-responders/')
+        responder.scope['user'] = staff
+        outsider = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/crisis-responders/')
+        outsider.scope['user'] = self.bob
+        self.assertFalse((await outsider.connect())[0])
+        self.assertTrue((await responder.connect())[0])
+        self.assertEqual(await responder.receive_json_from(), {'type': 'crisis_alert_snapshot', 'alerts': []})
+
+        alice = self.connect(self.alice)
+        await alice.connect()
+        await alice.receive_json_from()
+
+        updates = []
+        with mock.patch.object(ChatConsumer, 'queue_ai_response'):
+            for text in ('I feel hopeless', 'I feel hopeless and alone', 'I am still hopeless'):
+                await alice.send_json_to({'type': 'chat_message', 'message': text})
+                await alice.receive_json_from()
+                if await responder.receive_nothing(timeout=0.2) is False:
+                    updates.append(await responder.receive_json_from())
+
+        # One push when the alert opens, one when the third signal escalates it
+        self.assertEqual([u['event'] for u in updates], ['created', 'escalated'])
+        self.assertEqual(updates[0]['alert']['severity'], 'medium')
+        self.assertEqual(updates[1]['alert']['severity'], 'high')
+        self.assertEqual(updates[1]['alert']['occurrences'], 3)
+        self.assertEqual(updates[1]['alert']['keywords'], ['hopeless', 'alone'])
+        self.assertEqual(await CrisisAlert.objects.acount(), 1)
+
+        await alice.disconnect()
+        await responder.disconnect()
+
+
+    async def test_anonymous_support_session_creates_rows_on_first_message(self):
+        def anonymous(token=None, query=''):
+            protocols = [SESSION_PROTOCOL] + ([TOKEN_PROTOCOL_PREFIX + token] if token else [])
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/support/guest/{query}', subprotocols=protocols
+            )
+            communicator.scope['user'] = AnonymousUser()
+            return communicator
+
+        anonymous_users = User.objects.filter(username__startswith='anonymous_')
+        visitor = anonymous()
+        self.assertEqual(await visitor.connect(), (True, SESSION_PROTOCOL))
+        session = await visitor.receive_json_from()
+        welcome = await visitor.receive_json_from()
+        self.assertEqual(session['type'], 'session')
+        self.assertIsNone(welcome['message']['id'])
+        await visitor.disconnect()
+        self.assertEqual(await anonymous_users.acount(), 0)
+        self.assertFalse(await ChatRoom.objects.filter(room_type='support').aexists())
+
+        # The token travels in the handshake header; one in the URL is ignored
+        visitor = anonymous(query=f"?anon_token={session['anonymous_token']}")
+        await visitor.connect()
+        self.assertNotEqual((await visitor.receive_json_from())['anonymous_token'], session['anonymous_token'])
+        await visitor.disconnect()
+
+        visitor = anonymous(session['anonymous_token'])
+        self.assertEqual(await visitor.connect(), (True, SESSION_PROTOCOL))
+        await visitor.receive_json_from()
+        await visitor.receive_json_from()
+        with mock.patch.object(ChatConsumer, 'queue_ai_response'):
+            await visitor.send_json_to({'type': 'chat_message', 'message': 'can we talk'})
+            echo = await visitor.receive_json_from()
+        await visitor.disconnect()
+
+        user = await anonymous_users.aget()
+        self.assertEqual(echo['message']['sender']['username'], user.username)
+        self.assertFalse(user.is_active)
+        room = await ChatRoom.objects.aget(room_type='support')
+        self.assertEqual(room.name, f'support_{user.username}')
+
+        # The token resolves to the same user on later connections
+        returning = anonymous(session['anonymous_token'])
+        await returning.connect()
+        await returning.receive_json_from()
+        self.assertIsNotNone((await returning.receive_json_from())['message']['id'])
+        await returning.disconnect()
+        self.assertEqual(await anonymous_users.acount(), 1)
+
+
+# Budgets include the five queries every session-authenticated request costs:
+# session and user lookups, and the session save wrapped in a savepoint
+CHAT_ENDPOINTS = [
+    Endpoint('chatroom-list', queries=8),
+    Endpoint('chatroom-list', 'post', queries=11, data={'name': 'new room', 'room_type': 'peer'}),
+    Endpoint('chatroom-detail', queries=8, args=('room',)),
+    Endpoint('chatroom-detail', 'patch', queries=13, args=('room',), data={'description': 'updated'}),
+    Endpoint('chatroom-join', 'post', queries=8, args=('room',)),
+    Endpoint('chatroom-leave', 'post', queries=8, args=('room',)),
+    Endpoint('chatroom-messages', queries=9, args=('room',)),
+    Endpoint('chatroom-participants', queries=7, args=('room',)),
+    Endpoint('chatroom-create-support-room', 'post', queries=12),
+    Endpoint('chatroom-create-ai-room', 'post', queries=18),
+    Endpoint('message-list', queries=7, ms=500),
+    Endpoint('message-detail', queries=7, args=('message',)),
+    Endpoint('message-detail', 'patch', queries=10, args=('message',), data={'content': 'patched'}),
+    Endpoint('message-react', 'post', queries=13, args=('message',), data={'reaction_type': 'love'}),
+    Endpoint('message-unreact', 'delete', queries=12, args=('message',), data={'reaction_type': 'like'}),
+    Endpoint('message-edit', 'patch', queries=9, args=('own_message',), data={'content': 'edited'}),
+    Endpoint('crisisalert-list', queries=6, user='staff'),
+    Endpoint('crisisalert-detail', queries=6, args=('alert',), user='staff'),
+    Endpoint('crisisalert-acknowledge', 'post', queries=7, args=('alert',), user='staff'),
+    Endpoint('crisisalert-resolve', 'post', queries=7, args=('alert',), user='staff'),
+    Endpoint('crisisalert-active', queries=6, user='staff'),
+    Endpoint('aiassistant-get-response', 'post', queries=7, data={'message': 'I had a long day'}),
+    Endpoint('aiassistant-resources', queries=5),
+    Endpoint('aiassistant-check-crisis', 'post', queries=5, data={'message': 'I feel fine'}),
+    Endpoint('aiassistant-get-response-batch', 'post', queries=7, user='staff',
+             data={'messages': [f'I feel overwhelmed about day {i}' for i in range(50)]}),
+    Endpoint('aiassistant-check-crisis-batch', 'post', queries=5, user='staff',
+             data={'messages': [f'I feel hopeless about day {i}' for i in range(1000)]}),
+    Endpoint('aiassistant-queue-stats', queries=5, user='staff'),
+    Endpoint('memory_profile', queries=14),
+    Endpoint('memory_add', 'post', queries=9, data={'content': 'Likes evening walks'}),
+    Endpoint('memory_search', 'post', queries=7, data={'query': 'walks'}),
+    Endpoint('search_history', queries=9, data={'q': 'message room1'}),
+    Endpoint('ai_chat', 'post', queries=5, data={'message': 'I had a long day'}),
+    Endpoint('recommendations', queries=11),
+]
+
+# Queries per consumer frame, counted until the resulting frame is delivered
+CONSUMER_BUDGETS = {
+    'connect': 4,
+    'chat_message': 1,
+    'typing': 0,
+    'reaction': 6,
+    'edit_message': 2,
+    'delete_message': 2,
+    'resume': 1,
+}
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ChatBudgetTests(BudgetTestMixin, TestCase):
+    """Every chat route and consumer frame against a member of many busy rooms"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.friend, cls.peer, cls.staff = User.objects.bulk_create([
+            User(username='member', email='member@example.com'),
+            User(username='friend', email='friend@example.com'),
+            User(username='peer', email='peer@example.com'),
+            User(username='responder', email='responder@example.com', is_staff=True),
+        ])
+        rooms = ChatRoom.objects.bulk_create([
+            ChatRoom(name=f'room{i}', room_type='peer', created_by=cls.user, max_participants=5)
+            for i in range(20)
+        ])
+        ChatParticipant.objects.bulk_create([
+            ChatParticipant(room=room, user=user)
+            for room in rooms for user in (cls.user, cls.friend, cls.peer)
+        ])
+        Message.objects.bulk_create([
+            Message(room=room, sender=(cls.user, cls.friend, cls.peer)[i % 3], content=f'message {i} in {room.name}')
+            for room in rooms for i in range(25)
+        ])
+        messages = list(Message.objects.filter(sender=cls.friend))
+        MessageReaction.objects.bulk_create([
+            MessageReaction(message=message, user=cls.user, reaction_type='like') for message in messages
+        ])
+        Message.objects.bulk_create([
+            Message(room=message.room, sender=cls.user, content='replying', reply_to=message)
+            for message in messages[:40]
+        ])
+        CrisisAlert.objects.bulk_create([
+            CrisisAlert(user=cls.friend, room=rooms[i % 20], severity='medium', alert_reason='test')
+            for i in range(30)
+        ])
+
+        cls.room = rooms[0]
+        cls.message = Message.objects.filter(room=cls.room, sender=cls.friend).first()
+        cls.own_message = Message.objects.filter(room=cls.room, sender=cls.user).first()
+        cls.alert = CrisisAlert.objects.first()
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(presence, '_presence_store', InMemoryPresenceStore()),
+            mock.patch.object(presence.last_seen_buffer, 'record'),
+            mock.patch.object(consumers, 'user_rate_limiter', RateLimiter({'default': (100.0, 100)})),
+            mock.patch.object(consumers, 'room_history', RoomHistory(size=50)),
+            mock.patch('chat.views.get_ai_response', return_value='That sounds tiring.'),
+            mock.patch('chat.views.get_dashboard_ai_response', return_value={'response': 'That sounds tiring.'}),
+            mock.patch('chat.crisis_alerts.publish_event'),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_every_route_has_a_budget(self):
+        self.assertRoutesBudgeted(urls.urlpatterns, CHAT_ENDPOINTS)
+
+    def test_endpoints_stay_within_budget(self):
+        client = APIClient()
+        for endpoint in CHAT_ENDPOINTS:
+            with self.subTest(endpoint.label):
+                self.request_endpoint(client, endpoint)
+
+    async def test_consumer_frames_stay_within_budget(self):
+        def connect(user):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/{self.room.name}/')
+            communicator.scope['user'] = user
+            return communicator
+
+        async def frame_of_type(communicator, frame_type):
+            while True:
+                frame = await communicator.receive_json_from()
+                if frame['type'] == frame_type:
+                    return frame
+
+        async def exchange(sender, receiver, payload, frame_type):
+            await sender.send_json_to(payload)
+            return await frame_of_type(receiver, frame_type)
+
+        async def within_budget(label, coroutine):
+            return await self.assertWithinBudgetAsync(label, coroutine, CONSUMER_BUDGETS[label], 250)
+
+        member, friend = connect(self.user), connect(self.friend)
+
+        async def connect_both():
+            await member.connect()
+            await friend.connect()
+            await frame_of_type(member, 'room_info')
+            await frame_of_type(friend, 'room_info')
+
+        await within_budget('connect', connect_both())
+        sent = await within_budget('chat_message', exchange(
+            member, friend, {'type': 'chat_message', 'message': 'checking in'}, 'chat_message'
+        ))
+        await frame_of_type(member, 'chat_message')
+        message_id = sent['message']['id']
+
+        await within_budget('typing', exchange(
+            member, friend, {'type': 'typing', 'is_typing': True}, 'typing_indicator'
+        ))
+        reacted = await within_budget('reaction', exchange(
+            friend, member, {'type': 'reaction', 'message_id': message_id, 'reaction_type': 'support'},
+            'message_reaction'
+        ))
+        self.assertEqual(reacted['reaction_counts'], {'support': 1})
+        await within_budget('edit_message', exchange(
+            member, friend, {'type': 'edit_message', 'message_id': message_id, 'new_content': 'edited'},
+            'message_edited'
+        ))
+        await within_budget('resume', exchange(
+            friend, friend, {'type': 'resume', 'resume_from': self.message.id}, 'replay_complete'
+        ))
+        await within_budget('delete_message', exchange(
+            member, friend, {'type': 'delete_message', 'message_id': message_id}, 'message_deleted'
+        ))
+
+        await member.disconnect()
+        await friend.disconnect()
+
+
+class AnonymousSessionTests(TestCase):
+    def test_tokens_round_trip_and_tampering_starts_fresh(self):
+        session = AnonymousSession()
+        self.assertEqual(load_session(session.token).key, session.key)
+        self.assertNotEqual(load_session(session.token + 'x').key, session.key)
+        self.assertNotEqual(load_session(None).key, session.key)
+
+        # Tokens are valid subprotocol names, picked out of the offered list
+        self.assertRegex(session.token, r"^[!#$%&'*+.^_`|~0-9A-Za-z-]+$")
+        offered = ['hh.msgpack.v1', TOKEN_PROTOCOL_PREFIX + session.token]
+        self.assertEqual(load_session(token_from_protocols(offered)).key, session.key)
+        self.assertIsNone(token_from_protocols(None))
+
+    def test_compaction_purges_only_abandoned_anonymous_users(self):
+        old = timezone.now() - timedelta(days=60)
+        abandoned, chatting, in_crisis = [
+            AnonymousSession().build_user() for _ in range(3)
+        ]
+        regular = User(username='regular', email='regular@example.com', is_active=False)
+        for user in (abandoned, chatting, in_crisis, regular):
+            user.date_joined = old
+        User.objects.bulk_create([abandoned, chatting, in_crisis, regular])
+        extra = [AnonymousSession().build_user() for _ in range(2)]
+        for user in extra:
+            user.date_joined = old
+        User.objects.bulk_create(extra)
+
+        counselor = User.objects.create(username='counselor', email='counselor@example.com')
+        answered = AnonymousSession().build_user()
+        answered.date_joined = old
+        answered.save()
+
+        room = ChatRoom.objects.create(name='support_old', room_type='support', created_by=abandoned)
+        ChatParticipant.objects.create(user=counselor, room=room, role='therapist')
+        Message.objects.create(room=room, sender=abandoned, content='long ago')
+        Message.objects.create(room=room, sender=counselor, content='checking back in')
+        Message.objects.filter(room=room).update(created_at=old)
+        other_room = ChatRoom.objects.create(name='support_recent', room_type='support', created_by=chatting)
+        Message.objects.create(room=other_room, sender=chatting, content='still here')
+        # The visitor went quiet, but a counselor wrote to them recently
+        answered_room = ChatRoom.objects.create(name='support_answered', room_type='support', created_by=answered)
+        Message.objects.create(room=answered_room, sender=counselor, content='are you still there?')
+        CrisisAlert.objects.create(user=in_crisis, severity='high', alert_reason='test')
+
+        call_command('compact_anonymous_users', '--batch-size', '2', stdout=mock.MagicMock())
+
+        remaining = set(User.objects.values_list('username', flat=True))
+        self.assertEqual(remaining, {chatting.username, in_crisis.username, answered.username,
+                                     'regular', 'counselor'})
+        # The abandoned visitor's room goes with them, counselor messages and memberships included
+        self.assertFalse(ChatRoom.objects.filter(name='support_old').exists())
+        self.assertFalse(Message.objects.filter(content__in=['long ago', 'checking back in']).exists())
+        self.assertFalse(ChatParticipant.objects.filter(user=counselor, room_id=room.id).exists())
+        self.assertTrue(ChatRoom.objects.filter(name='support_answered').exists())
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CrisisAlertConcurrencyTests(TransactionTestCase):
+    def test_concurrent_first_signals_open_one_alert(self):
+        user = User.objects.create(username='erin', email='erin@example.com')
+        room = ChatRoom.objects.create(name='erin_room', room_type='support', created_by=user)
+        barrier = threading.Barrier(4)
+
+        def signal():
+            try:
+                barrier.wait()
+                record_crisis_signal(user, room, 'high', keywords=['alone'])
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=signal) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        alert = CrisisAlert.objects.get(user=user, room=room)
+        self.assertEqual(alert.occurrences, 4)
+
+
+class CrisisAlertAggregationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='dana', email='dana@example.com')
+        self.room = ChatRoom.objects.create(name='dana_room', room_type='support', created_by=self.user)
+
+    def test_signals_outside_window_or_after_resolution_open_new_alerts(self):
+        first, event = record_crisis_signal(self.user, self.room, 'high', keywords=['pills'])
+        self.assertEqual(event['type'], 'broadcast_frame')
+        _, event = record_crisis_signal(self.user, self.room, 'medium', keywords=['alone'])
+        self.assertIsNone(event)
+        first.refresh_from_db()
+        self.assertEqual((first.severity, first.occurrences), ('high', 2))
+
+        CrisisAlert.objects.filter(pk=first.pk).update(last_triggered_at=timezone.now() - timedelta(hours=1))
+        second, _ = record_crisis_signal(self.user, self.room, 'medium', keywords=['alone'])
+        self.assertNotEqual(second.pk, first.pk)
+
+        second.status = 'resolved'
+        second.save()
+        third, event = record_crisis_signal(self.user, self.room, 'critical')
+        self.assertNotIn(third.pk, (first.pk, second.pk))
+        self.assertIsNotNone(event)
+
+    def test_user_row_is_locked_before_looking_for_an_open_alert(self):
+        with CaptureQueriesContext(connection) as queries:
+            record_crisis_signal(self.user, self.room, 'high', keywords=['pills'])
+        statements = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertIn(User._meta.db_table, statements[0])
+        self.assertIn(CrisisAlert._meta.db_table, statements[1])
+
+    def test_resolving_pushes_update(self):
+        alert, _ = record_crisis_signal(self.user, self.room, 'high', keywords=['pills'])
+        staff = User.objects.create(username='lead', email='lead@example.com', is_staff=True)
+        client = APIClient()
+        client.force_authenticate(staff)
+
+        with mock.patch('chat.crisis_alerts.publish_event') as publish:
+            response = client.post(reverse('crisisalert-resolve', args=[alert.pk]), {'resolution_notes': 'safe'})
+
+        self.assertEqual(response.status_code, 200)
+        frame = json.loads(publish.call_args[0][0]['frame'])
+        self.assertEqual((frame['event'], frame['alert']['status']), ('resolved', 'resolved'))
+
+
+class WireProtocolTests(SimpleTestCase):
+    payload = {
+        'type': 'chat_message',
+        'message': {'id': 3, 'content': 'hi', 'sender': {'id': 1, 'username': 'a'}, 'extra': [{'id': 2}]},
+        'crisis_detected': False
+    }
+
+    def test_short_field_codes_round_trip(self):
+        wire = MsgPackProtocol('hh.msgpack.v1')
+        frame = wire.encode_text(json.dumps(self.payload))
+
+        self.assertEqual(frame[:1], HEADER_PLAIN)
+        self.assertLess(len(frame), len(json.dumps(self.payload)) / 2)
+        self.assertNotIn(b'username', frame)
+        self.assertEqual(wire.decode(frame), self.payload)
+
+    def test_large_frames_are_deflated_when_negotiated(self):
+        wire = negotiate(['hh.other', MSGPACK_DEFLATE_PROTOCOL])
+        large = {'type': 'ai_response', 'message': {'content': 'breathe slowly. ' * 200}}
+
+        frame = wire.encode(large)
+        self.assertEqual(frame[:1], HEADER_DEFLATE)
+        self.assertLess(len(frame), 200)
+        self.assertEqual(wire.decode(frame), large)
+        self.assertEqual(wire.encode(self.payload)[:1], HEADER_PLAIN)
+
+    def test_rejects_malformed_frames_and_unknown_protocols(self):
+        wire = MsgPackProtocol('hh.msgpack.v1')
+        for frame in (b'', b'\x07abc', HEADER_DEFLATE + b'garbage', HEADER_PLAIN + b'\xc1'):
+            with self.assertRaises(ValueError):
+                wire.decode(frame)
+        self.assertIsNone(negotiate(['graphql-ws']))
+        with override_settings(CHAT_MSGPACK_ENABLED=False):
+            self.assertIsNone(negotiate([MSGPACK_DEFLATE_PROTOCOL]))
+
+    def test_rejects_deflate_frames_that_inflate_past_the_cap(self):
+        wire = MsgPackProtocol(MSGPACK_DEFLATE_PROTOCOL, deflate=True, max_frame_bytes=4096)
+        # About 100 KB of zeros in a frame of a few hundred bytes
+        bomb = HEADER_DEFLATE + zlib.compress(b'\x00' * 100_000, 9)
+        self.assertLess(len(bomb), 200)
+        with self.assertRaisesRegex(ValueError, 'inflates beyond 4096 bytes'):
+            wire.decode(bomb)
+        with self.assertRaisesRegex(ValueError, 'truncated'):
+            wire.decode(HEADER_DEFLATE + zlib.compress(b'\x81\xa1t\xa4ping')[:-4])
+        self.assertEqual(wire.decode(HEADER_DEFLATE + zlib.compress(b'\x81\xa1t\xa4ping')), {'type': 'ping'})
+
+
+class RoomHistoryTests(SimpleTestCase):
+    def event(self, message_id):
+        return {'frame': f'frame-{message_id}', 'message_id': message_id}
+
+    def test_replays_only_ranges_the_buffer_covers(self):
+        history = RoomHistory(size=3)
+        history.observe('room', self.event(1))
+        history.attach('room')
+        for message_id in (5, 6, 6, 7, 8):
+            history.observe('room', self.event(message_id))
+
+        # 5 was evicted, so only resumes from 6 onwards are complete
+        self.assertIsNone(history.replay('room', 5))
+        self.assertEqual(history.replay('room', 6), ['frame-7', 'frame-8'])
+        self.assertEqual(history.replay('room', 8), [])
+
+    def test_edits_invalidate_older_frames_and_detach_drops_room(self):
+        history = RoomHistory(size=10)
+        history.attach('room')
+        history.attach('room')
+        for message_id in (1, 2, 3):
+            history.observe('room', self.event(message_id))
+
+        history.observe('room', {'frame': 'edit', 'invalidates': '2'})
+        self.assertIsNone(history.replay('room', 1))
+        self.assertEqual(history.replay('room', 3), [])
+
+        history.detach('room')
+        self.assertEqual(history.get_stats()['rooms'], 1)
+        history.detach('room')
+        self.assertIsNone(history.replay('room', 3))
+
+    def test_invalidations_only_apply_to_newer_versions(self):
+        history = RoomHistory(size=10)
+        history.attach('room')
+        history.observe('room', self.event(1))
+        history.observe('room', {**self.event(2), 'version': 3})
+        history.observe('room', self.event(3))
+
+        # Replayed or reordered events for a state the buffer already has change nothing
+        history.observe('room', {'frame': 'edit', 'invalidates': 2, 'version': 2})
+        history.observe('room', {'frame': 'edit', 'invalidates': 2, 'version': 3})
+        self.assertEqual(history.replay('room', 1), ['frame-2', 'frame-3'])
+
+        history.observe('room', {'frame': 'delete', 'invalidates': 2, 'version': 4})
+        self.assertIsNone(history.replay('room', 1))
+        self.assertEqual(history.replay('room', 3), [])
+
+    def test_replay_is_in_id_order_and_tracks_evictions_past_late_frames(self):
+        history = RoomHistory(size=3)
+        history.attach('room')
+        # Frames from different replicas can arrive out of id order
+        for message_id in (2, 4, 3):
+            history.observe('room', self.event(message_id))
+        self.assertEqual(history.replay('room', 2), ['frame-3', 'frame-4'])
+
+        # 2 is evicted; resumes from 2 or earlier miss even though 3 is the oldest arrival left
+        history.observe('room', self.event(5))
+        self.assertIsNone(history.replay('room', 2))
+        self.assertEqual(history.replay('room', 3), ['frame-4', 'frame-5'])
+
+        # Evicting 4 leaves 3 buffered, but a resume from 3 would now miss 4
+        history.observe('room', self.event(6))
+        self.assertIsNone(history.replay('room', 3))
+        self.assertEqual(history.replay('room', 5), ['frame-6'])
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_bucket_refills_at_rate_up_to_burst(self):
+        bucket = TokenBucket(rate=2.0, burst=3, now=0.0)
+        self.assertTrue(all(bucket.consume(now=0.0) for _ in range(3)))
+        self.assertFalse(bucket.consume(now=0.0))
+        self.assertAlmostEqual(bucket.retry_after(), 0.5)
+        self.assertTrue(bucket.consume(now=0.5))
+        bucket.consume(now=100.0)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_user_budget_is_shared_across_connections(self):
+        users = RateLimiter({'default': (0.001, 3)})
+        first = ConnectionRateLimit(7, users, {'default': (0.001, 2)})
+        second = ConnectionRateLimit(7, users, {'default': (0.001, 2)})
+
+        self.assertEqual([first.check('chat_message', now=0.0) == 0 for _ in range(3)], [True, True, False])
+        # The connection has a token left, but the user's third was spent elsewhere
+        self.assertEqual(second.check('chat_message', now=0.0), 0)
+        self.assertGreater(second.check('chat_message', now=0.0), 0)
+        self.assertEqual(second.connection.bucket(None, 'chat_message', 0.0).tokens, 1)
+        self.assertEqual(second.violations, 1)
+
+    def test_idle_buckets_are_pruned(self):
+        limiter = RateLimiter({'default': (1.0, 1)}, max_keys=2)
+        limiter.check('a', 'typing', now=0.0)
+        limiter.check('b', 'typing', now=0.0)
+        limiter.check('c', 'typing', now=5.0)
+        self.assertEqual(len(limiter), 1)
+
+
+class AISchedulerTests(SimpleTestCase):
+    def test_priority_fairness_and_bounded_concurrency(self):
+        order = []
+        running = {'now': 0, 'peak': 0}
+
+        def job(name):
+            async def run():
+                running['now'] += 1
+                running['peak'] = max(running['peak'], running['now'])
+                await asyncio.sleep(0.01)
+                order.append(name)
+                running['now'] -= 1
+                return name
+            return run
+
+        async def scenario():
+            scheduler = AIScheduler(workers=1, crisis_workers=0)
+            futures = [scheduler.submit('ai', 'busy-user', job(f'busy-{i}')) for i in range(3)]
+            futures.append(scheduler.submit('ai', 'other-user', job('other')))
+            futures.append(scheduler.submit('support', 'helper', job('support')))
+            futures.append(scheduler.submit('crisis', 'urgent', job('crisis')))
+            await asyncio.gather(*futures)
+            return scheduler.get_stats()
+
+        stats = asyncio.run(scenario())
+
+        # Higher lanes first; within a lane users alternate instead of draining one user's backlog
+        self.assertEqual(order, ['crisis', 'support', 'busy-0', 'other', 'busy-1', 'busy-2'])
+        self.assertEqual(running['peak'], 1)
+        self.assertEqual(stats['lanes']['ai']['completed'], 4)
+        self.assertEqual(stats['lanes']['ai']['depth'], 0)
+
+    def test_crisis_worker_bypasses_saturated_pool(self):
+        async def slow():
+            await asyncio.sleep(0.5)
+
+        async def crisis():
+            return time.monotonic()
+
+        async def scenario():
+            scheduler = AIScheduler(workers=2, crisis_workers=1)
+            for i in range(6):
+                scheduler.submit('ai', i, slow)
+            started = time.monotonic()
+            finished = await scheduler.submit('crisis', 'urgent', crisis)
+            return finished - started, scheduler.depth('ai')
+
+        latency, ai_depth = asyncio.run(scenario())
+
+        self.assertLess(latency, 0.1)
+        self.assertEqual(ai_depth, 4)
+
+    def test_failed_job_reports_error(self):
+        async def broken():
+            raise RuntimeError('boom')
+
+        async def scenario():
+            scheduler = AIScheduler(workers=1, crisis_workers=0)
+            # assertRaises would clear the worker frame held by the traceback
+            try:
+                await scheduler.submit('ai', 1, broken)
+            except RuntimeError as e:
+                error = str(e)
+            return error, scheduler.get_stats()
+
+        error, stats = asyncio.run(scenario())
+        self.assertEqual(error, 'boom')
+        self.assertEqual(stats['lanes']['ai']['failed'], 1)
+
+
+class LoadtestCommandTests(TransactionTestCase):
+    def test_percentile_is_nearest_rank(self):
+        samples = list(range(1, 21))
+        self.assertEqual([loadtest_chat.percentile(samples, pct) for pct in (50, 95, 99, 100)], [10, 19, 20, 20])
+        self.assertEqual(loadtest_chat.percentile([7], 50), 7)
+        self.assertIsNone(loadtest_chat.percentile([], 50))
+
+    def test_smoke_run_reports_every_consumer(self):
+        out = StringIO()
+        call_command('loadtest_chat', rooms=1, clients=1, messages=1, interval=0, llm_latency=0, timeout=5, stdout=out)
+        report = out.getvalue()
+        for kind in ('chat', 'support', 'crisis'):
+            self.assertIn(f'{kind}: 1 clients, 1 messages', report)
+        self.assertNotIn('did not arrive', report)
@@ -0,0 +1,141 @@
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Coroutine that tells the room whether the user is typing
+Broadcast = Callable[[bool], Awaitable[None]]
+
+
+class _TypingState:
+    """Typing state of one user in one room"""
+
+    __slots__ = ('wants_typing', 'broadcast_typing', 'last_activity', 'last_broadcast',
+                 'stop_requested_at', 'timer')
+
+    def __init__(self):
+        self.wants_typing = False
+        self.broadcast_typing = False
+        self.last_activity = 0.0
+        self.last_broadcast = float('-inf')
+        self.stop_requested_at = 0.0
+        self.timer = None
+
+
+class TypingTracker:
+    """Coalesce keystroke-rate typing frames into started/stopped transitions.
+
+    Clients may send a typing frame on every keystroke. Only changes of state
+    are broadcast, at most one per throttle window per user and room. An
+    explicit stop is held for the debounce window so a pause between words
+    does not flap the indicator, and a user who goes quiet is stopped
+    automatically after the timeout.
+    """
+
+    def __init__(self, debounce: float = None, throttle: float = None, timeout: float = None,
+                 clock: Callable[[], float] = None):
+        self.debounce = debounce if debounce is not None else getattr(settings, 'CHAT_TYPING_DEBOUNCE', 1.0)
+        self.throttle = throttle if throttle is not None else getattr(settings, 'CHAT_TYPING_THROTTLE', 2.0)
+        self.timeout = timeout if timeout is not None else getattr(settings, 'CHAT_TYPING_TIMEOUT', 6.0)
+        # Injectable so tests can step time instead of sleeping
+        self.clock = clock or time.monotonic
+        self._states: Dict[Tuple[str, int], _TypingState] = {}
+        self.frames_received = 0
+        self.broadcasts_sent = 0
+
+    async def update(self, room: str, user_id: int, is_typing: bool, broadcast: Broadcast):
+        """Record a typing frame from the client"""
+        self.frames_received += 1
+        key = (room, user_id)
+        state = self._states.get(key)
+        if state is None:
+            if not is_typing:
+                return
+            state = self._states[key] = _TypingState()
+
+        now = self.clock()
+        if is_typing:
+            state.wants_typing = True
+            state.last_activity = now
+        elif state.wants_typing:
+            state.wants_typing = False
+            state.stop_requested_at = now
+
+        await self._evaluate(key, state, broadcast)
+
+    async def stop(self, room: str, user_id: int, broadcast: Broadcast):
+        """Stop immediately, e.g. when the user sends their message or disconnects"""
+        state = self._states.pop((room, user_id), None)
+        if state is None:
+            return
+        self._cancel_timer(state)
+        if state.broadcast_typing:
+            await self._send(broadcast, False)
+
+    def typing_users(self, room: str) -> List[int]:
+        """Users currently shown as typing in a room"""
+        return [user_id for (state_room, user_id), state in self._states.items()
+                if state_room == room and state.broadcast_typing]
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'frames_received': self.frames_received,
+            'broadcasts_sent': self.broadcasts_sent,
+            'tracked': len(self._states)
+        }
+
+    async def _evaluate(self, key: Tuple[str, int], state: _TypingState, broadcast: Broadcast):
+        """Broadcast a pending transition if its window has passed, otherwise wait for it"""
+        now = self.clock()
+        timed_out = state.wants_typing and now - state.last_activity >= self.timeout
+        desired = state.wants_typing and not timed_out
+        next_check = None
+
+        if desired != state.broadcast_typing:
+            earliest = state.last_broadcast + self.throttle
+            if not desired and not timed_out:
+                earliest = max(earliest, state.stop_requested_at + self.debounce)
+            if now >= earliest:
+                state.broadcast_typing = desired
+                state.last_broadcast = now
+                await self._send(broadcast, desired)
+            else:
+                next_check = earliest
+
+        if state.broadcast_typing and state.wants_typing:
+            deadline = state.last_activity + self.timeout
+            next_check = deadline if next_check is None else min(next_check, deadline)
+
+        self._cancel_timer(state)
+        if next_check is not None:
+            state.timer = asyncio.ensure_future(self._fire_at(next_check, key, state, broadcast))
+        elif not state.wants_typing and not state.broadcast_typing:
+            if self._states.get(key) is state:
+                del self._states[key]
+
+    async def _fire_at(self, deadline: float, key: Tuple[str, int], state: _TypingState,
+                       broadcast: Broadcast):
+        await asyncio.sleep(max(deadline - self.clock(), 0))
+        state.timer = None
+        if self._states.get(key) is not state:
+            return
+        try:
+            await self._evaluate(key, state, broadcast)
+        except Exception as e:
+            logger.error(f"Error updating typing state: {str(e)}")
+
+    def _cancel_timer(self, state: _TypingState):
+        if state.timer is not None and state.timer is not asyncio.current_task():
+            state.timer.cancel()
+        state.timer = None
+
+    async def _send(self, broadcast: Broadcast, is_typing: bool):
+        self.broadcasts_sent += 1
+        await broadcast(is_typing)
+
+
+typing_tracker = TypingTracker()
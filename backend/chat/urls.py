@@ -10,4 +10,10 @@ router.register(r'ai-assistant', views.AIAssistantViewSet, basename='aiassistant
 
 urlpatterns = [
     path('api/', include(router.urls)),
+    path('search/', views.search_history, name='search_history'),
+    path('ai-chat/', views.ai_chat, name='ai_chat'),
+    path('recommendations/', views.recommendations, name='recommendations'),
+    path('memory/profile/', views.memory_profile, name='memory_profile'),
+    path('memory/add/', views.memory_add, name='memory_add'),
+    path('memory/search/', views.memory_search, name='memory_search'),
 ]
@@ -1,28 +1,54 @@
+import json
+import time
+import logging
+
+from channels.db import database_sync_to_async
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from django.utils import timezone
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_http_methods
 from .models import ChatRoom, Message, ChatParticipant, CrisisAlert, AIResponse
 from .serializers import (
     ChatRoomSerializer, MessageSerializer, CrisisAlertSerializer,
     ChatParticipantSerializer
 )
-from .ai_support import get_ai_response, detect_crisis_keywords, get_emergency_resources, get_support_resources
+from .ai_support import (
+    get_ai_response, detect_crisis_keywords, get_emergency_resources, get_support_resources,
+    get_user_memory_profile, generate_gemini_response, crisis_screener, get_dashboard_ai_response
+)
+from .ai_batch import run_batch
+from .ai_scheduler import ai_scheduler
+from .crisis_alerts import record_crisis_signal, publish_alert, publish_event
+from .message_history import room_history_page, approximate_message_count
+from .message_edits import edit_message
+from .reactions import REACTION_TYPES, add_reaction, remove_reaction
+from .memory_service import get_memory_service
+from .search import KINDS, search as search_history_index
+from .recommendations import get_recommendations, DEFAULT_RECOMMENDATIONS
 
 User = get_user_model()
 
+logger = logging.getLogger(__name__)
+
 class ChatRoomViewSet(viewsets.ModelViewSet):
     serializer_class = ChatRoomSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         """Return chat rooms where user is a participant"""
-        return ChatRoom.objects.filter(
+        queryset = ChatRoom.objects.filter(
             participants=self.request.user
         ).order_by('-updated_at')
+        if self.action in ('list', 'retrieve', 'update', 'partial_update'):
+            queryset = ChatRoomSerializer.setup_eager_loading(queryset, self.request.user)
+        return queryset
 
     def perform_create(self, serializer):
         """Create a new chat room with the current user as creator"""
@@ -81,26 +107,36 @@ class ChatRoomViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        messages = Message.objects.filter(room=room, is_deleted=False).order_by('-created_at')
-        
-        # Pagination
-        page_size = int(request.query_params.get('page_size', 50))
-        offset = int(request.query_params.get('offset', 0))
-        
-        paginated_messages = messages[offset:offset + page_size]
-        serialized_messages = MessageSerializer(paginated_messages, many=True).data
-        
-        return Response({
-            'messages': serialized_messages,
-            'total_count': messages.count(),
-            'has_more': messages.count() > offset + page_size
-        })
+        # Cursor pagination: pass next_cursor back as ?cursor= for older messages
+        try:
+            page_size = min(
+                max(int(request.query_params.get('page_size', 50)), 1),
+                getattr(settings, 'CHAT_MESSAGE_PAGE_MAX', 100)
+            )
+            messages, next_cursor = room_history_page(
+                room, cursor=request.query_params.get('cursor'), page_size=page_size,
+                queryset=MessageSerializer.setup_eager_loading(Message.objects.all(), request.user)
+            )
+        except ValueError:
+            return Response(
+                {'error': 'Invalid cursor or page_size'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        data = {
+            'messages': MessageSerializer(messages, many=True).data,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if request.query_params.get('include_total') == 'true':
+            data['total_count'] = approximate_message_count(room)
+        return Response(data)
 
     @action(detail=True, methods=['get'])
     def participants(self, request, pk=None):
         """Get participants for a specific room"""
         room = self.get_object()
-        participants = ChatParticipant.objects.filter(room=room)
+        participants = ChatParticipant.objects.filter(room=room).select_related('user')
         serializer = ChatParticipantSerializer(participants, many=True)
         return Response(serializer.data)
 
@@ -204,10 +240,10 @@ class MessageViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Return messages from rooms where user is a participant"""
         user_rooms = ChatRoom.objects.filter(participants=self.request.user)
-        return Message.objects.filter(
+        return MessageSerializer.setup_eager_loading(Message.objects.filter(
             room__in=user_rooms,
             is_deleted=False
-        ).order_by('-created_at')
+        ), self.request.user).order_by('-created_at')
 
     def perform_create(self, serializer):
         """Create a new message"""
@@ -216,15 +252,17 @@ class MessageViewSet(viewsets.ModelViewSet):
         # Check for crisis keywords
         crisis_keywords = detect_crisis_keywords(message.content)
         if crisis_keywords:
-            # Create crisis alert
-            CrisisAlert.objects.create(
-                user=self.request.user,
-                room=message.room,
-                message=message,
-                severity='high' if any(word in message.content.lower() 
-                                     for word in ['suicide', 'kill', 'die']) else 'medium',
-                alert_reason=f"Crisis keywords detected: {', '.join(crisis_keywords)}"
+            # Create or escalate the user's open crisis alert for this room
+            alert, event = record_crisis_signal(
+                self.request.user,
+                message.room,
+                'high' if any(word in message.content.lower()
+                              for word in ['suicide', 'kill', 'die']) else 'medium',
+                keywords=crisis_keywords,
+                message=message
             )
+            if event is not None:
+                publish_event(event)
 
     @action(detail=True, methods=['post'])
     def react(self, request, pk=None):
@@ -232,22 +270,25 @@ class MessageViewSet(viewsets.ModelViewSet):
         message = self.get_object()
         reaction_type = request.data.get('reaction_type')
         
-        if not reaction_type:
+        if reaction_type not in REACTION_TYPES:
             return Response(
-                {'error': 'reaction_type is required'},
+                {'error': f"reaction_type must be one of: {', '.join(sorted(REACTION_TYPES))}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        from .models import MessageReaction
-        reaction, created = MessageReaction.objects.get_or_create(
-            message=message,
-            user=request.user,
-            reaction_type=reaction_type
-        )
+        result = add_reaction(message.id, request.user, reaction_type)
+        if result is None:
+            # Deleted since it was read
+            return Response(
+                {'error': 'Message not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        reaction, created, counts = result
         
         return Response({
             'message': 'Reaction added' if created else 'Reaction already exists',
-            'reaction_type': reaction_type
+            'reaction_type': reaction_type,
+            'reaction_counts': counts
         })
 
     @action(detail=True, methods=['delete'])
@@ -256,27 +297,20 @@ class MessageViewSet(viewsets.ModelViewSet):
         message = self.get_object()
         reaction_type = request.data.get('reaction_type')
         
-        from .models import MessageReaction
-        try:
-            reaction = MessageReaction.objects.get(
-                message=message,
-                user=request.user,
-                reaction_type=reaction_type
-            )
-            reaction.delete()
-            return Response({'message': 'Reaction removed'})
-        except MessageReaction.DoesNotExist:
+        counts = remove_reaction(message.id, request.user, reaction_type)
+        if counts is None:
             return Response(
                 {'error': 'Reaction not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+        return Response({'message': 'Reaction removed', 'reaction_counts': counts})
 
     @action(detail=True, methods=['patch'])
     def edit(self, request, pk=None):
         """Edit a message (only by sender)"""
         message = self.get_object()
         
-        if message.sender != request.user:
+        if message.sender_id != request.user.id:
             return Response(
                 {'error': 'You can only edit your own messages'},
                 status=status.HTTP_403_FORBIDDEN
@@ -289,13 +323,19 @@ class MessageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        message.content = new_content
-        message.mark_as_edited()
+        edit = edit_message(message.id, request.user.id, new_content)
+        if edit is None:
+            # Deleted since it was read
+            return Response(
+                {'error': 'Message not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
         
         return Response({
             'message': 'Message updated successfully',
-            'content': message.content,
-            'edited_at': message.edited_at
+            'content': new_content,
+            'edited_at': edit['edited_at'],
+            'version': edit['version']
         })
 
 
@@ -305,9 +345,14 @@ class CrisisAlertViewSet(viewsets.ReadOnlyModelViewSet):
 
     def get_queryset(self):
         """Return crisis alerts for the current user or handled by them"""
-        return CrisisAlert.objects.filter(
-            Q(user=self.request.user) | Q(responder=self.request.user)
-        ).order_by('-created_at')
+        if self.request.user.is_staff:
+            # Responders act on alerts pushed to the crisis_responders feed
+            alerts = CrisisAlert.objects.all()
+        else:
+            alerts = CrisisAlert.objects.filter(
+                Q(user=self.request.user) | Q(responder=self.request.user)
+            )
+        return alerts.select_related('user', 'responder', 'room').order_by('-created_at')
 
     @action(detail=True, methods=['post'])
     def acknowledge(self, request, pk=None):
@@ -319,6 +364,7 @@ class CrisisAlertViewSet(viewsets.ReadOnlyModelViewSet):
             alert.responder = request.user
             alert.responded_at = timezone.now()
             alert.save()
+            publish_alert(alert, 'acknowledged')
             
             return Response({
                 'message': 'Crisis alert acknowledged',
@@ -342,6 +388,7 @@ class CrisisAlertViewSet(viewsets.ReadOnlyModelViewSet):
             alert.responder = request.user
             alert.responded_at = timezone.now()
         alert.save()
+        publish_alert(alert, 'resolved')
         
         return Response({
             'message': 'Crisis alert resolved',
@@ -353,7 +400,7 @@ class CrisisAlertViewSet(viewsets.ReadOnlyModelViewSet):
         """Get all active crisis alerts (for crisis responders)"""
         active_alerts = CrisisAlert.objects.filter(
             status='active'
-        ).order_by('-created_at')
+        ).select_related('user', 'responder', 'room').order_by('-created_at')
         
         serializer = self.get_serializer(active_alerts, many=True)
         return Response(serializer.data)
@@ -417,6 +464,111 @@ class AIAssistantViewSet(viewsets.ViewSet):
             'urgency_level': 'high' if crisis_keywords else 'low'
         })
 
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def get_response_batch(self, request):
+        """Responses for many messages at once, generated concurrently on the batch pool.
+
+        Body: {"messages": [str | {"message", "is_crisis"}], "generator": "template" | "llm"}
+        """
+        generator = request.data.get('generator', 'template')
+        if generator not in ('template', 'llm'):
+            return Response(
+                {'error': 'generator must be "template" or "llm"'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # LLM calls take seconds each, so those batches are kept small enough to finish in one request
+        max_items = getattr(settings, 'AI_BATCH_LLM_MAX_ITEMS', 50) if generator == 'llm' else None
+        items, error = self.get_batch_items(request, max_items)
+        if error:
+            return error
+
+        started = time.perf_counter()
+        user_context = self.get_user_context(request.user)
+        screens = crisis_screener.screen_many([item['message'] for item in items])
+
+        def respond(pair):
+            item, screen = pair
+            is_crisis = item['is_crisis'] or screen['is_crisis'] or screen['sentiment'] == 'crisis'
+            if generator == 'llm':
+                text = generate_gemini_response(item['message'], user_context, crisis_detected=is_crisis)
+            else:
+                text = get_ai_response(message=item['message'], is_crisis=is_crisis, user_context=user_context)
+            return {
+                'response': text,
+                'confidence': 0.9 if is_crisis else 0.7,
+                'response_type': 'crisis_intervention' if is_crisis else 'supportive',
+                'urgency_level': screen['urgency_level']
+            }
+
+        results = run_batch(list(zip(items, screens)), respond, timeout=getattr(settings, 'AI_BATCH_TIMEOUT', 120))
+        return Response({
+            'results': results,
+            'count': len(results),
+            'failed': sum(1 for result in results if 'error' in result),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def check_crisis_batch(self, request):
+        """Crisis screening for many messages at once: {"messages": [str, ...]}"""
+        items, error = self.get_batch_items(request)
+        if error:
+            return error
+
+        started = time.perf_counter()
+        results = []
+        for index, item in enumerate(items):
+            item_started = time.perf_counter()
+            screen = crisis_screener.screen(item['message'])
+            results.append({
+                'index': index,
+                'is_crisis': screen['is_crisis'],
+                'keywords_detected': screen['keywords_detected'],
+                'urgency_level': 'high' if screen['is_crisis'] else 'low',
+                'risk_level': screen['urgency_level'],
+                'elapsed_ms': round((time.perf_counter() - item_started) * 1000, 3)
+            })
+        return Response({
+            'results': results,
+            'count': len(results),
+            'crisis_count': sum(1 for result in results if result['is_crisis']),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2)
+        })
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def queue_stats(self, request):
+        """Queue depth and wait times of this process's AI reply scheduler"""
+        return Response(ai_scheduler.get_stats())
+
+    def get_batch_items(self, request, max_items=None):
+        """Validated batch messages as [{message, is_crisis}], or an error response"""
+        messages = request.data.get('messages')
+        max_items = max_items or getattr(settings, 'AI_BATCH_MAX_ITEMS', 1000)
+        if not isinstance(messages, list) or not messages:
+            return None, Response(
+                {'error': 'messages must be a non-empty list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(messages) > max_items:
+            return None, Response(
+                {'error': f'At most {max_items} messages can be sent at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        items = []
+        for message in messages:
+            if isinstance(message, dict):
+                item = {'message': message.get('message'), 'is_crisis': bool(message.get('is_crisis', False))}
+            else:
+                item = {'message': message, 'is_crisis': False}
+            if not isinstance(item['message'], str) or not item['message']:
+                return None, Response(
+                    {'error': 'every message must be a non-empty string'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            items.append(item)
+        return items, None
+
     def get_user_context(self, user):
         """Get user context for AI response generation"""
         context = {
@@ -436,3 +588,200 @@ class AIAssistantViewSet(viewsets.ViewSet):
             })
         
         return context
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def memory_profile(request):
+    """Return what the assistant remembers about the current user"""
+    return Response({
+        'success': True,
+        'profile': get_user_memory_profile(request.user)
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def memory_add(request):
+    """Add one memory ({content, category, metadata}) or a batch ({memories: [...]})"""
+    items = request.data.get('memories')
+    if items is None:
+        items = [request.data]
+    
+    if not isinstance(items, list) or not items:
+        return Response(
+            {'success': False, 'error': 'memories must be a non-empty list'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    max_batch = getattr(settings, 'MEMORY_ADD_MAX_BATCH', 100)
+    if len(items) > max_batch:
+        return Response(
+            {'success': False, 'error': f'At most {max_batch} memories can be added at once'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not all(isinstance(item, dict) and str(item.get('content') or '').strip() for item in items):
+        return Response(
+            {'success': False, 'error': 'content is required for every memory'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    if not all(isinstance(item.get('metadata') or {}, dict) for item in items):
+        return Response(
+            {'success': False, 'error': 'metadata must be an object'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    memories = get_memory_service().add_memories(request.user.id, items)
+    
+    return Response({
+        'success': True,
+        'created': len(memories),
+        'ids': [memory.id for memory in memories]
+    }, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_history(request):
+    """Ranked full-text search over the user's chat messages and journal entries"""
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'success': False, 'error': 'q is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    kinds = [kind for kind in request.query_params.get('kinds', ','.join(KINDS)).split(',') if kind in KINDS]
+    max_page_size = getattr(settings, 'CHAT_SEARCH_PAGE_MAX', 50)
+    max_page = getattr(settings, 'CHAT_SEARCH_MAX_PAGE', 20)
+    try:
+        page = min(max(int(request.query_params.get('page', 1)), 1), max_page)
+        page_size = min(max(int(request.query_params.get('page_size', 20)), 1), max_page_size)
+    except (TypeError, ValueError):
+        page, page_size = 1, 20
+
+    results, has_more = search_history_index(request.user, query, kinds=kinds, page=page, page_size=page_size)
+    return Response({
+        'success': True,
+        'results': results,
+        'page': page,
+        'next_page': page + 1 if has_more and page < max_page else None
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def memory_search(request):
+    """Search the current user's memories, one cursor page at a time"""
+    query = request.data.get('query', '')
+    max_limit = getattr(settings, 'MEMORY_SEARCH_MAX_LIMIT', 50)
+    try:
+        limit = min(max(int(request.data.get('limit', 10)), 1), max_limit)
+    except (TypeError, ValueError):
+        limit = 10
+    
+    try:
+        memories, next_cursor = get_memory_service().search_memories(
+            request.user,
+            query=str(query),
+            limit=limit,
+            cursor=request.data.get('cursor')
+        )
+    except ValueError as e:
+        return Response(
+            {'success': False, 'error': str(e)},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response({
+        'success': True,
+        'memories': [
+            {
+                'id': memory.id,
+                'content': memory.content,
+                'category': memory.context.get('category', memory.memory_type),
+                'memory_type': memory.memory_type,
+                'importance': memory.importance,
+                'created_at': memory.created_at.isoformat()
+            }
+            for memory in memories
+        ],
+        'next_cursor': next_cursor
+    })
+
+
+# The dashboard's AI panels are plain async views: replies wait on the shared
+# AI scheduler without holding a worker thread. CSRF is exempt like the
+# session authentication the API views use.
+
+@csrf_exempt
+@require_POST
+async def ai_chat(request):
+    """Reply to a dashboard chat message, optionally using memories and retrieval"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
+    try:
+        data = json.loads(request.body or b'{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'Invalid JSON data'}, status=400)
+    if not isinstance(data, dict):
+        data = {}
+
+    message = str(data.get('message') or '').strip()
+    if not message:
+        return JsonResponse({'success': False, 'error': 'message is required'}, status=400)
+    use_memory = data.get('use_memory', True) is not False
+    use_rag = data.get('use_rag', True) is not False
+
+    screen = crisis_screener.screen(message)
+    is_crisis = screen['is_crisis'] or screen['sentiment'] == 'crisis'
+    lane = 'crisis' if is_crisis else 'ai'
+
+    result = None
+    if ai_scheduler.saturated(lane):
+        # Backpressure: answer from templates now instead of queuing behind the LLM
+        ai_scheduler.record_shed(lane)
+    else:
+        try:
+            # Not thread-sensitive, so scheduler workers generate in parallel threads
+            result = await ai_scheduler.submit(
+                lane,
+                user.id,
+                lambda: database_sync_to_async(get_dashboard_ai_response, thread_sensitive=False)(
+                    message, user, use_memory=use_memory, use_rag=use_rag, is_crisis=is_crisis
+                )
+            )
+        except Exception as e:
+            logger.error(f"Dashboard AI chat failed: {str(e)}")
+    if not result or not result.get('response'):
+        result = {'response': get_ai_response(message, is_crisis=is_crisis), 'personalized': False}
+
+    return JsonResponse({
+        'success': True,
+        'response': result['response'],
+        'crisis_detected': is_crisis or bool(result.get('crisis_detected')),
+        'urgency_level': screen['urgency_level'],
+        'personalized': bool(result.get('personalized')),
+        'knowledge_used': len(result.get('knowledge_used') or []),
+        'resources': get_emergency_resources() if is_crisis else []
+    })
+
+
+@csrf_exempt
+@require_http_methods(['GET', 'POST'])
+async def recommendations(request):
+    """The user's precomputed dashboard recommendations"""
+    user = await request.auser()
+    if not user.is_authenticated:
+        return JsonResponse({'success': False, 'error': 'Authentication required'}, status=401)
+
+    recommendation_set = await database_sync_to_async(get_recommendations)(user)
+    if recommendation_set is None:
+        return JsonResponse({'success': True, 'recommendations': DEFAULT_RECOMMENDATIONS, 'updated_at': None})
+    return JsonResponse({
+        'success': True,
+        'recommendations': recommendation_set.items,
+        'updated_at': recommendation_set.updated_at.isoformat()
+    })
@@ -0,0 +1,143 @@
+"""Binary WebSocket framing for chat consumers.
+
+Clients opt in by offering a subprotocol at connect time:
+
+    hh.msgpack.v1           MessagePack frames with short field codes
+    hh.msgpack.v1+deflate   as above; large frames are zlib-deflated
+
+Every binary frame starts with one header byte (0 = plain, 1 = deflated)
+followed by the MessagePack body. Keys listed in FIELD_CODES are replaced by
+their code in both directions; other keys are sent unchanged. Clients that
+offer no supported subprotocol keep the JSON text protocol.
+"""
+import json
+import zlib
+import logging
+from functools import lru_cache
+from typing import Any, Dict, Iterable, Optional
+
+from django.conf import settings
+
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+MSGPACK_PROTOCOL = 'hh.msgpack.v1'
+MSGPACK_DEFLATE_PROTOCOL = 'hh.msgpack.v1+deflate'
+
+HEADER_PLAIN = b'\x00'
+HEADER_DEFLATE = b'\x01'
+
+# Part of the v1 protocol: codes may be added but never reused or changed
+FIELD_CODES = {
+    'type': 't',
+    'message': 'm',
+    'id': 'i',
+    'content': 'c',
+    'sender': 's',
+    'username': 'u',
+    'first_name': 'fn',
+    'last_name': 'ln',
+    'message_type': 'mt',
+    'reply_to': 'rt',
+    'created_at': 'ca',
+    'is_edited': 'ie',
+    'edited_at': 'ea',
+    'crisis_detected': 'cd',
+    'response_type': 'rs',
+    'confidence': 'cf',
+    'message_id': 'mi',
+    'user_id': 'ui',
+    'is_typing': 'it',
+    'reaction': 'r',
+    'new_content': 'nc',
+    'edited_by': 'eb',
+    'deleted_by': 'db',
+    'resume_from': 'rf',
+    'version': 'v',
+    'reaction_counts': 'rc',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+
+
+def _rename(value: Any, mapping: Dict[str, str]) -> Any:
+    if isinstance(value, dict):
+        return {mapping.get(key, key): _rename(item, mapping) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_rename(item, mapping) for item in value]
+    return value
+
+
+class MsgPackProtocol:
+    """Encode outgoing frames and decode incoming ones for one negotiated subprotocol"""
+
+    def __init__(self, name: str, deflate: bool = False, deflate_min_bytes: int = 512, level: int = 6,
+                 max_frame_bytes: int = None):
+        self.name = name
+        self.deflate = deflate
+        self.deflate_min_bytes = deflate_min_bytes
+        self.level = level
+        self.max_frame_bytes = max_frame_bytes or getattr(settings, 'CHAT_MAX_FRAME_BYTES', 65536)
+        # Room broadcasts reach every local receiver as the same JSON text, so
+        # each one is converted once per process rather than once per socket
+        self.encode_text = lru_cache(maxsize=256)(self._encode_text)
+
+    def encode(self, payload: Dict[str, Any]) -> bytes:
+        body = msgpack.packb(_rename(payload, FIELD_CODES), use_bin_type=True)
+        if self.deflate and len(body) >= self.deflate_min_bytes:
+            return HEADER_DEFLATE + zlib.compress(body, self.level)
+        return HEADER_PLAIN + body
+
+    def _encode_text(self, text: str) -> bytes:
+        return self.encode(json.loads(text))
+
+    def _inflate(self, body: bytes) -> bytes:
+        # Capped, so a small compressed frame cannot expand without bound in memory
+        inflater = zlib.decompressobj()
+        data = inflater.decompress(body, self.max_frame_bytes)
+        if inflater.unconsumed_tail:
+            raise ValueError(f"frame inflates beyond {self.max_frame_bytes} bytes")
+        if not inflater.eof:
+            raise ValueError('truncated deflate frame')
+        return data
+
+    def decode(self, frame: bytes) -> Dict[str, Any]:
+        """Decode a client frame; raises ValueError for anything malformed"""
+        try:
+            header, body = frame[:1], frame[1:]
+            if header == HEADER_DEFLATE:
+                body = self._inflate(body)
+            elif header != HEADER_PLAIN:
+                raise ValueError(f"unknown frame header {header!r}")
+            data = msgpack.unpackb(body, raw=False)
+        except ValueError:
+            raise
+        except Exception as e:
+            raise ValueError(str(e)) from e
+        if not isinstance(data, dict):
+            raise ValueError('frame must be a map')
+        return _rename(data, FIELD_NAMES)
+
+
+def negotiate(offered: Iterable[str]) -> Optional[MsgPackProtocol]:
+    """First binary subprotocol the client offered that this server supports"""
+    if not MSGPACK_AVAILABLE or not getattr(settings, 'CHAT_MSGPACK_ENABLED', True):
+        return None
+    for name in offered or ():
+        if name in _protocols:
+            return _protocols[name]
+    return None
+
+
+_deflate_min_bytes = getattr(settings, 'CHAT_DEFLATE_MIN_BYTES', 512)
+_protocols = {
+    MSGPACK_PROTOCOL: MsgPackProtocol(MSGPACK_PROTOCOL),
+    MSGPACK_DEFLATE_PROTOCOL: MsgPackProtocol(
+        MSGPACK_DEFLATE_PROTOCOL, deflate=True, deflate_min_bytes=_deflate_min_bytes
+    ),
+}
@@ -0,0 +1,144 @@
+from datetime import date, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from mental_health_backend.perf_budget import BudgetTestMixin, Endpoint
+from . import urls
+from .models import (
+    MoodEntry, JournalEntry, Goal, Activity, Appointment,
+    UserSettings, MeditationSession
+)
+from .views import current_streak
+
+User = get_user_model()
+
+MOOD = {'mood': 'good', 'score': 7, 'date': '2020-01-01', 'note': 'budget check'}
+JOURNAL = {'title': 'Budget check', 'content': 'A short entry about today.', 'date': '2020-01-01'}
+GOAL = {
+    'title': 'Walk', 'description': 'Walk daily', 'category': 'exercise', 'target_value': 30,
+    'unit': 'days', 'start_date': '2020-01-01', 'end_date': '2020-02-01'
+}
+
+# Budgets include the five queries every session-authenticated request costs:
+# session and user lookups, and the session save wrapped in a savepoint
+ENDPOINTS = [
+    Endpoint('moodentry-list', queries=6),
+    Endpoint('moodentry-list', 'post', queries=22, data=MOOD),
+    Endpoint('moodentry-detail', queries=6, args=('mood_entry',)),
+    Endpoint('moodentry-detail', 'patch', queries=7, args=('mood_entry',), data={'note': 'edited'}),
+    Endpoint('moodentry-analytics', queries=12),
+    Endpoint('journalentry-list', queries=6),
+    Endpoint('journalentry-list', 'post', queries=15, data=JOURNAL),
+    Endpoint('journalentry-detail', queries=6, args=('journal_entry',)),
+    Endpoint('journalentry-stats', queries=9),
+    Endpoint('goal-list', queries=6),
+    Endpoint('goal-list', 'post', queries=22, data=GOAL),
+    Endpoint('goal-detail', queries=6, args=('goal',)),
+    Endpoint('goal-update-progress', 'post', queries=8, args=('goal',), data={'increment': 1}),
+    Endpoint('activity-list', queries=6),
+    Endpoint('activity-detail', queries=6, args=('activity',)),
+    Endpoint('appointment-list', queries=6),
+    Endpoint('appointment-list', 'post', queries=7, data={
+        'therapist_name': 'Dr. Lee', 'appointment_type': 'individual', 'session_format': 'video',
+        'date': '2030-01-01', 'time': '10:00'
+    }),
+    Endpoint('appointment-detail', queries=6, args=('appointment',)),
+    Endpoint('meditationsession-list', queries=6),
+    Endpoint('meditationsession-list', 'post', queries=22, data={
+        'session_name': 'Body scan', 'duration_minutes': 10, 'completed': True
+    }),
+    Endpoint('meditationsession-detail', queries=6, args=('meditation',)),
+    Endpoint('meditationsession-stats', queries=8),
+    Endpoint('dashboard-overview', queries=15),
+    Endpoint('user-settings', queries=6),
+    Endpoint('user-settings', 'post', queries=7, data={'theme': 'dark'}),
+    Endpoint('user-activities', queries=6),
+    Endpoint('mood-entries', queries=6),
+    Endpoint('create-mood-entry', 'post', queries=22, data=MOOD, status=201),
+    Endpoint('journal-entries', queries=6),
+    Endpoint('create-journal-entry', 'post', queries=15, data=JOURNAL, status=201),
+    Endpoint('goals-list', queries=6),
+    Endpoint('create-goal', 'post', queries=22, data=GOAL, status=201),
+    Endpoint('refresh-data', 'post', queries=17),
+]
+
+
+class StreakTests(TestCase):
+    def test_streak_counts_consecutive_days_ending_today(self):
+        today = date(2024, 5, 10)
+        days = [today - timedelta(days=offset) for offset in (0, 1, 2, 4)]
+        self.assertEqual(current_streak(iter(days), today), 3)
+        self.assertEqual(current_streak(iter(days[1:]), today), 0)
+        self.assertEqual(current_streak(iter([]), today), 0)
+
+
+class DashboardBudgetTests(BudgetTestMixin, TestCase):
+    """Every dashboard route against a user with several months of history"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tracker', email='tracker@example.com', password='pw')
+        today = timezone.now().date()
+
+        MoodEntry.objects.bulk_create([
+            MoodEntry(user=cls.user, mood='good', score=5 + day % 5, date=today - timedelta(days=day))
+            for day in range(90)
+        ])
+        JournalEntry.objects.bulk_create([
+            JournalEntry(user=cls.user, title=f'Day {day}', content='Writing things down ' * 20,
+                         word_count=80, date=today - timedelta(days=day))
+            for day in range(60)
+        ])
+        Goal.objects.bulk_create([
+            Goal(user=cls.user, title=f'Goal {i}', description='Keep going', category='self-care',
+                 target_value=30, current_value=i * 2, unit='days', start_date=today,
+                 end_date=today + timedelta(days=30), status='completed' if i % 4 == 0 else 'active')
+            for i in range(12)
+        ])
+        Activity.objects.bulk_create([
+            Activity(user=cls.user, activity_type='mood', title=f'Activity {i}')
+            for i in range(200)
+        ])
+        Appointment.objects.bulk_create([
+            Appointment(user=cls.user, therapist_name='Dr. Lee', appointment_type='individual',
+                        session_format='video', date=today + timedelta(days=i), time=time(10))
+            for i in range(15)
+        ])
+        UserSettings.objects.create(user=cls.user)
+
+        # A 45-day meditation streak, two sessions a day
+        MeditationSession.objects.bulk_create([
+            MeditationSession(user=cls.user, session_name='Breathing', duration_minutes=10, completed=True)
+            for _ in range(90)
+        ])
+        now = timezone.now()
+        for i, pk in enumerate(MeditationSession.objects.values_list('pk', flat=True)):
+            MeditationSession.objects.filter(pk=pk).update(created_at=now - timedelta(days=i // 2))
+
+        cls.mood_entry = MoodEntry.objects.filter(user=cls.user).first()
+        cls.journal_entry = JournalEntry.objects.filter(user=cls.user).first()
+        cls.goal = Goal.objects.filter(user=cls.user, status='active').first()
+        cls.activity = Activity.objects.filter(user=cls.user).first()
+        cls.appointment = Appointment.objects.filter(user=cls.user).first()
+        cls.meditation = MeditationSession.objects.filter(user=cls.user).first()
+
+    def test_every_route_has_a_budget(self):
+        self.assertRoutesBudgeted(urls.urlpatterns, ENDPOINTS)
+
+    def test_endpoints_stay_within_budget(self):
+        client = APIClient()
+        for endpoint in ENDPOINTS:
+            with self.subTest(endpoint.label):
+                self.request_endpoint(client, endpoint)
+
+    def test_streaks_do_not_query_per_day(self):
+        client = APIClient()
+        budgets = {endpoint.label: endpoint for endpoint in ENDPOINTS}
+        overview = self.request_endpoint(client, budgets['GET dashboard-overview'])
+        self.assertEqual(overview.data['dashboard_stats']['meditation_streak'], 45)
+        stats = self.request_endpoint(client, budgets['GET journalentry-stats'])
+        self.assertEqual(stats.data['stats']['current_streak'], 60)
+        self.assertEqual(stats.data['stats']['total_words'], 60 * 80)
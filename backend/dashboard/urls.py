@@ -12,6 +12,12 @@ router.register(r'appointments', views.AppointmentViewSet, basename='appointment
 router.register(r'meditation-sessions', views.MeditationSessionViewSet, basename='meditationsession')
 
 urlpatterns = [
+    # Create endpoints come before the router, whose detail routes would
+    # otherwise take "create" as a primary key
+    path('api/mood-entries/create/', views.create_mood_entry, name='create-mood-entry'),
+    path('api/journal-entries/create/', views.create_journal_entry, name='create-journal-entry'),
+    path('api/goals/create/', views.create_goal, name='create-goal'),
+
     # Include router URLs
     path('api/', include(router.urls)),
     
@@ -26,15 +32,12 @@ urlpatterns = [
     
     # Mood endpoints (alternative to viewset)
     path('api/mood-entries/', views.mood_entries, name='mood-entries'),
-    path('api/mood-entries/create/', views.create_mood_entry, name='create-mood-entry'),
     
     # Journal endpoints (alternative to viewset)
     path('api/journal-entries/', views.journal_entries, name='journal-entries'),
-    path('api/journal-entries/create/', views.create_journal_entry, name='create-journal-entry'),
     
     # Goals endpoints (alternative to viewset)
     path('api/goals/', views.goals_list, name='goals-list'),
-    path('api/goals/create/', views.create_goal, name='create-goal'),
     
     # Refresh endpoint
     path('api/refresh-data/', views.refresh_dashboard_data, name='refresh-data'),
@@ -3,7 +3,8 @@ from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from django.utils import timezone
-from django.db.models import Count, Avg, Q, Max, Min
+from django.db.models import Count, Avg, Q, Max, Min, Sum
+from django.db.models.functions import TruncDate
 from datetime import datetime, timedelta, date
 from collections import Counter
 import json
@@ -18,7 +19,22 @@ from .serializers import (
     MeditationSessionSerializer, DashboardInsightSerializer,
     MoodAnalyticsSerializer, DashboardStatsSerializer, RecentActivitySerializer
 )
-from chat.memory_service import MemoryService
+from chat.memory_service import get_memory_service
+
+def current_streak(days, today):
+    """Consecutive days ending today, from distinct dates in descending order"""
+    streak = 0
+    for day in days:
+        if day != today - timedelta(days=streak):
+            break
+        streak += 1
+    return streak
+
+def meditation_streak_days(sessions, today):
+    """Distinct days with a session, newest first, read in one query"""
+    return sessions.filter(created_at__date__lte=today).annotate(
+        day=TruncDate('created_at')
+    ).order_by('-day').values_list('day', flat=True).distinct().iterator()
 
 class MoodEntryViewSet(viewsets.ModelViewSet):
     serializer_class = MoodEntrySerializer
@@ -54,11 +70,12 @@ class MoodEntryViewSet(viewsets.ModelViewSet):
                 memory_content += f". Factors: {', '.join(mood_data['factors'])}"
             
             try:
-                memory_service = MemoryService()
+                memory_service = get_memory_service()
                 memory_service.add_memory(
                     user_id=str(request.user.id),
                     content=memory_content,
-                    category="mood_tracking"
+                    category="mood_tracking",
+                    metadata={'score': mood_data['score']}
                 )
             except Exception as e:
                 print(f"Failed to add mood to memory: {e}")
@@ -116,7 +133,7 @@ class MoodEntryViewSet(viewsets.ModelViewSet):
         mood_distribution = dict(mood_counts)
         
         # Recent trend
-        recent_entries = mood_entries[:7]
+        recent_entries = list(mood_entries[:7])
         if len(recent_entries) >= 2:
             recent_trend = "improving" if recent_entries[0].score > recent_entries[-1].score else "declining" if recent_entries[0].score < recent_entries[-1].score else "stable"
         else:
@@ -165,7 +182,7 @@ class JournalEntryViewSet(viewsets.ModelViewSet):
             memory_content = f"Journal entry: {journal_data['title']}. Content preview: {journal_data['content'][:200]}..."
             
             try:
-                memory_service = MemoryService()
+                memory_service = get_memory_service()
                 memory_service.add_memory(
                     user_id=str(request.user.id),
                     content=memory_content,
@@ -191,19 +208,14 @@ class JournalEntryViewSet(viewsets.ModelViewSet):
         entries = self.get_queryset()
         
         total_entries = entries.count()
-        total_words = sum(entries.values_list('word_count', flat=True))
+        total_words = entries.aggregate(total=Sum('word_count'))['total'] or 0
         
         # Calculate writing streak
         today = timezone.now().date()
-        streak = 0
-        current_date = today
-        
-        while True:
-            if entries.filter(date=current_date).exists():
-                streak += 1
-                current_date -= timedelta(days=1)
-            else:
-                break
+        streak = current_streak(
+            entries.filter(date__lte=today).order_by('-date').values_list('date', flat=True).distinct().iterator(),
+            today
+        )
         
         # Recent entries
         recent_entries = entries[:5].values('id', 'title', 'date', 'word_count', 'mood')
@@ -248,7 +260,7 @@ class GoalViewSet(viewsets.ModelViewSet):
             memory_content = f"New goal created: {goal_data['title']} - {goal_data['description']}. Target: {goal_data['target_value']} {goal_data['unit']}"
             
             try:
-                memory_service = MemoryService()
+                memory_service = get_memory_service()
                 memory_service.add_memory(
                     user_id=str(request.user.id),
                     content=memory_content,
@@ -289,7 +301,7 @@ class GoalViewSet(viewsets.ModelViewSet):
         # Add to memory if goal is completed
         if goal.status == 'completed':
             try:
-                memory_service = MemoryService()
+                memory_service = get_memory_service()
                 memory_service.add_memory(
                     user_id=str(request.user.id),
                     content=f"Completed goal: {goal.title}. Achievement unlocked!",
@@ -407,7 +419,7 @@ class MeditationSessionViewSet(viewsets.ModelViewSet):
             
             # Add to memory system
             try:
-                memory_service = MemoryService()
+                memory_service = get_memory_service()
                 memory_service.add_memory(
                     user_id=str(request.user.id),
                     content=f"Completed {session_data['duration_minutes']}-minute meditation session: {session_data['session_name']}",
@@ -424,19 +436,11 @@ class MeditationSessionViewSet(viewsets.ModelViewSet):
         sessions = self.get_queryset().filter(completed=True)
         
         total_sessions = sessions.count()
-        total_minutes = sum(sessions.values_list('duration_minutes', flat=True))
+        total_minutes = sessions.aggregate(total=Sum('duration_minutes'))['total'] or 0
         
         # Calculate streak
         today = timezone.now().date()
-        streak = 0
-        current_date = today
-        
-        while True:
-            if sessions.filter(created_at__date=current_date).exists():
-                streak += 1
-                current_date -= timedelta(days=1)
-            else:
-                break
+        streak = current_streak(meditation_streak_days(sessions, today), today)
         
         return Response({
             'success': True,
@@ -468,38 +472,40 @@ def dashboard_overview(request):
     
     today = timezone.now().date()
     
+    # Last 7 days of moods, read once for today's mood and the chart
+    week_ago = today - timedelta(days=6)
+    mood_entries = {
+        entry.date: entry for entry in MoodEntry.objects.filter(
+            user=user,
+            date__gte=week_ago,
+            date__lte=today
+        )
+    }
+    
     # Today's mood
-    today_mood_entry = MoodEntry.objects.filter(user=user, date=today).first()
+    today_mood_entry = mood_entries.get(today)
     today_mood = today_mood_entry.mood if today_mood_entry else None
     
     # Calculate mood change from yesterday
     yesterday = today - timedelta(days=1)
-    yesterday_mood = MoodEntry.objects.filter(user=user, date=yesterday).first()
+    yesterday_mood = mood_entries.get(yesterday)
     mood_change = 0
     if today_mood_entry and yesterday_mood:
         mood_change = ((today_mood_entry.score - yesterday_mood.score) / yesterday_mood.score) * 100
     
     # Meditation streak
-    meditation_sessions = MeditationSession.objects.filter(user=user, completed=True).order_by('-created_at')
-    meditation_streak = 0
-    current_date = today
-    
-    while True:
-        if meditation_sessions.filter(created_at__date=current_date).exists():
-            meditation_streak += 1
-            current_date -= timedelta(days=1)
-        else:
-            break
+    meditation_sessions = MeditationSession.objects.filter(user=user, completed=True)
+    meditation_streak = current_streak(meditation_streak_days(meditation_sessions, today), today)
     
     # Goals stats
     goals = Goal.objects.filter(user=user)
     goals_completed = goals.filter(status='completed').count()
-    goals_active = goals.filter(status='active').count()
     
     # Weekly goals progress
-    active_goals = goals.filter(status='active')
-    if active_goals.exists():
-        weekly_progress = sum(goal.progress_percentage for goal in active_goals) / active_goals.count()
+    active_goals = list(goals.filter(status='active'))
+    goals_active = len(active_goals)
+    if active_goals:
+        weekly_progress = sum(goal.progress_percentage for goal in active_goals) / goals_active
     else:
         weekly_progress = 0
     
@@ -549,17 +555,10 @@ def dashboard_overview(request):
         })
     
     # Mood chart data (last 7 days)
-    week_ago = today - timedelta(days=6)
-    mood_entries = MoodEntry.objects.filter(
-        user=user,
-        date__gte=week_ago,
-        date__lte=today
-    ).order_by('date')
-    
     mood_chart_data = []
     for i in range(7):
         chart_date = week_ago + timedelta(days=i)
-        mood_entry = mood_entries.filter(date=chart_date).first()
+        mood_entry = mood_entries.get(chart_date)
         mood_chart_data.append({
             'date': chart_date.strftime('%Y-%m-%d'),
             'day': chart_date.strftime('%a'),
@@ -638,8 +637,8 @@ def generate_user_insights(user):
     insights = []
     
     # Mood trend insight
-    mood_entries = MoodEntry.objects.filter(user=user).order_by('-date')[:14]
-    if mood_entries.count() >= 7:
+    mood_entries = list(MoodEntry.objects.filter(user=user).order_by('-date')[:14])
+    if len(mood_entries) >= 7:
         recent_avg = sum(entry.score for entry in mood_entries[:7]) / 7
         previous_entries = mood_entries[7:14]
         if len(previous_entries) > 0:
@@ -665,9 +664,9 @@ def generate_user_insights(user):
             })
     
     # Goal progress insight
-    active_goals = Goal.objects.filter(user=user, status='active')
-    if active_goals.exists():
-        avg_progress = sum(goal.progress_percentage for goal in active_goals) / active_goals.count()
+    active_goals = list(Goal.objects.filter(user=user, status='active'))
+    if active_goals:
+        avg_progress = sum(goal.progress_percentage for goal in active_goals) / len(active_goals)
         if avg_progress > 75:
             insights.append({
                 'type': 'goal_achievement',
@@ -678,16 +677,16 @@ def generate_user_insights(user):
             })
     
     # Meditation consistency
-    meditation_sessions = MeditationSession.objects.filter(
+    weekly_sessions = MeditationSession.objects.filter(
         user=user,
         completed=True,
         created_at__gte=timezone.now() - timedelta(days=7)
-    )
-    if meditation_sessions.count() >= 5:
+    ).count()
+    if weekly_sessions >= 5:
         insights.append({
             'type': 'meditation_consistency',
             'title': 'Meditation master in the making! 🧘',
-            'description': f'You\'ve meditated {meditation_sessions.count()} times this week. Your mind thanks you!',
+            'description': f'You\'ve meditated {weekly_sessions} times this week. Your mind thanks you!',
             'icon': 'brain',
             'priority': 2
         })
@@ -790,11 +789,12 @@ def create_mood_entry(request):
             memory_content += f". Factors: {', '.join(mood_entry.factors)}"
         
         try:
-            memory_service = MemoryService()
+            memory_service = get_memory_service()
             memory_service.add_memory(
                 user_id=str(request.user.id),
                 content=memory_content,
-                category="mood_tracking"
+                category="mood_tracking",
+                metadata={'score': mood_entry.score}
             )
         except Exception as e:
             print(f"Failed to add mood to memory: {e}")
@@ -857,7 +857,7 @@ def create_journal_entry(request):
         memory_content = f"Journal entry: {journal_entry.title}. Content preview: {journal_entry.content[:200]}..."
         
         try:
-            memory_service = MemoryService()
+            memory_service = get_memory_service()
             memory_service.add_memory(
                 user_id=str(request.user.id),
                 content=memory_content,
@@ -924,7 +924,7 @@ def create_goal(request):
         memory_content = f"New goal created: {goal.title} - {goal.description}. Target: {goal.target_value} {goal.unit}"
         
         try:
-            memory_service = MemoryService()
+            memory_service = get_memory_service()
             memory_service.add_memory(
                 user_id=str(request.user.id),
                 content=memory_content,
@@ -986,12 +986,9 @@ def refresh_dashboard_data(request):
         deleted_counts['activities'] = activity_count
         
         # Reset all goals to zero progress
-        goals = Goal.objects.filter(user=user)
-        goal_count = goals.count()
-        for goal in goals:
-            goal.current_value = 0
-            goal.status = 'active'
-            goal.save()
+        goal_count = Goal.objects.filter(user=user).update(
+            current_value=0, status='active', updated_at=timezone.now()
+        )
         deleted_counts['goals_reset'] = goal_count
         
         # Delete all journal entries
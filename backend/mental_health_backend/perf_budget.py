@@ -0,0 +1,160 @@
+"""Query-count and wall-time budgets for endpoint and consumer tests.
+
+Each app's tests declare an Endpoint per route: the most SQL queries and
+milliseconds one request may take against a realistically sized fixture.
+BudgetTestMixin fails the test when a request goes over either budget, so
+performance regressions break the build like functional ones.
+
+Every measurement is kept; set PERF_BUDGET_REPORT to a file path to have
+them appended there as JSON lines, and PERF_BUDGET_TIME_FACTOR to scale the
+time budgets on slow machines.
+"""
+import json
+import time
+import logging
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Set
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+_measurements: List[Dict] = []
+
+
+class Endpoint:
+    """Budget for one route, with the request used to measure it.
+
+    args names fixture attributes on the test case whose primary keys fill
+    the URL, e.g. args=('room',) for a detail route.
+    """
+
+    def __init__(self, name: str, method: str = 'get', queries: int = 10, ms: float = 250,
+                 args: Iterable[str] = (), data: Optional[Dict] = None,
+                 status: Optional[int] = None, user: Optional[str] = 'user'):
+        self.name = name
+        self.method = method
+        self.queries = queries
+        self.ms = ms
+        self.args = tuple(args)
+        self.data = data
+        self.status = status
+        self.user = user
+
+    @property
+    def label(self) -> str:
+        return f"{self.method.upper()} {self.name}"
+
+
+def route_names(patterns) -> Set[str]:
+    """Names of every route in a URLconf's patterns, following include()"""
+    names = set()
+    for pattern in patterns:
+        if hasattr(pattern, 'url_patterns'):
+            names |= route_names(pattern.url_patterns)
+        elif pattern.name and pattern.name != 'api-root':
+            names.add(pattern.name)
+    return names
+
+
+def measurements() -> List[Dict]:
+    return list(_measurements)
+
+
+def write_report():
+    """Append the measurements taken so far to PERF_BUDGET_REPORT, if set"""
+    path = getattr(settings, 'PERF_BUDGET_REPORT', '')
+    if not path or not _measurements:
+        return
+    try:
+        with open(path, 'a') as report:
+            for measurement in _measurements:
+                report.write(json.dumps(measurement) + '\n')
+        _measurements.clear()
+    except OSError as e:
+        logger.error(f"Error writing performance budget report: {str(e)}")
+
+
+class BudgetTestMixin:
+    """TestCase mixin for asserting query-count and wall-time budgets"""
+
+    def check_budget(self, label: str, captured: List[Dict], elapsed_ms: float, queries: int, ms: float):
+        time_budget = ms * getattr(settings, 'PERF_BUDGET_TIME_FACTOR', 1.0)
+        _measurements.append({
+            'test': self.id(),
+            'label': label,
+            'queries': len(captured),
+            'query_budget': queries,
+            'ms': round(elapsed_ms, 2),
+            'ms_budget': time_budget,
+        })
+        sql = '\n'.join(query['sql'] for query in captured)
+        self.assertLessEqual(
+            len(captured), queries, f"{label} ran {len(captured)} queries, budget is {queries}:\n{sql}"
+        )
+        self.assertLessEqual(
+            elapsed_ms, time_budget, f"{label} took {elapsed_ms:.1f}ms, budget is {time_budget:.0f}ms"
+        )
+
+    @contextmanager
+    def assertWithinBudget(self, label: str, queries: int, ms: float):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            yield context
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        self.check_budget(label, context.captured_queries, elapsed_ms, queries, ms)
+
+    async def assertWithinBudgetAsync(self, label: str, coroutine, queries: int, ms: float):
+        """Await a coroutine under a budget, counting queries on the database thread"""
+        context = CaptureQueriesContext(connection)
+        await sync_to_async(context.__enter__)()
+        started = time.perf_counter()
+        try:
+            result = await coroutine
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            await sync_to_async(context.__exit__)(None, None, None)
+        captured = await sync_to_async(lambda: context.captured_queries)()
+        self.check_budget(label, captured, elapsed_ms, queries, ms)
+        return result
+
+    def request_endpoint(self, client, endpoint: Endpoint):
+        """Send an endpoint's request under its budget; writes are rolled back afterwards"""
+        if endpoint.user:
+            client.force_login(getattr(self, endpoint.user))
+        else:
+            client.logout()
+        url = reverse(endpoint.name, args=[getattr(self, name).pk for name in endpoint.args])
+        send = getattr(client, endpoint.method)
+
+        with transaction.atomic():
+            with self.assertWithinBudget(endpoint.label, endpoint.queries, endpoint.ms):
+                if endpoint.method in ('get', 'delete'):
+                    response = send(url, endpoint.data or {})
+                else:
+                    response = send(url, endpoint.data or {}, format='json')
+                if response.streaming:
+                    # Streamed bodies run their queries while being read
+                    response.streamed_body = b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+
+        if endpoint.status is not None:
+            self.assertEqual(response.status_code, endpoint.status, endpoint.label)
+        else:
+            body = response.streamed_body if response.streaming else response.content
+            self.assertLess(response.status_code, 400, f"{endpoint.label}: {body[:200]}")
+        return response
+
+    def assertRoutesBudgeted(self, patterns, endpoints: Iterable[Endpoint]):
+        """Every named route in the URLconf has at least one declared budget"""
+        missing = route_names(patterns) - {endpoint.name for endpoint in endpoints}
+        self.assertFalse(missing, f"Routes without a performance budget: {sorted(missing)}")
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        write_report()
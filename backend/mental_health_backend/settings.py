@@ -238,9 +238,117 @@ MEM0_API_KEY = os.getenv('MEM0_API_KEY', '')
 VECTOR_DB_TYPE = os.getenv('VECTOR_DB_TYPE', 'chroma')
 VECTOR_DB_PATH = os.getenv('VECTOR_DB_PATH', BASE_DIR / 'vector_db')
 DEFAULT_MODEL = os.getenv('DEFAULT_MODEL', 'gpt-3.5-turbo')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-1.5-flash')
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1')
+GEMINI_API_BASE = os.getenv('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
 DEBUG_AI = os.getenv('DEBUG_AI', 'False').lower() == 'true'
 
+# Prompt assembly limits (tokens are estimated, not exact)
+AI_PROMPT_TOKEN_BUDGET = int(os.getenv('AI_PROMPT_TOKEN_BUDGET', '1200'))
+AI_PROMPT_HISTORY_MESSAGES = int(os.getenv('AI_PROMPT_HISTORY_MESSAGES', '6'))
+
+# LLM routing: the provider with the lowest EWMA latency is tried first and a
+# backup request is hedged once the primary passes its estimated p90 latency
+LLM_REQUEST_TIMEOUT = float(os.getenv('LLM_REQUEST_TIMEOUT', '30'))
+LLM_HEDGING_ENABLED = os.getenv('LLM_HEDGING_ENABLED', 'True').lower() == 'true'
+LLM_HEDGE_DEFAULT_DELAY = float(os.getenv('LLM_HEDGE_DEFAULT_DELAY', '2.0'))
+LLM_HEDGE_MIN_DELAY = float(os.getenv('LLM_HEDGE_MIN_DELAY', '0.05'))
+LLM_MAX_WORKERS = int(os.getenv('LLM_MAX_WORKERS', '8'))
+
+# AI reply scheduler: bounded concurrent generations per process, plus
+# workers reserved for the crisis lane
+AI_SCHEDULER_WORKERS = int(os.getenv('AI_SCHEDULER_WORKERS', '4'))
+AI_SCHEDULER_CRISIS_WORKERS = int(os.getenv('AI_SCHEDULER_CRISIS_WORKERS', '1'))
+# Past this many queued jobs in a lane, replies fall back to templates
+AI_SCHEDULER_MAX_DEPTH = int(os.getenv('AI_SCHEDULER_MAX_DEPTH', '50'))
+
+# Batch AI endpoints for moderation and offline evaluation: at most
+# AI_BATCH_MAX_ITEMS messages per request (AI_BATCH_LLM_MAX_ITEMS with the llm
+# generator), generated on AI_BATCH_WORKERS threads; items unfinished after
+# AI_BATCH_TIMEOUT seconds are reported as timed out
+AI_BATCH_MAX_ITEMS = int(os.getenv('AI_BATCH_MAX_ITEMS', '1000'))
+AI_BATCH_LLM_MAX_ITEMS = int(os.getenv('AI_BATCH_LLM_MAX_ITEMS', '50'))
+AI_BATCH_WORKERS = int(os.getenv('AI_BATCH_WORKERS', '4'))
+AI_BATCH_TIMEOUT = float(os.getenv('AI_BATCH_TIMEOUT', '120'))
+
+# WebSocket rate limits: (tokens per second, burst) per message type, checked
+# per connection and per user; see chat/rate_limit.py for the other types.
+# Sockets exceeding CHAT_RATE_LIMIT_MAX_VIOLATIONS rejected frames in a row are closed.
+CHAT_RATE_LIMITS_CONNECTION = {
+    'chat_message': (float(os.getenv('CHAT_MESSAGE_RATE', '0.5')), int(os.getenv('CHAT_MESSAGE_BURST', '5'))),
+}
+CHAT_RATE_LIMITS_USER = {
+    'chat_message': (float(os.getenv('CHAT_USER_MESSAGE_RATE', '1.0')), int(os.getenv('CHAT_USER_MESSAGE_BURST', '10'))),
+}
+CHAT_RATE_LIMIT_MAX_VIOLATIONS = int(os.getenv('CHAT_RATE_LIMIT_MAX_VIOLATIONS', '20'))
+
+# Crisis alerts: signals from the same user and room within the window update
+# one alert; every N signals raise its severity a level
+CRISIS_ALERT_WINDOW = int(os.getenv('CRISIS_ALERT_WINDOW', '900'))
+CRISIS_ESCALATION_OCCURRENCES = int(os.getenv('CRISIS_ESCALATION_OCCURRENCES', '3'))
+CRISIS_SNAPSHOT_LIMIT = int(os.getenv('CRISIS_SNAPSHOT_LIMIT', '100'))
+
+# Anonymous support sessions: signed session tokens stay valid for this many
+# seconds; compact_anonymous_users purges users idle past the retention period
+CHAT_ANONYMOUS_SESSION_MAX_AGE = int(os.getenv('CHAT_ANONYMOUS_SESSION_MAX_AGE', str(7 * 24 * 3600)))
+CHAT_ANONYMOUS_RETENTION_DAYS = int(os.getenv('CHAT_ANONYMOUS_RETENTION_DAYS', '30'))
+
+# Typing indicators: clients may send a frame per keystroke, but only
+# started/stopped transitions are broadcast, at most once per throttle window
+CHAT_TYPING_DEBOUNCE = float(os.getenv('CHAT_TYPING_DEBOUNCE', '1.0'))
+CHAT_TYPING_THROTTLE = float(os.getenv('CHAT_TYPING_THROTTLE', '2.0'))
+CHAT_TYPING_TIMEOUT = float(os.getenv('CHAT_TYPING_TIMEOUT', '6.0'))
+
+# Resumable sessions: recent message frames kept per room for reconnecting
+# clients (?resume_from=<message id>); older gaps are read from the database
+CHAT_REPLAY_BUFFER_SIZE = int(os.getenv('CHAT_REPLAY_BUFFER_SIZE', '200'))
+CHAT_REPLAY_MAX_MESSAGES = int(os.getenv('CHAT_REPLAY_MAX_MESSAGES', '200'))
+
+# Room history API: cursor pages of at most CHAT_MESSAGE_PAGE_MAX messages; the
+# optional total is a cached count refreshed every CHAT_MESSAGE_COUNT_CACHE_TTL seconds
+CHAT_MESSAGE_PAGE_MAX = int(os.getenv('CHAT_MESSAGE_PAGE_MAX', '100'))
+CHAT_MESSAGE_COUNT_CACHE_TTL = int(os.getenv('CHAT_MESSAGE_COUNT_CACHE_TTL', '300'))
+
+# Full-text search over chat history and journals (chat/search.py): pages of at
+# most CHAT_SEARCH_PAGE_MAX results, and no deeper than CHAT_SEARCH_MAX_PAGE pages
+CHAT_SEARCH_PAGE_MAX = int(os.getenv('CHAT_SEARCH_PAGE_MAX', '50'))
+CHAT_SEARCH_MAX_PAGE = int(os.getenv('CHAT_SEARCH_MAX_PAGE', '20'))
+
+# Account data export (users/export.py): rows are read from the database in
+# chunks of USER_EXPORT_CHUNK_SIZE while the NDJSON streams out
+USER_EXPORT_CHUNK_SIZE = int(os.getenv('USER_EXPORT_CHUNK_SIZE', '2000'))
+
+# Binary WebSocket subprotocol (chat/wire_protocol.py); JSON stays the default.
+# With the +deflate variant, frames of at least CHAT_DEFLATE_MIN_BYTES are compressed;
+# client frames may not inflate beyond CHAT_MAX_FRAME_BYTES
+CHAT_MSGPACK_ENABLED = os.getenv('CHAT_MSGPACK_ENABLED', 'True').lower() == 'true'
+CHAT_DEFLATE_MIN_BYTES = int(os.getenv('CHAT_DEFLATE_MIN_BYTES', '512'))
+CHAT_MAX_FRAME_BYTES = int(os.getenv('CHAT_MAX_FRAME_BYTES', '65536'))
+
+# Presence: 'redis' shares presence across workers, 'memory' is per process,
+# 'auto' follows the channel layer. last_seen is written in batches.
+PRESENCE_BACKEND = os.getenv('PRESENCE_BACKEND', 'auto')
+PRESENCE_REDIS_URL = os.getenv('PRESENCE_REDIS_URL', '')
+PRESENCE_TTL = float(os.getenv('PRESENCE_TTL', '60'))
+PRESENCE_HEARTBEAT_INTERVAL = float(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', '20'))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv('PRESENCE_FLUSH_INTERVAL', '10'))
+
+# Memory API: adds are embedded in the background in batches
+MEMORY_ADD_MAX_BATCH = int(os.getenv('MEMORY_ADD_MAX_BATCH', '100'))
+MEMORY_EMBEDDING_BATCH_SIZE = int(os.getenv('MEMORY_EMBEDDING_BATCH_SIZE', '32'))
+MEMORY_EMBEDDING_QUEUE_SIZE = int(os.getenv('MEMORY_EMBEDDING_QUEUE_SIZE', '10000'))
+MEMORY_SEARCH_MAX_LIMIT = int(os.getenv('MEMORY_SEARCH_MAX_LIMIT', '50'))
+
+# Dashboard recommendations (chat/recommendations.py) are precomputed per user;
+# the knowledge base entry behind each topic is cached for this many seconds
+RECOMMENDATION_KNOWLEDGE_TTL = int(os.getenv('RECOMMENDATION_KNOWLEDGE_TTL', '3600'))
+
+# Performance budget tests (mental_health_backend/perf_budget.py): measurements
+# are appended to PERF_BUDGET_REPORT as JSON lines; time budgets scale by the factor
+PERF_BUDGET_REPORT = os.getenv('PERF_BUDGET_REPORT', '')
+PERF_BUDGET_TIME_FACTOR = float(os.getenv('PERF_BUDGET_TIME_FACTOR', '1.0'))
+
 # Logging configuration
 LOGGING = {
     'version': 1,
@@ -0,0 +1,111 @@
+"""Streaming export of everything stored about a user, as NDJSON.
+
+Each line is one JSON object: a header line, then one line per row tagged
+with its record type. Rows are read with QuerySet.iterator() in chunks of
+USER_EXPORT_CHUNK_SIZE and written out in blocks, optionally gzipped, so
+memory use stays flat however large the account is.
+"""
+import zlib
+from typing import Iterable, Iterator, List, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from chat.memory_models import UserMemory, ConversationMemory
+from chat.models import Message
+from dashboard.models import (
+    MoodEntry, JournalEntry, Goal, Activity, Appointment, MeditationSession
+)
+
+BLOCK_SIZE = 64 * 1024
+
+_encoder = DjangoJSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+
+def export_sources(user) -> List[Tuple[str, QuerySet]]:
+    """Record type and queryset of each kind of row exported for the user"""
+    return [
+        ('message', Message.objects.filter(sender=user)),
+        ('memory', UserMemory.objects.filter(user=user)),
+        ('conversation_memory', ConversationMemory.objects.filter(user=user)),
+        ('mood_entry', MoodEntry.objects.filter(user=user)),
+        ('journal_entry', JournalEntry.objects.filter(user=user)),
+        ('goal', Goal.objects.filter(user=user)),
+        ('activity', Activity.objects.filter(user=user)),
+        ('appointment', Appointment.objects.filter(user=user)),
+        ('meditation_session', MeditationSession.objects.filter(user=user)),
+    ]
+
+
+def _exported_fields(queryset: QuerySet) -> List[str]:
+    # The owning user is implied by the export
+    return [
+        field.attname for field in queryset.model._meta.concrete_fields
+        if field.attname not in ('user_id', 'sender_id')
+    ]
+
+
+def export_lines(user, chunk_size: int = None) -> Iterator[str]:
+    """NDJSON lines for the user's data, one row at a time"""
+    chunk_size = chunk_size or getattr(settings, 'USER_EXPORT_CHUNK_SIZE', 2000)
+    yield _encoder.encode({
+        'type': 'export',
+        'user_id': user.id,
+        'email': user.email,
+        'generated_at': timezone.now(),
+    }) + '\n'
+
+    for record_type, queryset in export_sources(user):
+        rows = queryset.order_by('pk').values(*_exported_fields(queryset))
+        for row in rows.iterator(chunk_size=chunk_size):
+            row['type'] = record_type
+            yield _encoder.encode(row) + '\n'
+
+
+def encode_blocks(lines: Iterable[str], compress: bool = False) -> Iterator[bytes]:
+    """Group lines into blocks of roughly BLOCK_SIZE bytes, gzipped if requested"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    block, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        block.append(data)
+        size += len(data)
+        if size >= BLOCK_SIZE:
+            data = b''.join(block)
+            block, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = b''.join(block)
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+async def aiter_blocks(blocks: Iterator[bytes]):
+    """Serve a blocking block iterator to an ASGI response one block at a time.
+
+    Django consumes synchronous streaming content into a list when serving
+    over ASGI, which would hold the whole export in memory. Each block is
+    instead pulled on the request's database thread, so the iterator's
+    server-side cursor stays on one connection.
+    """
+    sentinel = object()
+    pull = sync_to_async(next, thread_sensitive=True)
+    while True:
+        block = await pull(blocks, sentinel)
+        if block is sentinel:
+            return
+        yield block
+
+
+def export_filename(user, compress: bool) -> str:
+    stamp = timezone.now().strftime('%Y%m%d')
+    return f"heal-hope-export-{user.id}-{stamp}.ndjson" + ('.gz' if compress else '')
+
@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.export import export_lines, encode_blocks
+from users.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Write all of a user's chat, memory and dashboard data as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='Email or id of the user to export')
+        parser.add_argument('--output', '-o', default='-',
+                            help='File to write to (default: stdout)')
+        parser.add_argument('--gzip', action='store_true',
+                            help='Gzip the output')
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='Rows fetched from the database at a time')
+
+    def handle(self, *args, **options):
+        lookup = {'pk': options['user']} if options['user'].isdigit() else {'email': options['user']}
+        try:
+            user = CustomUser.objects.get(**lookup)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No user matching {options['user']}")
+
+        blocks = encode_blocks(export_lines(user, chunk_size=options['chunk_size']), compress=options['gzip'])
+        if options['output'] == '-':
+            for block in blocks:
+                sys.stdout.buffer.write(block)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as output:
+            for block in blocks:
+                output.write(block)
+                written += len(block)
+        self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
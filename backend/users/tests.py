@@ -1,3 +1,118 @@
-from django.test import TestCase
+import gzip
+import json
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from chat.memory_models import UserMemory
+from chat.models import ChatRoom, Message
+from dashboard.models import MoodEntry, JournalEntry
+
+from mental_health_backend.perf_budget import BudgetTestMixin, Endpoint
+from . import urls
+from .export import export_lines, encode_blocks, aiter_blocks
+from .models import CustomUser, UserProfile
+
+SIGNUP = {'email': 'new@example.com', 'password': 'pw-123456', 'firstName': 'New', 'lastName': 'User'}
+
+# Budgets include session and user lookups plus the session save in a savepoint
+ENDPOINTS = [
+    Endpoint('signup', 'post', queries=11, data=SIGNUP, user=None),
+    Endpoint('login', 'post', queries=9, data={'email': 'member@example.com', 'password': 'pw'}, user=None),
+    Endpoint('logout', 'post', queries=4),
+    Endpoint('user_profile', queries=6),
+    Endpoint('auth_status', queries=5),
+    Endpoint('export_data', queries=14),
+]
+
+
+# Hashing cost is not what these budgets measure
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class UserBudgetTests(BudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(
+            username='member@example.com', email='member@example.com', password='pw',
+            first_name='Mem', last_name='Ber'
+        )
+        UserProfile.objects.create(user=cls.user)
+        CustomUser.objects.bulk_create([
+            CustomUser(username=f'user{i}@example.com', email=f'user{i}@example.com')
+            for i in range(500)
+        ])
+
+    def test_every_route_has_a_budget(self):
+        self.assertRoutesBudgeted(urls.urlpatterns, ENDPOINTS)
+
+    def test_endpoints_stay_within_budget(self):
+        client = APIClient()
+        for endpoint in ENDPOINTS:
+            with self.subTest(endpoint.label):
+                self.request_endpoint(client, endpoint)
+
+
+def read_export(data: bytes):
+    if data[:2] == b'\x1f\x8b':
+        data = gzip.decompress(data)
+    return [json.loads(line) for line in data.decode('utf-8').splitlines()]
+
+
+class DataExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='exporter@example.com', email='exporter@example.com')
+        cls.other = CustomUser.objects.create_user(username='other@example.com', email='other@example.com')
+        room = ChatRoom.objects.create(name='export', room_type='peer', created_by=cls.user)
+        Message.objects.bulk_create(
+            [Message(room=room, sender=cls.user, content=f'mine {i} \u2764') for i in range(25)]
+            + [Message(room=room, sender=cls.other, content='theirs')]
+        )
+        UserMemory.objects.create(user=cls.user, memory_type='preference', content='Likes tea', context={'k': 1})
+        MoodEntry.objects.create(user=cls.user, mood='good', score=7)
+        JournalEntry.objects.create(user=cls.user, title='Today', content='Fine', tags=['a'])
+
+    def test_export_contains_only_the_users_rows(self):
+        rows = read_export(b''.join(encode_blocks(export_lines(self.user))))
+        self.assertEqual(rows[0]['type'], 'export')
+        self.assertEqual(rows[0]['user_id'], self.user.id)
+        types = [row['type'] for row in rows[1:]]
+        self.assertEqual(types.count('message'), 25)
+        self.assertEqual(types.count('memory'), 1)
+        self.assertEqual(types.count('journal_entry'), 1)
+        self.assertNotIn('theirs', [row.get('content') for row in rows])
+        self.assertIn('mine 0 \u2764', [row.get('content') for row in rows])
+        self.assertNotIn('sender_id', rows[1])
+
+    def test_rows_are_fetched_in_chunks_with_one_query_per_source(self):
+        with CaptureQueriesContext(connection) as small:
+            small_lines = list(export_lines(self.user, chunk_size=2))
+        with CaptureQueriesContext(connection) as large:
+            large_lines = list(export_lines(self.user, chunk_size=1000))
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertEqual(len(small_lines), len(large_lines))
+
+    def test_endpoint_streams_plain_and_gzip(self):
+        client = APIClient()
+        client.force_login(self.user)
+        plain = client.get(reverse('export_data'))
+        self.assertTrue(plain.streaming)
+        self.assertEqual(plain['Content-Type'], 'application/x-ndjson')
+        plain_rows = read_export(b''.join(plain.streaming_content))
+
+        zipped = client.get(reverse('export_data'), {'compress': 'gzip'})
+        self.assertIn('.ndjson.gz', zipped['Content-Disposition'])
+        body = b''.join(zipped.streaming_content)
+        self.assertEqual(body[:2], b'\x1f\x8b')
+        self.assertEqual(len(read_export(body)), len(plain_rows))
+
+    def test_async_iteration_yields_the_same_blocks(self):
+        async def collect():
+            return [block async for block in aiter_blocks(encode_blocks(export_lines(self.user)))]
+
+        blocks = async_to_sync(collect)()
+        expected = read_export(b''.join(encode_blocks(export_lines(self.user))))
+        self.assertEqual(read_export(b''.join(blocks))[1:], expected[1:])
@@ -11,5 +11,6 @@ urlpatterns = [
     path('auth/login/', views.LoginView.as_view(), name='login'),
     path('auth/logout/', views.LogoutView.as_view(), name='logout'),
     path('auth/profile/', views.user_profile, name='user_profile'),
+    path('auth/export/', views.export_data, name='export_data'),
     path('auth/status/', views.check_auth_status, name='auth_status'),
 ]
@@ -1,10 +1,13 @@
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from django.utils.decorators import method_decorator
 from django.views import View
 from .models import CustomUser, UserProfile
+from .export import export_lines, encode_blocks, aiter_blocks, export_filename
 import json
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -160,6 +163,23 @@ def user_profile(request):
         'user': profile_data
     })
 
+@login_required
+@require_GET
+def export_data(request):
+    """Stream all of the current user's data as NDJSON; ?compress=gzip for a .ndjson.gz"""
+    compress = request.GET.get('compress') == 'gzip'
+    blocks = encode_blocks(export_lines(request.user), compress=compress)
+    if isinstance(request, ASGIRequest):
+        blocks = aiter_blocks(blocks)
+
+    response = StreamingHttpResponse(
+        blocks,
+        content_type='application/gzip' if compress else 'application/x-ndjson'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(request.user, compress)}"'
+    response['Cache-Control'] = 'no-store'
+    return response
+
 def check_auth_status(request):
     """Check if user is authenticated"""
     if request.user.is_authenticated: